@@ -1,20 +1,37 @@
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, urlunparse, urlencode, parse_qs
 from pydantic import BaseModel
-from copy import deepcopy
-import numpy as np
+from typing import get_args, get_origin
+import hashlib
 import json
+import os
+import re
+import zlib
+
+READ_CHUNK_SIZE:int = 1024 * 1024
+FINGERPRINT_VERSION:int = 1
+MANIFEST_HEADER_SIZE:int = 4096 # Bytes read to find the manifest fields stored before the products
 
 #from pydantic_objects import Product
 
 def extract_pages(link_string:str) -> list:
     #Recieves the string formatted acordingly to the header.link attribute from the get requests
-    #and Returns a dataframe with the links for all the pages comprehended in that range
-    extracted_links:list = [splitted[0] for splitted in [_.split(';') for _ in link_string.split(',')]]
-    url_limits:list = [extracted_links[0].split('=')[0].strip('<') + "="] + [int(_.split('=')[1].strip('>')) for _ in extracted_links]
-    urls = [f'{url_limits[0]}{i}' for i in range(url_limits[1],url_limits[2]+1)]
+    #and Returns a list with the links for all the pages comprehended in that range.
+    #The other query parameters of the links (filters, fields, per_page) are kept on every page
+    links:dict = {rel: url for url, rel in re.findall(r'<([^>]*)>;\s*rel="(\w+)"', link_string)}
+    next_url = urlparse(links['next'])
+    params = parse_qs(next_url.query)
+    first_page, last_page = int(params['page'][0]), int(obtain_parameters(links['last'])['page'][0])
+    urls = [urlunparse(next_url._replace(query=urlencode({**params, 'page': page}, doseq=True))) for page in range(first_page, last_page + 1)]
     
     return urls
 
+def shard_id_ranges(lower_id:int, upper_id:int, shards:int) -> list:
+    # Splits the ids after lower_id into [since_id, last_id] ranges of about the same width, up to upper_id
+    # The last range has no end (None), so products created after upper_id was read are fetched as well
+    shards = max(1, min(shards, upper_id - lower_id))
+    bounds = [lower_id + (upper_id - lower_id) * shard // shards for shard in range(shards)]
+    return [[since_id, last_id] for since_id, last_id in zip(bounds, bounds[1:] + [None])]
+
 def obtain_parameters(url:str) -> dict:
     #Recieves a url as string, and extracts it's query parameters 
     parsed_url = urlparse(url)
@@ -40,6 +57,7 @@ def format_attributes(obj:BaseModel, method:str) -> BaseModel|list|str:
 def jsonify(obj, method='FULL'):
     # Recursive function to format the provided object into JSON
     # based on the method provided (PUT, POST, FULL)
+    # Legacy version, which alters the provided object. Superseded by serialize
     new_obj = dict()
 
     if isinstance(obj, list):
@@ -58,37 +76,188 @@ def jsonify(obj, method='FULL'):
     
     return new_obj
 
-def products_are_equal(product_1, product_2) -> bool:
-    #Converts the products to json, to compare them on their appropriate format (PUT, as it's more complete)
-    return deepcopy(product_1).to_json('PUT') == deepcopy(product_2).to_json('PUT')
+def canonical_bytes(json_obj) -> bytes:
+    # Stable UTF-8 encoding of a json object. Keys are sorted so the field order doesn't matter
+    return json.dumps(json_obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
 
-def exclude_missing_variants(obj_read:BaseModel, obj_fetched:BaseModel) -> list[BaseModel]:
-    # Compares the object read from the json, and the one fetched from the API
-    # Returns a list of the objects for the missing variants
-    read_variants = obj_read.variants_list
-    fetched_variants = set(obj_fetched.variants_list)
-    
-    variants_to_exclude = [variant for variant in read_variants if variant not in fetched_variants]
-    excluded_variant_objects = [obj_read.variants_dict[f'{variant}'] for variant in variants_to_exclude]
+def bytes_hash(content:bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
 
-    if len(variants_to_exclude) > 0:
-        obj_read.remove_variants(variants_to_exclude)
+def canonical_hash(json_obj) -> str:
+    # Stable content hash of a json object
+    return bytes_hash(canonical_bytes(json_obj))
 
-    return excluded_variant_objects
+_SERIALIZATION_PLANS:dict = dict()
 
-def clusterize(object_list:list, cluster_limit:int) -> list:
-    #Divide the provided list in evenly distributed clusters according to the provided cluster_limit
-    if not object_list:
-        return []
+def nested_models(annotation) -> list:
+    # Returns the [model class, is_list] pairs for the pydantic models contained in a field annotation
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return [[annotation, False]]
+    found = []
+    for argument in get_args(annotation):
+        for model_class, is_list in nested_models(argument):
+            found.append([model_class, is_list or get_origin(annotation) is list])
+    return found
+
+def serialization_plan(model_class:type[BaseModel], method:str) -> dict:
+    # Returns the exclusion spec for the model class on the provided method (PUT, POST, FULL),
+    # covering every nested model, in the format expected by model_dump(exclude=...)
+    # Built once for every (model class, method) pair from the models' _exclusion_list
+    plan_key = (model_class, method)
+    if plan_key not in _SERIALIZATION_PLANS:
+        exclude = dict()
+        if '_exclusion_list' in model_class.__private_attributes__:
+            exclusion_list:dict = model_class.__private_attributes__['_exclusion_list'].get_default()
+            if method not in exclusion_list:
+                raise ValueError(f'Value {method} is not a valid method for the selected object {model_class.__name__}')
+            exclude = {field: True for field in exclusion_list[method] if field in model_class.model_fields}
+        
+        for field, field_info in model_class.model_fields.items():
+            if field in exclude:
+                continue
+            for nested_class, is_list in nested_models(field_info.annotation):
+                nested_exclude = serialization_plan(nested_class, method)
+                if nested_exclude:
+                    exclude[field] = {'__all__': nested_exclude} if is_list else nested_exclude
+        _SERIALIZATION_PLANS[plan_key] = exclude
     
-    if cluster_limit > len(object_list):
-        cluster_limit = len(object_list)
-    return [list(array) for array in (np.array_split(object_list, int(np.ceil(len(object_list) / cluster_limit))))]
+    return _SERIALIZATION_PLANS[plan_key]
+
+def serialize(obj, method='FULL'):
+    # Formats the provided object into JSON based on the method provided (PUT, POST, FULL)
+    # in a single model_dump pass, following the cached serialization plans. The object is left untouched
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(exclude=serialization_plan(type(obj), method), exclude_none=True)
+    if isinstance(obj, list):
+        return [serialize(item, method) for item in obj]
+    return obj
+
+def project_raw(json_obj, exclude:dict):
+    # Applies a serialization plan to a raw json object (as read from a file or the API), without validating it
+    if isinstance(json_obj, list):
+        return [project_raw(item, exclude) for item in json_obj]
+    if not isinstance(json_obj, dict) or not exclude:
+        return json_obj
+    
+    projected = dict()
+    for key, value in json_obj.items():
+        nested_exclude = exclude.get(key)
+        if nested_exclude is True:
+            continue
+        if isinstance(nested_exclude, dict):
+            value = project_raw(value, nested_exclude.get('__all__', nested_exclude))
+        projected[key] = value
+    return projected
+
+def changed_fields(new_json:dict, old_json:dict) -> dict:
+    # Returns the top level fields of new_json whose values differ from (or are missing in) old_json
+    missing = object()
+    return {key: value for key, value in new_json.items() if old_json.get(key, missing) != value}
+
+def matches_product_filter(product_json:dict, category_id:int|None=None, sku_prefix:str|None=None) -> bool:
+    # Whether a raw product json belongs to the category (when given) and has a variant SKU starting with the prefix (when given)
+    if category_id is not None and not any(category['id'] == category_id for category in product_json.get('categories') or []):
+        return False
+    if sku_prefix is not None and not any((variant.get('sku') or '').startswith(sku_prefix) for variant in product_json.get('variants') or []):
+        return False
+    return True
 
 def save_json_data(filename:str, json_data:dict):
     with open(filename, 'w') as file:
         json.dump(json_data, file) 
 
+def manifest_filename(json_file:str) -> str:
+    return f'{json_file}.manifest.json'
+
+def save_fingerprint_manifest(json_file:str, fingerprints:dict, started_at:str|None=None) -> str:
+    # Stores the product and variant fingerprints (product id -> Product.fingerprint_entry) next to the snapshot file
+    # So they don't need to be computed again when the snapshot is restored.
+    # started_at is when the products started being fetched, used as the starting point of the next delta snapshot
+    # sorted_by_id tells whether the products were stored in id order, following the order they were added to fingerprints.
+    # The products go last, so the rest of the fields can be read without decoding them, see load_manifest_header
+    product_ids = [int(product_id) for product_id in fingerprints]
+    manifest = {
+        'version': FINGERPRINT_VERSION,
+        'snapshot_size': os.path.getsize(json_file),
+        'started_at': started_at,
+        'sorted_by_id': all(previous_id < product_id for previous_id, product_id in zip(product_ids, product_ids[1:])),
+        'products': fingerprints
+    }
+    manifest_file = manifest_filename(json_file)
+    save_json_data(manifest_file, manifest)
+    return manifest_file
+
+def manifest_is_current(json_file:str, manifest:dict) -> bool:
+    # Manifests from another fingerprint version, or written for a different file, are ignored
+    return manifest.get('version') == FINGERPRINT_VERSION and manifest.get('snapshot_size') == os.path.getsize(json_file)
+
+def load_manifest(json_file:str) -> dict:
+    # Returns the manifest of the snapshot file.
+    # Manifests from another fingerprint version, or written for a different or newer file, are ignored
+    manifest_file = manifest_filename(json_file)
+    if not os.path.exists(manifest_file) or os.path.getmtime(manifest_file) < os.path.getmtime(json_file):
+        return dict()
+    
+    with open(manifest_file, 'r') as file:
+        manifest = json.load(file)
+    return manifest if manifest_is_current(json_file, manifest) else dict()
+
+def load_manifest_header(json_file:str) -> dict:
+    # Returns the manifest fields stored before the products (version, snapshot_size, started_at, sorted_by_id)
+    # Only the start of the file is read, so the fingerprints of big snapshots aren't decoded
+    manifest_file = manifest_filename(json_file)
+    if not os.path.exists(manifest_file) or os.path.getmtime(manifest_file) < os.path.getmtime(json_file):
+        return dict()
+    
+    with open(manifest_file, 'r') as file:
+        head = file.read(MANIFEST_HEADER_SIZE)
+    products_start = head.find('"products": ')
+    if products_start == -1:
+        return dict()
+    header = json.loads(head[:products_start].rstrip().removesuffix(',') + '}')
+    return header if manifest_is_current(json_file, header) else dict()
+
+def load_fingerprint_manifest(json_file:str) -> dict:
+    # Returns the product fingerprints stored for the snapshot file, if it has a valid manifest
+    return load_manifest(json_file).get('products', dict())
+
+async def gzip_chunks(chunks):
+    # Compresses an async stream of bytes chunks into a gzip stream, chunk by chunk
+    compressor = zlib.compressobj(wbits=31) # 31 selects the gzip container
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def iter_json_items(filename:str, chunk_size:int=READ_CHUNK_SIZE):
+    # Yields the items of a JSON array file, or of an NDJSON file, one at a time
+    # The file is read in chunks and decoded incrementally, so only the current item needs to fit in memory
+    decoder = json.JSONDecoder()
+    with open(filename, 'r', encoding='utf-8') as file:
+        buffer, position, end_of_file = '', 0, False
+        while True:
+            # Skips whitespace, the array brackets and the separators between items
+            while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+                position += 1
+            if position == len(buffer):
+                if end_of_file:
+                    return
+                buffer, position = file.read(chunk_size), 0
+                end_of_file = not buffer
+                continue
+            
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+                # The item continues on the next chunk
+                chunk = file.read(chunk_size)
+                buffer, position, end_of_file = buffer[position:] + chunk, 0, not chunk
+                continue
+            yield item
+
 if __name__ == '__main__':
     #link_string = '<https://api.tiendanube.com/v1/3734860/products?page=2>; rel="next", <https://api.tiendanube.com/v1/3734860/products?page=10000>; rel="last"'
     #urls = extract_pages(link_string)
@@ -0,0 +1,133 @@
+from datetime import datetime
+from rich.console import Console
+from rich.table import Table
+import argparse
+import asyncio
+import csv
+import os
+import time
+import pandas as pd
+from main import ExecutionManager, SCRIPT_DIR
+from client_pool import ClientPool, CLIENT_POOL
+from request_pool import FairBudget
+
+CONSOLE = Console()
+
+MAX_CONCURRENCY_PER_STORE:int = 10
+MAX_RUNNING_STORES:int = 50
+
+
+class BatchSnapshotManager:
+    """
+    Snapshots several stores concurrently on a single event loop.
+    Every store keeps its own adaptive rate limiter, capped at max_concurrency_per_store, while the requests of
+    all of them share a global budget of max_in_flight requests, handed out round robin between the stores.
+    The budget can't go over the connections of the client pool: requests past them would just wait for a connection,
+    and that wait counts against their timeout. By default it's the whole pool.
+    At most max_running_stores snapshots (and files) are open at the same time, the rest wait for their turn.
+    """
+    def __init__(self, stores:list, max_in_flight:int|None=None, max_concurrency_per_store:int=MAX_CONCURRENCY_PER_STORE,
+                 max_running_stores:int=MAX_RUNNING_STORES, client_pool:ClientPool=CLIENT_POOL) -> None:
+        self._stores:list = [(str(store_id), access_token) for store_id, access_token in stores]
+        self._max_concurrency_per_store:int = max_concurrency_per_store
+        self._max_running_stores:int = max_running_stores
+        self._client_pool:ClientPool = client_pool
+        self._budget:FairBudget = FairBudget(self.in_flight_limit(max_in_flight))
+        self._report:pd.DataFrame = pd.DataFrame()
+
+    @property
+    def stores(self):
+        return self._stores
+
+    def in_flight_limit(self, max_in_flight:int|None) -> int:
+        max_connections = self._client_pool.limits.max_connections
+        if max_connections is None: # The pool has no connection limit
+            return max_in_flight or MAX_CONCURRENCY_PER_STORE * len(self.stores)
+        if max_in_flight and max_in_flight > max_connections:
+            CONSOLE.print(f"[bold yellow]Only {max_connections} requests can be in flight, the connections of the client pool[/bold yellow]")
+        return min(max_in_flight or max_connections, max_connections)
+
+    @property
+    def budget(self):
+        return self._budget
+
+    @property
+    def report(self):
+        return self._report
+
+    async def snapshot_store(self, store_id:str, access_token:str, running_stores:asyncio.Semaphore) -> dict:
+        # Runs a single store snapshot, and returns its report row. Failures are reported instead of raised,
+        # so one store can't abort the batch
+        row = {'store_id': store_id, 'status': 'failed', 'products': 0, 'pages': 0, 'requests': 0, 'throttled': 0, 'retries': 0,
+               'seconds': 0.0, 'products_per_second': 0.0, 'snapshot_file': None, 'error': None}
+
+        def on_progress(phase:str, done:int, total:int) -> None:
+            row['pages'] = done + 1 # Plus the first page, fetched before the rest are known
+
+        async with running_stores:
+            execution_manager = ExecutionManager(store_id, access_token, progress_callback=on_progress,
+                                                 max_concurrency=self._max_concurrency_per_store, request_budget=self.budget,
+                                                 client_pool=self._client_pool)
+            start = time.perf_counter()
+            try:
+                snapshot_file = execution_manager.build_snapshot_filename()
+                async for chunk in execution_manager.iter_snapshot_ndjson(snapshot_file):
+                    row['products'] += chunk.count(b'\n')
+                row['status'], row['snapshot_file'] = 'finished', snapshot_file
+            except Exception as e:
+                row['error'] = f'{type(e).__name__}: {e}'
+            finally:
+                row['seconds'] = round(time.perf_counter() - start, 2)
+                row['requests'] = execution_manager.request_manager.requests_sent
+                run_metrics = execution_manager.metrics.summary()
+                row['throttled'], row['retries'] = run_metrics['throttled'], sum(run_metrics['retries'].values())
+
+        row['products_per_second'] = round(row['products'] / row['seconds'], 1) if row['seconds'] else 0.0
+        return row
+
+    async def run_async(self) -> pd.DataFrame:
+        # Snapshots every store, and returns the report with one row per store
+        CONSOLE.print(f"[bold blue]Snapshotting[/bold blue] [bold green]{len(self.stores)}[/bold green] [bold blue]stores with up to[/bold blue] [bold green]{self.budget.limit}[/bold green] [bold blue]requests in flight[/bold blue]")
+        running_stores = asyncio.Semaphore(self._max_running_stores)
+        rows = await asyncio.gather(*(self.snapshot_store(store_id, access_token, running_stores) for store_id, access_token in self.stores))
+        self._report = pd.DataFrame(rows)
+        self.print_report()
+        return self._report
+
+    def run(self) -> pd.DataFrame:
+        return asyncio.run(self.run_async())
+
+    def print_report(self) -> None:
+        table = Table(title='Batch snapshot')
+        for column in ['store_id', 'status', 'products', 'requests', 'seconds', 'products_per_second', 'error']:
+            table.add_column(column)
+        for row in self.report.itertuples():
+            style = 'green' if row.status == 'finished' else 'red'
+            table.add_row(row.store_id, row.status, str(row.products), str(row.requests), str(row.seconds),
+                          str(row.products_per_second), row.error or '', style=style)
+        CONSOLE.print(table)
+
+        failed = int((self.report['status'] != 'finished').sum())
+        CONSOLE.print(f"[bold green]{len(self.report) - failed} stores finished[/bold green], [bold red]{failed} failed[/bold red]")
+
+    def save_report(self) -> str:
+        report_file = os.path.join(SCRIPT_DIR, f'Batch snapshot {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}.csv')
+        self.report.to_csv(report_file, index=False)
+        return report_file
+
+
+if __name__ == '__main__':
+    # Reads the stores from a csv file with store_id and access_token columns
+    parser = argparse.ArgumentParser(description='Snapshots several stores in one run')
+    parser.add_argument('stores_file')
+    parser.add_argument('--max-in-flight', type=int, default=None, help='Defaults to the connections of the client pool')
+    parser.add_argument('--max-concurrency-per-store', type=int, default=MAX_CONCURRENCY_PER_STORE)
+    parser.add_argument('--max-running-stores', type=int, default=MAX_RUNNING_STORES)
+    args = parser.parse_args()
+
+    with open(args.stores_file, newline='') as file:
+        stores = [(row['store_id'], row['access_token']) for row in csv.DictReader(file)]
+
+    batch_manager = BatchSnapshotManager(stores, args.max_in_flight, args.max_concurrency_per_store, args.max_running_stores)
+    batch_manager.run()
+    CONSOLE.print(f"[bold green]Report saved to {batch_manager.save_report()}[/bold green]")
@@ -0,0 +1,74 @@
+import argparse
+import gc
+import itertools
+import time
+import tracemalloc
+import pandas as pd
+
+from benchmarks.catalog_factory import build_product
+from compact_catalog import CompactCatalog
+from pydantic_objects import PRODUCT_LIST_ADAPTER
+
+# Compares the memory held by the read catalog: the previous dataframe of Product objects against the CompactCatalog
+# Products are generated on the fly, so only the catalog being measured stays in memory
+# Run from the repository root: python -m benchmarks.bench_catalog_memory --products 100000
+
+BATCH_SIZE:int = 5000
+
+
+def iter_products(products_count:int, variants_per_product:int):
+    return (build_product(product_id, variants_per_product) for product_id in range(1, products_count + 1))
+
+def build_object_dataframe(products_json) -> pd.DataFrame:
+    # Previous ExecutionManager.load_json_file result, with the fingerprints the diff computes
+    products_list = []
+    while batch := list(itertools.islice(products_json, BATCH_SIZE)):
+        products_list.extend(PRODUCT_LIST_ADAPTER.validate_python(batch))
+    for product in products_list:
+        product.fingerprint
+    return pd.DataFrame({'read_product_object': products_list})
+
+def measure(build, products_count:int, variants_per_product:int) -> list:
+    # Returns [catalog, bytes still allocated once built, peak bytes while building, seconds]
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    catalog = build(iter_products(products_count, variants_per_product))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return [catalog, current, peak, elapsed]
+
+def mutate(products_json, ratio:float):
+    # Changes the price of the first variant on a share of the products
+    step = int(1 / ratio)
+    for product in products_json:
+        if product['id'] % step == 0:
+            product['variants'][0]['price'] = f"{float(product['variants'][0]['price']) + 1:.2f}"
+        yield product
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Read catalog memory benchmark')
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--variants', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{args.products} products, {args.variants} variants each')
+    results = dict()
+    for name, build in (('Product dataframe', build_object_dataframe), ('CompactCatalog', CompactCatalog.from_json)):
+        catalog, current, peak, elapsed = measure(build, args.products, args.variants)
+        results[name] = current
+        print(f'{name:>17}: {current / 2 ** 20:9.1f} MiB held | {current / args.products / 1024:6.2f} KiB/product | '
+              f'{peak / 2 ** 20:9.1f} MiB peak | built in {elapsed:.2f}s')
+        del catalog
+
+    print(f'CompactCatalog holds x{results["Product dataframe"] / results["CompactCatalog"]:.1f} less memory')
+
+    # Vectorized variant comparison against a catalog with 1% of the prices changed
+    read_catalog = CompactCatalog.from_json(iter_products(args.products, args.variants))
+    fetched_catalog = CompactCatalog.from_json(mutate(iter_products(args.products, args.variants), 0.01))
+    start = time.perf_counter()
+    changes = read_catalog.compare_variants(fetched_catalog)
+    print(f'compare_variants: {len(changes)} changed variants out of {read_catalog.variants_count} in {time.perf_counter() - start:.3f}s')
@@ -0,0 +1,51 @@
+import argparse
+import random
+import time
+
+from benchmarks.catalog_factory import build_catalog
+from diff_engine import build_parallel_action_plan, diff_shard
+
+# Measures how parsing plus diffing scales with the amount of processes
+# Run from the repository root: python -m benchmarks.bench_parallel_diff --sizes 10000 100000 500000 --workers 1 2 4 8
+
+CHANGED_RATIO:float = 0.01
+
+
+def build_fetched_catalog(read_json:list[dict], seed:int=1) -> list[dict]:
+    # Copies the read catalog, changing the stock of a few variants and deleting a few products
+    rng = random.Random(seed)
+    fetched_json = []
+    for product in read_json:
+        roll = rng.random()
+        if roll < CHANGED_RATIO / 2:
+            continue
+        if roll < CHANGED_RATIO:
+            product = {**product, 'variants': [{**product['variants'][0], 'stock': 0}] + product['variants'][1:]}
+        fetched_json.append(product)
+    return fetched_json
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel parse and diff benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--variants', type=int, default=3)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        read_json = build_catalog(size, args.variants)
+        fetched_json = build_fetched_catalog(read_json)
+        baseline = None
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            if workers == 1:
+                changed = len(diff_shard([read_json, fetched_json]))
+            else:
+                plan = build_parallel_action_plan(read_json, fetched_json, workers)
+                changed = int((plan['action'] != 'IGNORE').sum())
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+
+            print(f'{size:>8} products | {workers:>2} workers | {elapsed:8.2f} s | '
+                  f'{size / elapsed:10.0f} products/s | speedup x{baseline / elapsed:.2f} | {changed} actions')
@@ -0,0 +1,49 @@
+from copy import deepcopy
+import argparse
+import gc
+import time
+
+from auxiliary_functions import jsonify
+from benchmarks.catalog_factory import build_catalog
+from pydantic_objects import Product
+
+# Compares the legacy jsonify serialization against the cached serialization plans used by to_json
+# Run from the repository root: python -m benchmarks.bench_serialization --products 5000
+
+METHODS:list = ['FULL', 'PUT', 'POST']
+
+
+def legacy_to_json(product:Product, method:str) -> dict:
+    # Previous Product.to_json behaviour. jsonify alters the nested objects,
+    # so it's handed copies made before the timer starts
+    json_object = jsonify(product, method)
+    return product.tweak(json_object)
+
+def timed(function, products:list, method:str) -> list:
+    # Garbage collection is paused while timing, like timeit does, so both sides are measured the same way
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        results = [function(product, method) for product in products]
+        return [time.perf_counter() - start, results]
+    finally:
+        gc.enable()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serialization benchmark')
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--variants', type=int, default=3)
+    args = parser.parse_args()
+
+    products = [Product(**product) for product in build_catalog(args.products, args.variants)]
+    print(f'{args.products} products, {args.variants} variants each')
+
+    for method in METHODS:
+        legacy_time, legacy_results = timed(legacy_to_json, deepcopy(products), method)
+        plan_time, plan_results = timed(lambda product, method: product.to_json(method), products, method)
+
+        assert legacy_results == plan_results, f'Serialization output differs for method {method}'
+        print(f'{method:>5}: legacy {legacy_time * 1e6 / len(products):8.1f} us/product | '
+              f'plans {plan_time * 1e6 / len(products):8.1f} us/product | speedup x{legacy_time / plan_time:.1f}')
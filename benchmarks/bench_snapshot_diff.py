@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+import time
+
+from auxiliary_functions import save_fingerprint_manifest
+from benchmarks.catalog_factory import build_product
+from snapshot_diff import diff_snapshots
+
+# Measures the offline snapshot diff on synthetic NDJSON snapshots built by catalog_factory. The new snapshot changes,
+# removes and adds a share of the products, and is compared twice: as built, in id order, and shuffled, which is how
+# snapshots fetched from the API are stored (pages are written as they complete), so it has to be sorted externally.
+# The shuffled snapshot gets a manifest saying so, like the ones written by ExecutionManager
+# Run from the repository root: python -m benchmarks.bench_snapshot_diff --products 200000
+
+
+def write_snapshot(snapshot_file:str, products) -> int:
+    with open(snapshot_file, 'w', encoding='utf-8') as file:
+        file.writelines(json.dumps(product) + '\n' for product in products)
+    return os.path.getsize(snapshot_file)
+
+def iter_new_products(products_count:int, variants_per_product:int, ratio:float, rng:random.Random):
+    # Changes the stock of a variant on a share of the products, removes a smaller share, and adds new ones at the end
+    for product_id in range(1, products_count + 1):
+        roll = rng.random()
+        if roll < ratio / 5:
+            continue
+        product = build_product(product_id, variants_per_product)
+        if roll < ratio:
+            product['variants'][0]['stock'] += 1
+        yield product
+    for product_id in range(products_count + 1, products_count + int(products_count * ratio / 5) + 1):
+        yield build_product(product_id, variants_per_product)
+
+def shuffled(products:list, rng:random.Random) -> list:
+    rng.shuffle(products)
+    return products
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline snapshot diff benchmark')
+    parser.add_argument('--products', type=int, default=200000)
+    parser.add_argument('--variants', type=int, default=3)
+    parser.add_argument('--ratio', type=float, default=0.01, help='Share of the products changed on the new snapshot')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as snapshots_dir:
+        old_file, new_file = os.path.join(snapshots_dir, 'old.ndjson'), os.path.join(snapshots_dir, 'new.ndjson')
+        shuffled_file = os.path.join(snapshots_dir, 'shuffled.ndjson')
+        size = write_snapshot(old_file, (build_product(product_id, args.variants) for product_id in range(1, args.products + 1)))
+        write_snapshot(new_file, iter_new_products(args.products, args.variants, args.ratio, random.Random(0)))
+        print(f'{args.products} products, {args.variants} variants each, {size / 2 ** 20:.1f} MiB per snapshot')
+
+        for name, new_snapshot in (('factory built, id order', new_file), ('shuffled, as fetched', None)):
+            if new_snapshot is None: # Shuffled in memory once, outside of the timing
+                products = shuffled(list(iter_new_products(args.products, args.variants, args.ratio, random.Random(0))), random.Random(1))
+                write_snapshot(shuffled_file, products)
+                save_fingerprint_manifest(shuffled_file, {str(product['id']): None for product in products})
+                new_snapshot, products = shuffled_file, None
+            start = time.perf_counter()
+            output_file, summary = diff_snapshots(old_file, new_snapshot, os.path.join(snapshots_dir, f'{name}.diff.ndjson'))
+            elapsed = time.perf_counter() - start
+            print(f'{name:>23}: {elapsed:.2f}s | {2 * size / 2 ** 20 / elapsed:6.1f} MiB/s | {summary["added"]} added, '
+                  f'{summary["removed"]} removed, {summary["changed"]} changed')
+
+    # ru_maxrss is in KiB on Linux. It includes building the shuffled snapshot in memory
+    print(f'Peak resident memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB')
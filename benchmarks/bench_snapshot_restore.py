@@ -0,0 +1,194 @@
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+import numpy as np
+
+import main
+from client_pool import ClientPool
+
+# Measures snapshot, diff and restore end to end against the local mock server (benchmarks/mock_server.py)
+# Reports throughput, p50/p99 request latency and peak RSS, and stores the results in benchmarks/results
+# Every catalog size runs on its own processes, so the peak RSS of one size doesn't leak into the next one
+# Run from the repository root: python -m benchmarks.bench_snapshot_restore --sizes 1000 10000 100000
+
+RESULTS_DIR:str = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results')
+RESULT_PREFIX:str = 'BENCH_RESULT '
+STORE_ID:str = '1'
+MUTATED_RATIO:float = 0.01
+
+
+class TimedClientPool(ClientPool):
+    """
+    Client pool which records the latency of every request, until its body has been read.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.latencies:list = []
+
+    def build_client(self) -> httpx.AsyncClient:
+        client = super().build_client()
+        client.event_hooks['request'].append(self.start_timer)
+        client.event_hooks['response'].append(self.stop_timer)
+        return client
+
+    async def start_timer(self, request:httpx.Request) -> None:
+        request.extensions['started_at'] = time.perf_counter()
+
+    async def stop_timer(self, response:httpx.Response) -> None:
+        await response.aread()
+        self.latencies.append(time.perf_counter() - response.request.extensions['started_at'])
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def phase_result(products:int, elapsed:float, latencies:list|None=None) -> dict:
+    result = {'products': products, 'seconds': round(elapsed, 3), 'products_per_second': round(products / elapsed, 1) if elapsed else None,
+              'requests': 0, 'p50_ms': None, 'p99_ms': None, 'peak_rss_mb': peak_rss_mb()}
+    if latencies:
+        result.update({'requests': len(latencies),
+                       'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+                       'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 2)})
+    return result
+
+async def run_size(base_url:str, work_dir:str) -> dict:
+    # Runs the three phases against a mock server that's already up. Called on the child process
+    main.SCRIPT_DIR = work_dir
+    results = dict()
+    quiet = lambda phase, done, total: None # No progress bars on the benchmarks
+
+    client_pool = TimedClientPool()
+    execution_manager = main.ExecutionManager(STORE_ID, 'token', progress_callback=quiet, base_url=base_url, client_pool=client_pool)
+
+    start = time.perf_counter()
+    snapshot_file = await execution_manager.save_snapshot_stream_async()
+    with open(snapshot_file, 'rb') as file:
+        products = sum(1 for _ in file)
+    results['snapshot'] = phase_result(products, time.perf_counter() - start, client_pool.latencies)
+
+    async with httpx.AsyncClient() as client:
+        await client.post(f'{base_url.removesuffix("/v1")}/_mock/mutate', params={'ratio': MUTATED_RATIO})
+
+    client_pool.latencies = []
+    start = time.perf_counter()
+    await execution_manager.build_fetched_products_json_async()
+    execution_manager.load_json_file(snapshot_file)
+    actions = execution_manager.build_actions_dataframe()
+    results['diff'] = phase_result(products, time.perf_counter() - start, client_pool.latencies)
+    results['diff']['actions'] = len(actions)
+
+    client_pool.latencies = []
+    start = time.perf_counter()
+    await execution_manager.request_manager.restore_products(actions, journal_file=os.path.join(work_dir, 'restore.journal.ndjson'))
+    results['restore'] = phase_result(len(actions), time.perf_counter() - start, client_pool.latencies)
+    return results
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_server(url:str, timeout:float=60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url).is_success:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f'The mock server did not start: {url}')
+
+def benchmark_size(size:int, server_args:list) -> dict:
+    # Starts a mock server with the catalog size, and runs the phases on a separate process
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.mock_server', '--products', str(size), '--port', str(port), *server_args])
+    try:
+        wait_for_server(f'http://127.0.0.1:{port}/')
+        with tempfile.TemporaryDirectory() as work_dir:
+            child = subprocess.run([sys.executable, '-m', 'benchmarks.bench_snapshot_restore', '--run-size',
+                                    '--base-url', f'http://127.0.0.1:{port}/v1', '--work-dir', work_dir],
+                                   capture_output=True, text=True)
+        lines = [line for line in child.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+        if child.returncode != 0 or not lines:
+            raise RuntimeError(f'The benchmark for {size} products failed:\n{child.stderr[-2000:]}')
+        return json.loads(lines[-1].removeprefix(RESULT_PREFIX))
+    finally:
+        server.terminate()
+        server.wait()
+
+def git_commit() -> str|None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save_results(run:dict) -> str:
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_file = os.path.join(RESULTS_DIR, f'snapshot_restore {datetime.now().strftime("%Y-%m-%d %H-%M-%S")}.json')
+    with open(results_file, 'w') as file:
+        json.dump(run, file, indent=2)
+    return results_file
+
+def load_previous_results(exclude:str) -> dict|None:
+    # The most recent stored run, to compare against
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    previous = sorted(name for name in os.listdir(RESULTS_DIR) if name.startswith('snapshot_restore') and os.path.join(RESULTS_DIR, name) != exclude)
+    if not previous:
+        return None
+    with open(os.path.join(RESULTS_DIR, previous[-1])) as file:
+        return json.load(file)
+
+def print_results(run:dict, previous:dict|None) -> None:
+    print(f'{"products":>9} | {"phase":<8} | {"seconds":>8} | {"products/s":>11} | {"requests":>8} | {"p50 ms":>7} | {"p99 ms":>7} | {"peak RSS MB":>11} | vs previous')
+    for size, phases in run['results'].items():
+        for phase, result in phases.items():
+            comparison = ''
+            previous_result = ((previous or {}).get('results', {}).get(size) or {}).get(phase)
+            if previous_result and previous_result['products_per_second'] and result['products_per_second']:
+                comparison = f'x{result["products_per_second"] / previous_result["products_per_second"]:.2f} throughput'
+            print(f'{size:>9} | {phase:<8} | {result["seconds"]:>8} | {result["products_per_second"] or "-":>11} | {result["requests"]:>8} | '
+                  f'{result["p50_ms"] or "-":>7} | {result["p99_ms"] or "-":>7} | {result["peak_rss_mb"]:>11} | {comparison}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Snapshot, diff and restore benchmark against the mock server')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--leak-rate', type=float, default=200.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--run-size', action='store_true', help=argparse.SUPPRESS) # Child process mode
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size:
+        print(RESULT_PREFIX + json.dumps(asyncio.run(run_size(args.base_url, args.work_dir))), flush=True)
+        sys.exit(0)
+
+    server_args = ['--latency', str(args.latency), '--jitter', str(args.jitter), '--leak-rate', str(args.leak_rate), '--error-rate', str(args.error_rate)]
+    run = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'latency': args.latency, 'jitter': args.jitter, 'leak_rate': args.leak_rate, 'error_rate': args.error_rate},
+        'results': {str(size): benchmark_size(size, server_args) for size in args.sizes}
+    }
+    results_file = save_results(run)
+    print_results(run, load_previous_results(results_file))
+    print(f'Results saved to {results_file}')
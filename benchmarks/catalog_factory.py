@@ -0,0 +1,51 @@
+import random
+
+# Builds synthetic product jsons shaped like the ones returned by the products endpoint
+# So the snapshot pipeline can be measured without touching a real store
+
+TIMESTAMP:str = '2024-01-01T00:00:00+0000'
+
+
+def build_language_string(text:str) -> dict:
+    return {'es': text, 'en': f'{text} (en)', 'pt': f'{text} (pt)'}
+
+def build_category(category_id:int) -> dict:
+    return {
+        'id': category_id, 'name': build_language_string(f'Category {category_id}'),
+        'description': build_language_string(''), 'handle': build_language_string(f'category-{category_id}'),
+        'parent': None, 'subcategories': [], 'seo_title': build_language_string(''), 'seo_description': build_language_string(''),
+        'google_shopping_category': None, 'created_at': TIMESTAMP, 'updated_at': TIMESTAMP
+    }
+
+def build_variant(product_id:int, variant_id:int, position:int, rng:random.Random) -> dict:
+    stock = rng.randint(0, 500)
+    return {
+        'id': variant_id, 'image_id': None, 'product_id': product_id, 'position': position,
+        'price': f'{rng.uniform(1, 1000):.2f}', 'compare_at_price': None, 'promotional_price': None,
+        'stock_management': True, 'stock': stock, 'weight': '0.500', 'width': '10.00', 'height': '10.00', 'depth': '10.00',
+        'sku': f'SKU-{product_id}-{position}', 'values': [{'es': f'Value {position}'}], 'barcode': None, 'mpn': None,
+        'age_group': None, 'gender': None, 'created_at': TIMESTAMP, 'updated_at': TIMESTAMP, 'cost': None,
+        'inventory_levels': [{'id': variant_id, 'variant_id': variant_id, 'location_id': '01HLOCATION', 'stock': stock}]
+    }
+
+def build_product(product_id:int, variants_per_product:int=3, rng:random.Random|None=None) -> dict:
+    rng = rng or random.Random(product_id)
+    category_id = rng.randint(1, 50)
+    return {
+        'id': product_id, 'name': build_language_string(f'Product {product_id}'),
+        'description': build_language_string(f'<p>Description for product {product_id}</p>' * 3),
+        'handle': build_language_string(f'product-{product_id}'), 'attributes': [build_language_string('Size')],
+        'published': True, 'free_shipping': False, 'requires_shipping': True,
+        'canonical_url': f'https://store.example/products/product-{product_id}', 'video_url': None,
+        'seo_title': build_language_string(f'Product {product_id}'), 'seo_description': build_language_string(''),
+        'brand': 'Brand', 'created_at': TIMESTAMP, 'updated_at': TIMESTAMP,
+        'variants': [build_variant(product_id, product_id * 100 + position, position, rng) for position in range(1, variants_per_product + 1)],
+        'tags': 'tag-a,tag-b',
+        'images': [{'id': product_id, 'product_id': product_id, 'src': f'https://cdn.example/{product_id}.jpg', 'position': 1,
+                    'alt': [], 'height': 800, 'width': 800, 'thumbnails_generated': 2, 'created_at': TIMESTAMP, 'updated_at': TIMESTAMP}],
+        'categories': [build_category(category_id)]
+    }
+
+def build_catalog(products_count:int, variants_per_product:int=3, seed:int=0) -> list[dict]:
+    rng = random.Random(seed)
+    return [build_product(product_id, variants_per_product, rng) for product_id in range(1, products_count + 1)]
@@ -0,0 +1,255 @@
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request, Response
+import argparse
+import asyncio
+import json
+import random
+import time
+import uvicorn
+
+from benchmarks.catalog_factory import build_category, build_product
+
+# Local stand-in for the Tiendanube products API, serving a synthetic catalog built with catalog_factory
+# Simulates the latency, the leaky bucket rate limit (429s and x-rate-limit-* headers) and random server errors
+# Run from the repository root: python -m benchmarks.mock_server --products 10000 --port 8001
+# And point the managers to it with base_url='http://127.0.0.1:8001/v1'
+
+DEFAULT_PER_PAGE:int = 30
+MAX_PER_PAGE:int = 200
+API_DATE_FORMAT:str = '%Y-%m-%dT%H:%M:%S%z'
+
+
+def api_timestamp() -> str:
+    return datetime.now(timezone.utc).strftime(API_DATE_FORMAT)
+
+def complete_variant(variant_json:dict, product_id:int, variant_id:int, position:int, existing:dict|None=None) -> dict:
+    # Fills the variant fields the API sets itself, which POST and PATCH payloads don't carry
+    existing = existing or {}
+    now = api_timestamp()
+    return {'image_id': None, 'inventory_levels': [], **existing, **variant_json, 'id': variant_id, 'product_id': product_id,
+            'position': existing.get('position', position), 'created_at': existing.get('created_at', now), 'updated_at': now}
+
+
+class MockStore:
+    """
+    Synthetic catalog of a single store. Products are generated on demand from their id,
+    only the ones created or modified through the API are kept in memory.
+    """
+    def __init__(self, products_count:int, variants_per_product:int=3) -> None:
+        self._variants_per_product:int = variants_per_product
+        self._ids:list = list(range(1, products_count + 1)) # Sorted, so pages are simple slices
+        self._modified:dict = dict()
+        self._next_id:int = products_count + 1
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def ids(self):
+        return self._ids
+
+    def exists(self, product_id:int) -> bool:
+        position = bisect_left(self._ids, product_id)
+        return position < len(self._ids) and self._ids[position] == product_id
+
+    def get(self, product_id:int) -> dict|None:
+        if not self.exists(product_id):
+            return None
+        return self._modified.get(product_id) or build_product(product_id, self._variants_per_product)
+
+    def listed_ids(self, since_id:int=0, descending:bool=False) -> list:
+        # Ids of the products after since_id, in the order the list endpoint returns them
+        ids = self._ids[bisect_right(self._ids, since_id):] if since_id else self._ids
+        return ids[::-1] if descending else ids
+
+    def page(self, page:int, per_page:int, since_id:int=0, descending:bool=False) -> list[dict]:
+        return [self.get(product_id) for product_id in self.listed_ids(since_id, descending)[(page - 1) * per_page:page * per_page]]
+
+    def put(self, product_json:dict) -> dict:
+        if not self.exists(product_json['id']):
+            insort(self._ids, product_json['id'])
+        self._modified[product_json['id']] = product_json
+        return product_json
+
+    def create(self, product_json:dict) -> dict:
+        product_id, self._next_id = self._next_id, self._next_id + 1
+        return self.put(self.complete({**product_json, 'id': product_id}))
+
+    def update(self, product_id:int, product_json:dict) -> dict:
+        return self.put(self.complete({**product_json, 'id': product_id}, self.get(product_id)))
+
+    @staticmethod
+    def complete(product_json:dict, existing:dict|None=None) -> dict:
+        # Builds the stored product out of a POST or PUT payload, the way the API does: the payload goes over the existing product,
+        # timestamps, variant ids and positions are set by the server, and category ids are expanded into category objects
+        existing = existing or {}
+        product_id, now = product_json['id'], api_timestamp()
+        existing_variants = {variant['id']: variant for variant in existing.get('variants') or []}
+        variants = [complete_variant(variant, product_id, variant.get('id') or product_id * 100 + position, position, existing_variants.get(variant.get('id')))
+                    for position, variant in enumerate(product_json.get('variants', existing.get('variants')) or [], start=1)]
+        categories = [category if isinstance(category, dict) else build_category(category)
+                      for category in product_json.get('categories', existing.get('categories')) or []]
+        return {'images': [], **existing, **product_json, 'variants': variants, 'categories': categories,
+                'created_at': existing.get('created_at', now), 'updated_at': now}
+
+    def delete(self, product_id:int) -> None:
+        if self.exists(product_id):
+            self._ids.pop(bisect_left(self._ids, product_id))
+        self._modified.pop(product_id, None)
+
+    def mutate(self, ratio:float, seed:int=0) -> dict:
+        # Changes the stock of a variant on a share of the products, and deletes a smaller share of them
+        # So the following diff and restore have something to do
+        rng = random.Random(seed)
+        changed = rng.sample(self._ids, int(len(self._ids) * ratio))
+        deleted = changed[:len(changed) // 4]
+        for product_id in changed[len(deleted):]:
+            product = self.get(product_id)
+            product['variants'][0]['stock'] += 1
+            self.put(product)
+        for product_id in deleted:
+            self.delete(product_id)
+        return {'changed': len(changed) - len(deleted), 'deleted': len(deleted)}
+
+
+class LeakyBucket:
+    """
+    Rate limit shaped like the Tiendanube one: every request fills the bucket by one, and it leaks leak_rate requests per second.
+    """
+    def __init__(self, size:int, leak_rate:float) -> None:
+        self._size:int = size
+        self._leak_rate:float = leak_rate
+        self._level:float = 0.0
+        self._updated_at:float = time.monotonic()
+
+    def take(self) -> list:
+        # Returns [allowed, headers]
+        now = time.monotonic()
+        self._level = max(0.0, self._level - (now - self._updated_at) * self._leak_rate)
+        self._updated_at = now
+        allowed = self._level + 1 <= self._size
+        if allowed:
+            self._level += 1
+        headers = {
+            'x-rate-limit-limit': str(self._size),
+            'x-rate-limit-remaining': str(max(0, int(self._size - self._level))),
+            'x-rate-limit-reset': str(int(1000 * self._level / self._leak_rate)),
+        }
+        return [allowed, headers]
+
+
+def build_mock_app(products_count:int, variants_per_product:int=3, latency:float=0.0, jitter:float=0.0,
+                   bucket_size:int=40, leak_rate:float=200.0, error_rate:float=0.0, seed:int=0) -> FastAPI:
+    # latency and jitter in seconds, error_rate as the share of requests answered with a 503
+    app = FastAPI()
+    app.state.store = MockStore(products_count, variants_per_product)
+    buckets:dict[str, LeakyBucket] = dict()
+    rng = random.Random(seed)
+
+    @app.middleware('http')
+    async def simulate_conditions(request:Request, call_next):
+        if not request.url.path.startswith('/v1/'):
+            return await call_next(request)
+        store_id = request.url.path.split('/')[2]
+        allowed, headers = buckets.setdefault(store_id, LeakyBucket(bucket_size, leak_rate)).take()
+        if latency or jitter:
+            await asyncio.sleep(latency + rng.uniform(0, jitter))
+        if not allowed:
+            return Response(json.dumps({'code': 429, 'message': 'Too Many Requests'}), status_code=429, headers=headers, media_type='application/json')
+        if rng.random() < error_rate:
+            return Response(json.dumps({'code': 503, 'message': 'Service Unavailable'}), status_code=503, headers=headers, media_type='application/json')
+        response = await call_next(request)
+        response.headers.update(headers)
+        return response
+
+    def json_response(content, status_code:int=200, headers:dict|None=None) -> Response:
+        return Response(json.dumps(content), status_code=status_code, headers=headers, media_type='application/json')
+
+    @app.get('/')
+    def health():
+        return {'products': len(app.state.store)}
+
+    @app.get('/v1/{store_id}/products')
+    def list_products(request:Request, store_id:str, page:int=1, per_page:int=DEFAULT_PER_PAGE, fields:str|None=None,
+                      since_id:int=0, sort_by:str|None=None):
+        # Ids are assigned in creation order, so created-at-descending is just the reversed ids
+        store:MockStore = app.state.store
+        per_page = min(per_page, MAX_PER_PAGE)
+        descending = sort_by == 'created-at-descending'
+        total = len(store.listed_ids(since_id))
+        last_page = max(1, -(-total // per_page))
+        if page > last_page or total == 0:
+            return json_response({'code': 404, 'message': 'Last page is 0'}, 404)
+
+        products = store.page(page, per_page, since_id, descending)
+        if fields:
+            products = [{field: product[field] for field in fields.split(',') if field in product} for product in products]
+        headers = {'x-total-count': str(total)}
+        if last_page > page:
+            links = [f'<{request.url.include_query_params(page=number)}>; rel="{rel}"' for number, rel in ((page + 1, 'next'), (last_page, 'last'))]
+            headers['link'] = ', '.join(links)
+        return json_response(products, headers=headers)
+
+    @app.get('/v1/{store_id}/products/{product_id}')
+    def get_product(store_id:str, product_id:int):
+        product = app.state.store.get(product_id)
+        if product is None:
+            return json_response({'code': 404, 'message': 'Not Found'}, 404)
+        return json_response(product)
+
+    @app.post('/v1/{store_id}/products')
+    async def create_product(request:Request, store_id:str):
+        return json_response(app.state.store.create(await request.json()), 201)
+
+    @app.put('/v1/{store_id}/products/{product_id}')
+    async def update_product(request:Request, store_id:str, product_id:int):
+        product = app.state.store.get(product_id)
+        if product is None:
+            return json_response({'code': 404, 'message': 'Not Found'}, 404)
+        return json_response(app.state.store.update(product_id, await request.json()))
+
+    @app.api_route('/v1/{store_id}/products/{product_id}/variants', methods=['PUT', 'PATCH'])
+    async def update_variants(request:Request, store_id:str, product_id:int):
+        product = app.state.store.get(product_id)
+        if product is None:
+            return json_response({'code': 404, 'message': 'Not Found'}, 404)
+        changes = {variant['id']: variant for variant in await request.json()}
+        product['variants'] = [complete_variant(changes[variant['id']], product_id, variant['id'], variant['position'], variant) if variant['id'] in changes else variant
+                               for variant in product['variants']]
+        return json_response(app.state.store.put(product)['variants'])
+
+    @app.post('/v1/{store_id}/products/{product_id}/variants')
+    async def create_variant(request:Request, store_id:str, product_id:int):
+        product = app.state.store.get(product_id)
+        if product is None:
+            return json_response({'code': 404, 'message': 'Not Found'}, 404)
+        position = len(product['variants']) + 1
+        variant_id = max((variant['id'] for variant in product['variants']), default=product_id * 100) + 1 # Never reuses a deleted variant id
+        variant = complete_variant(await request.json(), product_id, variant_id, position)
+        product['variants'].append(variant)
+        app.state.store.put(product)
+        return json_response(variant, 201)
+
+    @app.post('/_mock/mutate')
+    def mutate(ratio:float=0.01, seed:int=0):
+        # Benchmark helper, not part of the real API
+        return app.state.store.mutate(ratio, seed)
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock Tiendanube products API')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--variants', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Random extra seconds, up to this amount')
+    parser.add_argument('--bucket-size', type=int, default=40)
+    parser.add_argument('--leak-rate', type=float, default=200.0, help='Requests per second the rate limit bucket frees')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with a 503')
+    args = parser.parse_args()
+
+    app = build_mock_app(args.products, args.variants, args.latency, args.jitter, args.bucket_size, args.leak_rate, args.error_rate)
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning')
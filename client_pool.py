@@ -0,0 +1,100 @@
+from contextlib import asynccontextmanager
+from importlib.util import find_spec
+from rich.console import Console
+import asyncio
+import httpx
+
+CONSOLE = Console()
+
+MAX_CONNECTIONS:int = 100
+MAX_KEEPALIVE_CONNECTIONS:int = 40
+KEEPALIVE_EXPIRY:float = 30.0
+
+
+class ClientPool:
+    """
+    Long lived httpx client, shared by every RequestManager running on the same event loop,
+    so consecutive fetches and restores reuse warm connections instead of paying the TCP/TLS setup again.
+    Operations running on another event loop (the sync wrappers use asyncio.run) borrow a one-off client instead.
+    Connection reuse is measured through the httpcore trace extension.
+    """
+    def __init__(self, max_connections:int=MAX_CONNECTIONS, max_keepalive_connections:int=MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry:float=KEEPALIVE_EXPIRY, http2:bool=False) -> None:
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                                    keepalive_expiry=keepalive_expiry)
+        self._http2:bool = http2
+        self._client:httpx.AsyncClient|None = None
+        self._loop:asyncio.AbstractEventLoop|None = None
+        self._requests:int = 0
+        self._new_connections:int = 0
+
+    @property
+    def limits(self):
+        return self._limits
+
+    @property
+    def http2(self):
+        return self._http2
+
+    @property
+    def is_open(self) -> bool:
+        return self._client is not None
+
+    def configure(self, max_connections:int=MAX_CONNECTIONS, max_keepalive_connections:int=MAX_KEEPALIVE_CONNECTIONS,
+                  keepalive_expiry:float=KEEPALIVE_EXPIRY, http2:bool=False) -> None:
+        # Changes the settings used by the next open()
+        if self.is_open:
+            raise RuntimeError('The client pool must be closed before being configured')
+        self.__init__(max_connections, max_keepalive_connections, keepalive_expiry, http2)
+
+    def build_client(self) -> httpx.AsyncClient:
+        # HTTP/2 needs the optional h2 package (pip install httpx[http2]), without it the client falls back to HTTP/1.1
+        http2 = self.http2 and find_spec('h2') is not None
+        if self.http2 and not http2:
+            CONSOLE.print(f"[bold yellow]HTTP/2 was requested but the h2 package isn't installed, using HTTP/1.1[/bold yellow]")
+        return httpx.AsyncClient(limits=self.limits, http2=http2, event_hooks={'request': [self.attach_trace]})
+
+    async def attach_trace(self, request:httpx.Request) -> None:
+        # Request event hook. Counts the request, and traces it to detect whether it opened a new connection
+        self._requests += 1
+        request.extensions['trace'] = self.trace
+
+    async def trace(self, event_name:str, info:dict) -> None:
+        if event_name == 'connection.connect_tcp.complete':
+            self._new_connections += 1
+
+    async def open(self) -> None:
+        # Opens the shared client on the running event loop
+        if self.is_open:
+            return
+        self._client = self.build_client()
+        self._loop = asyncio.get_running_loop()
+
+    async def close(self) -> None:
+        if not self.is_open:
+            return
+        client, self._client, self._loop = self._client, None, None
+        await client.aclose()
+
+    @asynccontextmanager
+    async def borrow(self):
+        # Yields the shared client when it's open on the running event loop, otherwise a client only for this operation
+        if self.is_open and self._loop is asyncio.get_running_loop():
+            yield self._client
+            return
+        async with self.build_client() as client:
+            yield client
+
+    def stats(self) -> dict:
+        reused = max(self._requests - self._new_connections, 0)
+        return {
+            'open': self.is_open,
+            'http2': self.http2,
+            'requests': self._requests,
+            'new_connections': self._new_connections,
+            'reused_connections': reused,
+            'reuse_rate': round(reused / self._requests, 4) if self._requests else None
+        }
+
+
+CLIENT_POOL = ClientPool()
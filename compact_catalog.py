@@ -0,0 +1,165 @@
+import itertools
+import json
+import numpy as np
+import pandas as pd
+from pydantic_objects import Product, PRODUCT_LIST_ADAPTER
+
+BUILD_BATCH_SIZE:int = 5000
+PRODUCT_COLUMNS:tuple = ('product_id', 'fingerprint', 'variants_start', 'variants_count', 'raw_offset')
+VARIANT_COLUMNS:tuple = ('variant_id', 'product_id', 'position', 'price', 'promotional_price', 'stock', 'sku', 'updated_at')
+COMPARABLE_FIELDS:tuple = ('price', 'promotional_price', 'stock', 'sku')
+
+
+def parse_prices(values:list) -> np.ndarray:
+    # API prices are decimal strings. Missing ones, and any the Product model lets through but aren't numbers ('' included), become NaN
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+def parse_dates(values:list) -> np.ndarray:
+    return pd.to_datetime(values, format='ISO8601', utc=True, errors='coerce').tz_localize(None).to_numpy().astype('datetime64[s]')
+
+
+class CompactCatalog:
+    """
+    Columnar, in memory catalog of products. The fields the diff works on are kept as flat typed numpy columns:
+        products: product_id, fingerprint, variants_start, variants_count, raw_offset
+        variants: variant_id, product_id, position, price, promotional_price, stock, sku, updated_at
+    while the full product json is kept as compact UTF-8 bytes on a single buffer, and only turned back
+    into a Product for the products that need a request. Variant columns can be compared in bulk, see compare_variants.
+    """
+    def __init__(self, products:dict, variants:dict, raw:bytes) -> None:
+        self._products:dict = products
+        self._variants:dict = variants
+        self._raw:bytes = raw
+        self._sorted_positions:np.ndarray = np.argsort(products['product_id'], kind='stable')
+
+    def __len__(self) -> int:
+        return len(self._products['product_id'])
+
+    @property
+    def product_ids(self):
+        return self._products['product_id']
+
+    @property
+    def variants_count(self) -> int:
+        return len(self._variants['variant_id'])
+
+    @classmethod
+    def from_json(cls, products_json, fingerprints:dict|None=None, batch_size:int=BUILD_BATCH_SIZE):
+        # Builds the catalog from an iterable of product jsons, validating them in bulk batches like parse_json_stream.
+        # Only one batch of Product objects is alive at a time. fingerprints are the snapshot manifest entries, when available
+        fingerprints = fingerprints or dict()
+        products_json = iter(products_json)
+        product_chunks, variant_chunks, raw_chunks = [], [], []
+        raw_size, variants_size = 0, 0
+
+        while batch := list(itertools.islice(products_json, batch_size)):
+            products = PRODUCT_LIST_ADAPTER.validate_python(batch)
+            raw_lines = [json.dumps(product, separators=(',', ':'), ensure_ascii=False).encode('utf-8') for product in batch]
+            variants = [variant for product in products for variant in product.variants]
+            variants_count = np.array([len(product.variants) for product in products], dtype=np.int32)
+            raw_lengths = np.array([len(line) for line in raw_lines], dtype=np.int64)
+
+            product_chunks.append({
+                'product_id': np.array([product.id for product in products], dtype=np.int64),
+                'fingerprint': np.array([(fingerprints.get(str(product.id)) or {}).get('fingerprint') or product.fingerprint
+                                         for product in products], dtype='S32'),
+                'variants_start': variants_size + np.concatenate([[0], np.cumsum(variants_count)[:-1]]).astype(np.int64),
+                'variants_count': variants_count,
+                'raw_offset': raw_size + np.concatenate([[0], np.cumsum(raw_lengths)[:-1]]).astype(np.int64),
+            })
+            variant_chunks.append({
+                'variant_id': np.array([variant.id for variant in variants], dtype=np.int64),
+                'product_id': np.array([variant.product_id for variant in variants], dtype=np.int64),
+                'position': np.array([variant.position for variant in variants], dtype=np.int32),
+                'price': parse_prices([variant.price for variant in variants]),
+                'promotional_price': parse_prices([variant.promotional_price for variant in variants]),
+                'stock': np.array([variant.stock if variant.stock is not None else np.nan for variant in variants], dtype=np.float64), # NaN is infinite stock
+                'sku': np.array([(variant.sku or '').encode('utf-8') for variant in variants], dtype=np.bytes_),
+                'updated_at': parse_dates([variant.updated_at for variant in variants]),
+            })
+            raw_chunks.append(b''.join(raw_lines))
+            raw_size += int(raw_lengths.sum())
+            variants_size += len(variants)
+
+        products = {column: cls.concatenate([chunk[column] for chunk in product_chunks], column) for column in PRODUCT_COLUMNS}
+        variants = {column: cls.concatenate([chunk[column] for chunk in variant_chunks], column) for column in VARIANT_COLUMNS}
+        products['raw_offset'] = np.append(products['raw_offset'], np.int64(raw_size)) # One extra offset, so product i ends where i + 1 starts
+        return cls(products, variants, b''.join(raw_chunks))
+
+    @staticmethod
+    def concatenate(chunks:list, column:str) -> np.ndarray:
+        if chunks:
+            return np.concatenate(chunks)
+        return np.array([], dtype={'fingerprint': 'S32', 'position': np.int32, 'price': np.float64, 'promotional_price': np.float64,
+                                   'stock': np.float64, 'sku': np.bytes_, 'updated_at': 'datetime64[s]'}.get(column, np.int64))
+
+    def position_of(self, product_id:int) -> int|None:
+        # Row of the product on the catalog, found by binary search over the ids
+        sorted_ids = self.product_ids[self._sorted_positions]
+        position = int(np.searchsorted(sorted_ids, product_id))
+        if position == len(sorted_ids) or sorted_ids[position] != product_id:
+            return None
+        return int(self._sorted_positions[position])
+
+    def raw_json(self, position:int) -> bytes:
+        offsets = self._products['raw_offset']
+        return self._raw[offsets[position]:offsets[position + 1]]
+
+    def product_json(self, product_id:int) -> dict|None:
+        position = self.position_of(product_id)
+        return None if position is None else json.loads(self.raw_json(position))
+
+    def product(self, product_id:int) -> Product|None:
+        # Rebuilds the Product object of a single product, reusing its stored fingerprint
+        position = self.position_of(product_id)
+        if position is None:
+            return None
+        product = Product.model_validate_json(self.raw_json(position))
+        product.load_fingerprints({'fingerprint': self._products['fingerprint'][position].decode('ascii'), 'variants': {}})
+        return product
+
+    def iter_json(self):
+        # Yields every product json, in the order they were read
+        for position in range(len(self)):
+            yield json.loads(self.raw_json(position))
+
+    def products_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({column: self._products[column] for column in PRODUCT_COLUMNS if column != 'raw_offset'})
+
+    def variants_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self._variants)
+
+    def frames(self) -> list[pd.DataFrame]:
+        # Same [products, variants] frames as diff_engine.build_catalog_frames, so the catalog plugs into build_action_plan
+        products_df = pd.DataFrame({'product_id': self.product_ids, 'fingerprint': self._products['fingerprint'].astype(str)})
+        variants_df = pd.DataFrame({'product_id': self._variants['product_id'], 'variant_id': self._variants['variant_id']})
+        return [products_df, variants_df]
+
+    def compare_variants(self, other, fields:tuple=COMPARABLE_FIELDS) -> pd.DataFrame:
+        # Vectorized comparison of the variants present on both catalogs, matched by variant id
+        # (to the last copy, when the other catalog lists a product twice).
+        # Returns one row per variant with at least one different field, and a boolean column per compared field
+        other_ids = other._variants['variant_id']
+        other_order = np.argsort(other_ids, kind='stable')
+        positions = np.searchsorted(other_ids[other_order], self._variants['variant_id'], side='right') - 1
+        positions = np.maximum(positions, 0)
+        if len(other_ids):
+            matched = other_ids[other_order][positions] == self._variants['variant_id']
+        else:
+            matched = np.zeros(self.variants_count, dtype=np.bool_)
+        own_rows, other_rows = np.flatnonzero(matched), other_order[positions[matched]]
+
+        changes = pd.DataFrame({'product_id': self._variants['product_id'][own_rows], 'variant_id': self._variants['variant_id'][own_rows]})
+        for field in fields:
+            own_values, other_values = self._variants[field][own_rows], other._variants[field][other_rows]
+            changed = own_values != other_values
+            if own_values.dtype.kind in 'fM': # Missing on both sides (NaN or NaT) isn't a change
+                missing = np.isnan if own_values.dtype.kind == 'f' else np.isnat
+                changed &= ~(missing(own_values) & missing(other_values))
+            changes[field] = changed
+        return changes[changes[list(fields)].any(axis=1)].reset_index(drop=True)
+
+    def memory_usage(self) -> int:
+        # Bytes held by the columns and the raw json buffer
+        columns = itertools.chain(self._products.values(), self._variants.values(), [self._sorted_positions])
+        return sum(column.nbytes for column in columns) + len(self._raw)
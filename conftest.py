@@ -0,0 +1,26 @@
+import httpx
+import pytest
+from benchmarks.mock_server import build_mock_app
+from client_pool import ClientPool
+
+
+class MockClientPool(ClientPool):
+    """
+    Client pool whose clients send the requests straight to a mock server app, without opening a socket.
+    """
+    def __init__(self, app) -> None:
+        super().__init__()
+        self._app = app
+
+    def build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=self._app), event_hooks={'request': [self.attach_trace]})
+
+
+@pytest.fixture
+def mock_api():
+    # Builds a mock server app, and a client pool connected to it: mock_api(products_count, **options) -> [app, client_pool]
+    # Point the managers to it with base_url='http://mock/v1'
+    def build(products_count:int, **options) -> list:
+        app = build_mock_app(products_count, **options)
+        return [app, MockClientPool(app)]
+    return build
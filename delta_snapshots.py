@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta, timezone
+from rich.console import Console
+import argparse
+import json
+import os
+from auxiliary_functions import iter_json_items, load_manifest, save_fingerprint_manifest
+from pydantic_objects import Product
+from snapshot_repository import SnapshotRepository
+from indexed_snapshots import is_indexed, iter_indexed_snapshot
+
+CONSOLE = Console()
+
+DELTA_EXTENSION:str = 'delta.ndjson'
+WATERMARK_MARGIN:timedelta = timedelta(minutes=5) # Covers the clock difference with the API. Products fetched twice are simply overwritten
+API_DATE_FORMAT:str = '%Y-%m-%dT%H:%M:%S%z'
+
+
+class DeltaSnapshot:
+    """
+    Changes of a store catalog since a base snapshot, stored as NDJSON.
+    The base can be a full snapshot or another delta, so deltas form a chain that ends on a full snapshot.
+    Records:
+        {"type": "header", "store_id": ..., "base_snapshot": ..., "updated_at_min": ..., "started_at": ...}
+        {"type": "product", "product": {...}}       Created or updated since updated_at_min
+        {"type": "deleted", "product_ids": [...]}   Products of the base which no longer exist
+    """
+    def __init__(self, delta_file:str) -> None:
+        self._delta_file:str = delta_file
+        self._file = None
+
+    @property
+    def delta_file(self):
+        return self._delta_file
+
+    def __enter__(self):
+        self._file = open(self.delta_file, 'w', encoding='utf-8')
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+        self._file = None
+
+    @staticmethod
+    def is_delta(snapshot_file:str) -> bool:
+        return snapshot_file.endswith(f'.{DELTA_EXTENSION}')
+
+    def append(self, record:dict) -> None:
+        self._file.write(json.dumps(record) + '\n')
+
+    def write_header(self, store_id:str, base_snapshot:str, updated_at_min:str, started_at:str) -> None:
+        # The base is stored relative to the delta, so the chain can be moved around as a whole
+        base_snapshot = os.path.relpath(base_snapshot, os.path.dirname(os.path.abspath(self.delta_file)))
+        self.append({'type': 'header', 'store_id': str(store_id), 'base_snapshot': base_snapshot,
+                     'updated_at_min': updated_at_min, 'started_at': started_at})
+
+    def write_products(self, products_json:list) -> None:
+        self._file.writelines(json.dumps({'type': 'product', 'product': product}) + '\n' for product in products_json)
+
+    def write_deleted(self, product_ids:list) -> None:
+        self.append({'type': 'deleted', 'product_ids': product_ids})
+
+    def load_header(self) -> dict:
+        with open(self.delta_file, 'r', encoding='utf-8') as file:
+            return json.loads(file.readline())
+
+    def iter_records(self):
+        with open(self.delta_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def base_snapshot(self) -> str:
+        return os.path.join(os.path.dirname(os.path.abspath(self.delta_file)), self.load_header()['base_snapshot'])
+
+
+def snapshot_chain(snapshot_file:str) -> list[str]:
+    # Returns the files needed to rebuild the snapshot, from the newest delta back to its full base snapshot
+    chain = [snapshot_file]
+    while DeltaSnapshot.is_delta(chain[-1]):
+        chain.append(DeltaSnapshot(chain[-1]).base_snapshot())
+    return chain
+
+def snapshot_started_at(snapshot_file:str) -> datetime:
+    # When the products of the snapshot started being fetched. Taken from the delta header or the snapshot manifest,
+    # or, for older snapshots without it, from the most recent product update in the file
+    if DeltaSnapshot.is_delta(snapshot_file):
+        return datetime.fromisoformat(DeltaSnapshot(snapshot_file).load_header()['started_at'])
+
+    if SnapshotRepository.is_manifest(snapshot_file):
+        started_at = SnapshotRepository.for_manifest(snapshot_file).load_manifest(snapshot_file).get('started_at')
+    else:
+        started_at = load_manifest(snapshot_file).get('started_at')
+    if started_at:
+        return datetime.fromisoformat(started_at)
+    return max(datetime.strptime(product['updated_at'], API_DATE_FORMAT) for product in iter_full_snapshot(snapshot_file))
+
+def delta_watermark(base_snapshot:str) -> str:
+    # updated_at_min for a delta taken over the base snapshot
+    return (snapshot_started_at(base_snapshot) - WATERMARK_MARGIN).isoformat(timespec='seconds')
+
+def iter_full_snapshot(snapshot_file:str, product_ids:set|None=None):
+    # Yields the products of a full snapshot, stored as a json or NDJSON file, a repository manifest or an indexed snapshot
+    # When product_ids are given only those are returned. Manifests and indexed snapshots only decode the requested ones
+    if SnapshotRepository.is_manifest(snapshot_file):
+        return SnapshotRepository.for_manifest(snapshot_file).iter_products(snapshot_file, product_ids)
+    if is_indexed(snapshot_file):
+        return iter_indexed_snapshot(snapshot_file, product_ids)
+    if product_ids is None:
+        return iter_json_items(snapshot_file)
+    return (product for product in iter_json_items(snapshot_file) if product['id'] in product_ids)
+
+def iter_snapshot_products(snapshot_file:str, product_ids:set|None=None):
+    # Yields the products of the catalog as it was at the snapshot, which can be a full snapshot or a delta.
+    # This is how every snapshot format is read back. Optionally only the requested product ids
+    # The chain is walked from the newest delta back to the base, so only the ids already handled are kept in memory
+    handled_ids = set()
+    for chain_file in snapshot_chain(snapshot_file):
+        if not DeltaSnapshot.is_delta(chain_file):
+            pending_ids = None if product_ids is None else set(product_ids) - handled_ids
+            yield from (product for product in iter_full_snapshot(chain_file, pending_ids) if product['id'] not in handled_ids)
+            return
+
+        deleted_ids, products = set(), []
+        for record in DeltaSnapshot(chain_file).iter_records():
+            match record['type']:
+                case 'product':
+                    products.append(record['product'])
+                case 'deleted':
+                    deleted_ids.update(record['product_ids'])
+        # Deletions are detected after the updates, so they win within the same delta
+        handled_ids.update(deleted_ids)
+        for product in products:
+            if product['id'] not in handled_ids and (product_ids is None or product['id'] in product_ids):
+                handled_ids.add(product['id'])
+                yield product
+
+def rebuild_snapshot(snapshot_file:str, output_file:str|None=None) -> str:
+    # Writes the full point in time catalog of a delta chain as an NDJSON snapshot, along with its manifest
+    output_file = output_file or snapshot_file.removesuffix(f'.{DELTA_EXTENSION}') + ' - Rebuilt.ndjson'
+    fingerprints = dict()
+    with open(output_file, 'w', encoding='utf-8') as file:
+        for product in iter_snapshot_products(snapshot_file):
+            file.write(json.dumps(product) + '\n')
+            fingerprints[str(product['id'])] = Product(**product).fingerprint_entry()
+
+    save_fingerprint_manifest(output_file, fingerprints, snapshot_started_at(snapshot_file).isoformat(timespec='seconds'))
+    CONSOLE.print(f"[bold green]Rebuilt {len(fingerprints)} products from {len(snapshot_chain(snapshot_file))} files: {output_file}[/bold green]")
+    return output_file
+
+def utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuilds the full catalog of a delta snapshot chain')
+    parser.add_argument('delta_file')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    rebuild_snapshot(args.delta_file, args.output)
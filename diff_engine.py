@@ -0,0 +1,103 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import numpy as np
+import pandas as pd
+from pydantic_objects import Product, PRODUCT_LIST_ADAPTER
+
+IGNORE:str = 'IGNORE'
+PUT:str = 'PUT'
+POST:str = 'POST'
+
+
+def latest_copies(products_json:list[dict]) -> list[dict]:
+    # A page offset fetch over a catalog that changes meanwhile can list a product twice. Keeps only the last copy of each product,
+    # in the position of its first one
+    return list({product['id']: product for product in products_json}.values())
+
+def drop_repeated_products(frames:list[pd.DataFrame]) -> list[pd.DataFrame]:
+    # Keeps the last product and variant rows of each id, so every read product matches a single fetched row
+    products_df, variants_df = frames
+    return [products_df.drop_duplicates('product_id', keep='last'), variants_df.drop_duplicates(['product_id', 'variant_id'], keep='last')]
+
+def build_catalog_frames(products:list) -> list[pd.DataFrame]:
+    # Flattens a list of Product objects into the compact frames used by the diff engine:
+    # one row per product (product_id, fingerprint) and one row per variant (product_id, variant_id)
+    products_df = pd.DataFrame({
+        'product_id': np.fromiter((product.id for product in products), dtype=np.int64, count=len(products)),
+        'fingerprint': [product.fingerprint for product in products],
+    })
+    variant_pairs = [(product.id, variant.id) for product in products for variant in product.variants]
+    variants_df = pd.DataFrame(variant_pairs, columns=['product_id', 'variant_id'], dtype=np.int64)
+
+    return [products_df, variants_df]
+
+def build_raw_catalog_frames(products_json:list[dict]) -> list[pd.DataFrame]:
+    # Same frames as build_catalog_frames, built from unvalidated product jsons with their raw fingerprints
+    products_df = pd.DataFrame({
+        'product_id': np.fromiter((product['id'] for product in products_json), dtype=np.int64, count=len(products_json)),
+        'fingerprint': [Product.raw_fingerprint(product) for product in products_json],
+    })
+    variant_pairs = [(product['id'], variant['id']) for product in products_json for variant in product['variants']]
+    variants_df = pd.DataFrame(variant_pairs, columns=['product_id', 'variant_id'], dtype=np.int64)
+
+    return [products_df, variants_df]
+
+def build_action_plan(read_frames:list[pd.DataFrame], fetched_frames:list[pd.DataFrame]) -> pd.DataFrame:
+    # Compares the read catalog against the fetched one in bulk, using hash joins on the ids
+    # Returns the action plan: one row per read product with its action (IGNORE, PUT, POST)
+    # and the ids of the read variants which no longer exist on the fetched product
+    read_products, read_variants = read_frames
+    fetched_products, fetched_variants = drop_repeated_products(fetched_frames)
+
+    plan = read_products.merge(fetched_products, on='product_id', how='left', suffixes=('_read', '_fetched'))
+    plan['action'] = np.select(
+        [plan['fingerprint_fetched'].isna(),                            # Product doesn't exist currently, so it was deleted
+         plan['fingerprint_read'].to_numpy() != plan['fingerprint_fetched'].to_numpy()], # Changes were made to the product
+        [POST, PUT],
+        default=IGNORE
+    )
+
+    # Variants of the products that still exist, which are missing from the fetched catalog
+    changed_ids = plan.loc[plan['action'] == PUT, 'product_id']
+    candidate_variants = read_variants[read_variants['product_id'].isin(changed_ids)]
+    missing = candidate_variants.merge(fetched_variants, on=['product_id', 'variant_id'], how='left', indicator=True)
+    missing = missing[missing['_merge'] == 'left_only']
+    missing_by_product = missing.groupby('product_id')['variant_id'].agg(list)
+
+    plan['missing_variant_ids'] = plan['product_id'].map(missing_by_product)
+    plan['missing_variant_ids'] = [ids if isinstance(ids, list) else [] for ids in plan['missing_variant_ids']]
+
+    return plan[['product_id', 'action', 'missing_variant_ids']]
+
+def diff_shard(shard:list[list[dict]]) -> list[tuple]:
+    # Process pool worker. Parses and diffs one shard of [read products json, fetched products json]
+    # Returns only the compact records (product_id, action, missing_variant_ids) of the products which need an action,
+    # so no Product objects travel back to the main process
+    read_json, fetched_json = shard
+    read_products = PRODUCT_LIST_ADAPTER.validate_python(read_json)
+    fetched_products = PRODUCT_LIST_ADAPTER.validate_python(latest_copies(fetched_json)) # Copies of a product always land on the same shard
+
+    plan = build_action_plan(build_catalog_frames(read_products), build_catalog_frames(fetched_products))
+    plan = plan[plan['action'] != IGNORE]
+    return list(zip(plan['product_id'].tolist(), plan['action'], plan['missing_variant_ids']))
+
+def build_parallel_action_plan(read_json:list[dict], fetched_json:list[dict], workers:int) -> pd.DataFrame:
+    # Splits both catalogs into shards by product id, and parses and diffs every shard on a process pool
+    # Returns the same action plan as build_action_plan
+    shards = [[[], []] for _ in range(workers)]
+    for product in read_json:
+        shards[product['id'] % workers][0].append(product)
+    for product in fetched_json:
+        shards[product['id'] % workers][1].append(product)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        records = list(itertools.chain.from_iterable(executor.map(diff_shard, shards)))
+
+    plan = pd.DataFrame({'product_id': np.fromiter((product['id'] for product in read_json), dtype=np.int64, count=len(read_json))})
+    changes = pd.DataFrame(records, columns=['product_id', 'action', 'missing_variant_ids']).astype({'product_id': np.int64})
+    changes = changes.drop_duplicates('product_id', keep='last') # A product read twice gets the same record twice
+    plan = plan.merge(changes, on='product_id', how='left')
+    plan['action'] = plan['action'].fillna(IGNORE)
+    plan['missing_variant_ids'] = [ids if isinstance(ids, list) else [] for ids in plan['missing_variant_ids']]
+
+    return plan
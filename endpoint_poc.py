@@ -1,49 +1,272 @@
 import time 
-from fastapi import FastAPI, UploadFile 
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Query, UploadFile 
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import HTTPException 
-from fastapi.responses import FileResponse 
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse 
+from pydantic import BaseModel
 import uvicorn 
-import json 
 import os 
+import shutil
+import struct
+import zlib
 from main import ExecutionManager
-from auxiliary_functions import save_json_data
+from client_pool import CLIENT_POOL
+from metrics import METRICS
+from batch_snapshot import BatchSnapshotManager, MAX_CONCURRENCY_PER_STORE
+from auxiliary_functions import gzip_chunks, READ_CHUNK_SIZE
+from jobs import Job, JobManager, TooManyJobsError, FINISHED
+from snapshot_diff import diff_snapshots
 
-app = FastAPI() 
+JOBS = JobManager()
+
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    # Every request made while the app runs borrows its connections from the shared client pool
+    await CLIENT_POOL.open()
+    yield
+    await JOBS.shutdown()
+    await CLIENT_POOL.close()
+
+app = FastAPI(lifespan=lifespan) 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__)) 
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads") 
 timestr = time.strftime("%Y%m%d-%H%M%S") 
+UPLOAD_CONTENT_TYPES = ("application/json", "application/x-ndjson", "application/octet-stream") # octet-stream for indexed snapshots
+# What reading a malformed snapshot can raise: bad json or text (JSONDecodeError and UnicodeDecodeError are ValueErrors), products that
+# aren't objects or have no id, damaged compression or index of indexed snapshots, and missing base snapshots or repository objects
+SNAPSHOT_DECODE_ERRORS:tuple = (ValueError, KeyError, TypeError, zlib.error, struct.error, OSError)
+
+class StoreCredentials(BaseModel):
+    store_id:str
+    access_token:str
+
+def store_upload(file:UploadFile, prefix:str='') -> str:
+    # Copies the uploaded snapshot to the uploads folder in chunks and returns its path
+    # It isn't parsed here, load_json_file decodes it incrementally from disk
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    uploaded_file = os.path.join(UPLOAD_DIR, f'{prefix}{os.path.basename(file.filename)}')
+    with open(uploaded_file, 'wb') as destination:
+        shutil.copyfileobj(file.file, destination, READ_CHUNK_SIZE)
+    return uploaded_file
+
+def summarize_restore(execution_manager:ExecutionManager) -> dict:
+    # Counts of the executed requests by action and status, kept while the restore ran. The details are on the journal
+    summary = execution_manager.request_manager.restore_summary
+    if summary is None: # Nothing needed to be restored
+        return {'products': 0, 'failed_products': 0, 'operations': 0, 'by_action': {}}
+    return summary.to_dict()
+
+def is_targeted(product_ids:list|None, category_id:int|None, sku_prefix:str|None) -> bool:
+    return bool(product_ids) or category_id is not None or sku_prefix is not None
+
+def submit_job(kind:str, store_id:str, work, store_ids:list|None=None) -> dict:
+    try:
+        job = JOBS.submit(kind, store_id, work, store_ids)
+    except TooManyJobsError as e:
+        raise HTTPException(429, detail=str(e))
+    return {'job_id': job.id, 'status': job.status}
+
+def get_job(job_id:str) -> Job:
+    job = JOBS.get(job_id)
+    if job is None:
+        raise HTTPException(404, detail="Job not found")
+    return job
 
 @app.get("/") 
 def read_root(): 
     return {"Hello": "FastAPI"} 
 
 @app.post("/restore") 
-def upload_file(file: UploadFile, store_id:str, access_token:str): 
-    if file.content_type != "application/json": 
+async def upload_file(file: UploadFile, store_id:str, access_token:str, lazy:bool=False, diff_workers:int=1,
+                      product_ids:list[int]|None=Query(None), category_id:int|None=None, sku_prefix:str|None=None): 
+    # Runs on the server event loop, so fetching and restoring share the warm connections of the client pool
+    # With product_ids, category_id or sku_prefix only the matching products of the snapshot are fetched and restored
+    if file.content_type not in UPLOAD_CONTENT_TYPES: 
         raise HTTPException(400, detail="Invalid document type") 
     else: 
-        os.makedirs(UPLOAD_DIR, exist_ok=True)
-        uploaded_file = os.path.join(UPLOAD_DIR, file.filename)
-        data = json.loads(file.file.read())
-        save_json_data(uploaded_file, data)
+        uploaded_file = await run_in_threadpool(store_upload, file)
         
-        execution_manager = ExecutionManager(store_id, access_token)
-        execution_manager.build_fetched_products_json()
-        execution_manager.load_json_file(uploaded_file)
-        
-        results = execution_manager.execute_snapshot_restore()
+        execution_manager = ExecutionManager(store_id, access_token, diff_workers=diff_workers)
+        if is_targeted(product_ids, category_id, sku_prefix):
+            await execution_manager.execute_targeted_restore_async(uploaded_file, set(product_ids) if product_ids else None, category_id, sku_prefix,
+                                                                   lazy, executor=JOBS.executor)
+        else:
+            await execution_manager.build_fetched_products_json_async()
+            await run_in_threadpool(execution_manager.load_json_file, uploaded_file, lazy)
+            await execution_manager.execute_snapshot_restore_async(executor=JOBS.executor)
     
     #return {"content": data, "filename": file.filename} 
 
 @app.post("/snapshot") 
-def create_snapshot(store_id:str, access_token:str): 
-    execution_manager = ExecutionManager(store_id, access_token)
-    execution_manager.build_fetched_products_json()
-    json_file = execution_manager.save_json()
+async def create_snapshot(store_id:str, access_token:str, format:str='json', stream:bool=False, gzip:bool=False, save_copy:bool=False,
+                          sharded:bool=False): 
+    execution_manager = ExecutionManager(store_id, access_token, sharded_fetch=sharded)
+    if stream: # NDJSON bytes are sent as each page is fetched, optionally compressed and copied to disk in the same pass
+        chunks = execution_manager.iter_snapshot_ndjson(execution_manager.build_snapshot_filename() if save_copy else None)
+        filename = f'{store_id} - Snapshot {time.strftime("%Y-%m-%d %H:%M:%S")}.ndjson'
+        if gzip:
+            chunks, filename, media_type = gzip_chunks(chunks), f'{filename}.gz', "application/gzip"
+        else:
+            media_type = "application/x-ndjson"
+        return StreamingResponse(chunks, media_type=media_type, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    elif format not in ('json', 'ndjson', 'repository', 'indexed'):
+        raise HTTPException(400, detail="Invalid snapshot format. Use json, ndjson, repository or indexed")
+    
+    try:
+        if format == 'ndjson': # Pages are written as they arrive, so large catalogs never sit in memory
+            json_file = await execution_manager.save_snapshot_stream_async()
+            media_type = "application/x-ndjson"
+        elif format == 'repository': # Only the changed products are stored, the manifest of the snapshot is returned
+            json_file = await execution_manager.save_repository_snapshot_async()
+            media_type = "application/json"
+        elif format == 'indexed': # Compressed, and readable by product id without decoding the whole file
+            json_file = await execution_manager.save_indexed_snapshot_async()
+            media_type = "application/octet-stream"
+        else:
+            await execution_manager.build_fetched_products_json_async()
+            json_file = await run_in_threadpool(execution_manager.save_json)
+            media_type = "application/json"
+    except Exception as e:
+        raise HTTPException(502, detail=f"The snapshot could not be generated: {e}")
+    
+    if not json_file:
+        raise HTTPException(502, detail="The snapshot could not be generated")
+    return FileResponse( path=json_file, media_type=media_type, filename=os.path.basename(json_file), ) 
+
+@app.post("/snapshot-diff") 
+async def compare_snapshots(old_snapshot:UploadFile, new_snapshot:UploadFile): 
+    # Compares two snapshot files without touching the API. Returns the added, removed and changed products as NDJSON
+    if old_snapshot.content_type not in UPLOAD_CONTENT_TYPES or new_snapshot.content_type not in UPLOAD_CONTENT_TYPES:
+        raise HTTPException(400, detail="Invalid document type")
+    prefix = f'{time.strftime("%Y%m%d-%H%M%S")} - '
+    old_file = await run_in_threadpool(store_upload, old_snapshot, f'{prefix}old - ')
+    new_file = await run_in_threadpool(store_upload, new_snapshot, f'{prefix}new - ')
+    try:
+        diff_file, summary = await run_in_threadpool(diff_snapshots, old_file, new_file)
+    except SNAPSHOT_DECODE_ERRORS as e:
+        raise HTTPException(400, detail=f"The snapshots could not be compared: {type(e).__name__}: {e}")
+    return FileResponse(path=diff_file, media_type="application/x-ndjson", filename=os.path.basename(diff_file)) 
+
+@app.get("/connections") 
+async def connection_stats(): 
+    # Requests made through the shared client pool, and how many of them reused an open connection
+    return CLIENT_POOL.stats()
+
+@app.get("/metrics") 
+async def metrics(): 
+    # Request latencies, throttling, retries, bytes and phase timings of every run since the server started, for Prometheus to scrape
+    return PlainTextResponse(METRICS.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.post("/jobs/snapshot") 
+async def create_snapshot_job(store_id:str, access_token:str, sharded:bool=False): 
+    # Starts an NDJSON snapshot in the background. Its file is downloaded from /jobs/{job_id}/result
+    async def work(job:Job) -> None:
+        execution_manager = ExecutionManager(store_id, access_token, progress_callback=job.update_progress, sharded_fetch=sharded)
+        try:
+            job.result_file = await execution_manager.save_snapshot_stream_async()
+        finally:
+            job.summary = {'metrics': execution_manager.metrics.summary()}
     
-    return FileResponse( path=json_file, media_type="application/json", filename=os.path.basename(json_file), ) 
+    return submit_job('snapshot', store_id, work)
+
+@app.post("/jobs/delta-snapshot") 
+async def create_delta_snapshot_job(store_id:str, access_token:str, base_job_id:str): 
+    # Snapshots only the changes since the result of a previous snapshot or delta snapshot job
+    base_job = get_job(base_job_id)
+    if base_job.kind not in ('snapshot', 'delta-snapshot') or base_job.status != FINISHED or base_job.store_id != str(store_id):
+        raise HTTPException(400, detail="The base job must be a finished snapshot of the same store")
+
+    async def work(job:Job) -> None:
+        execution_manager = ExecutionManager(store_id, access_token, progress_callback=job.update_progress)
+        try:
+            job.result_file = await execution_manager.save_delta_snapshot_async(base_job.result_file)
+        finally:
+            job.summary = {'metrics': execution_manager.metrics.summary()}
+    
+    return submit_job('delta-snapshot', store_id, work)
+
+@app.post("/jobs/batch-snapshot") 
+async def create_batch_snapshot_job(stores:list[StoreCredentials], max_in_flight:int|None=None, max_concurrency_per_store:int=MAX_CONCURRENCY_PER_STORE): 
+    # Snapshots several stores in one job. Its result is the per store report, and each store gets its own NDJSON snapshot
+    async def work(job:Job) -> None:
+        batch_manager = BatchSnapshotManager([(store.store_id, store.access_token) for store in stores], max_in_flight, max_concurrency_per_store)
+        job.update_progress('Snapshotting stores', 0, len(stores))
+        report = await batch_manager.run_async()
+        job.update_progress('Snapshotting stores', len(report), len(stores))
+        job.summary = {'finished': int((report['status'] == 'finished').sum()), 'failed': int((report['status'] != 'finished').sum())}
+        job.result_file = await run_in_threadpool(batch_manager.save_report)
+    
+    # Waits for a slot of every store in the batch, like a job on each of them would
+    return submit_job('batch-snapshot', 'batch', work, [store.store_id for store in stores])
+
+@app.post("/jobs/restore") 
+async def create_restore_job(file: UploadFile, store_id:str, access_token:str, lazy:bool=False, diff_workers:int=1,
+                             product_ids:list[int]|None=Query(None), category_id:int|None=None, sku_prefix:str|None=None): 
+    # Starts a restore in the background. Its result is the restore journal
+    if file.content_type not in UPLOAD_CONTENT_TYPES: 
+        raise HTTPException(400, detail="Invalid document type") 
+    uploaded_file = await run_in_threadpool(store_upload, file, f'{time.strftime("%Y%m%d-%H%M%S")} - ')
+
+    async def work(job:Job) -> None:
+        execution_manager = ExecutionManager(store_id, access_token, diff_workers=diff_workers, progress_callback=job.update_progress)
+        try:
+            if is_targeted(product_ids, category_id, sku_prefix):
+                job.update_progress('Reading snapshot', 0, 0)
+                await execution_manager.execute_targeted_restore_async(uploaded_file, set(product_ids) if product_ids else None, category_id, sku_prefix,
+                                                                       lazy, executor=JOBS.executor)
+            else:
+                await execution_manager.build_fetched_products_json_async()
+                job.update_progress('Reading snapshot', 0, 0)
+                await execution_manager.run_cpu_bound(JOBS.executor, execution_manager.load_json_file, uploaded_file, lazy)
+                await execution_manager.execute_snapshot_restore_async(executor=JOBS.executor)
+        finally:
+            job.journal_file = job.result_file = execution_manager.last_journal_file
+            job.summary = {'metrics': execution_manager.metrics.summary()}
+        job.summary = {**summarize_restore(execution_manager), **job.summary}
+    
+    return submit_job('restore', store_id, work)
+
+@app.post("/jobs/{job_id}/resume") 
+async def resume_restore_job(job_id:str, access_token:str, failed_only:bool=False): 
+    # Resumes an interrupted or failed restore job from its journal, as a new job
+    # With failed_only, only the steps that failed are replayed
+    previous_job = get_job(job_id)
+    if previous_job.journal_file is None:
+        raise HTTPException(400, detail="The job has no restore journal to resume from")
+    if previous_job.is_active:
+        raise HTTPException(409, detail="The job is still running")
+
+    async def work(job:Job) -> None:
+        execution_manager = ExecutionManager(previous_job.store_id, access_token, progress_callback=job.update_progress)
+        job.journal_file = job.result_file = previous_job.journal_file
+        try:
+            await execution_manager.resume_snapshot_restore_async(previous_job.journal_file, failed_only)
+        finally:
+            job.summary = {'metrics': execution_manager.metrics.summary()}
+        job.summary = {**summarize_restore(execution_manager), **job.summary}
+    
+    return submit_job('resume', previous_job.store_id, work)
+
+@app.get("/jobs") 
+async def list_jobs(store_id:str|None=None): 
+    return [job.to_dict() for job in JOBS.list(store_id)]
+
+@app.get("/jobs/{job_id}") 
+async def job_status(job_id:str): 
+    return get_job(job_id).to_dict()
 
+@app.get("/jobs/{job_id}/progress") 
+async def job_progress(job_id:str): 
+    return get_job(job_id).progress()
 
+@app.get("/jobs/{job_id}/result") 
+async def job_result(job_id:str): 
+    job = get_job(job_id)
+    if job.status != FINISHED or job.result_file is None:
+        raise HTTPException(409, detail=f"The job has no result available, its status is {job.status}")
+    media_type = "text/csv" if job.result_file.endswith('.csv') else "application/x-ndjson"
+    return FileResponse( path=job.result_file, media_type=media_type, filename=os.path.basename(job.result_file), ) 
 
 
 if __name__ == "__main__": 
@@ -0,0 +1,205 @@
+from array import array
+from bisect import bisect_left
+from rich.console import Console
+import argparse
+import json
+import mmap
+import os
+import struct
+import zlib
+
+CONSOLE = Console()
+
+INDEXED_EXTENSION:str = 'isnap'
+MAGIC:bytes = b'SNAPIDX1'
+FOOTER = struct.Struct('<QQ8s')  # index offset, index length, magic
+CHUNK_PRODUCTS:int = 256
+COMPRESSION_LEVEL:int = 6
+
+
+class IndexedSnapshotWriter:
+    """
+    Writes an indexed snapshot: products stored as zlib compressed chunks of NDJSON lines,
+    followed by an index with the position of every product and a fixed size footer pointing to the index.
+        MAGIC | chunk | chunk | ... | index | footer
+    The index is compressed as well, and holds the chunk offsets and, sorted by product id,
+    the chunk of every product along with where its line starts and ends once the chunk is decompressed.
+    """
+    def __init__(self, snapshot_file:str, chunk_products:int=CHUNK_PRODUCTS) -> None:
+        self._snapshot_file:str = snapshot_file
+        self._chunk_products:int = chunk_products
+        self._file = None
+        self._pending:list = []
+        self._chunks:list = []       # [offset, compressed length] of each chunk
+        self._positions:list = []    # [product_id, chunk, start, end] of each product
+        self._products_count:int = 0
+
+    @property
+    def snapshot_file(self):
+        return self._snapshot_file
+
+    @property
+    def products_count(self):
+        return self._products_count
+
+    def __enter__(self):
+        self._file = open(self.snapshot_file, 'wb')
+        self._file.write(MAGIC)
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.flush_chunk()
+            self.write_index()
+        self._file.close()
+        self._file = None
+
+    def write_products(self, products_json:list) -> None:
+        for product in products_json:
+            self._pending.append(product)
+            if len(self._pending) >= self._chunk_products:
+                self.flush_chunk()
+        self._products_count += len(products_json)
+
+    def flush_chunk(self) -> None:
+        if not self._pending:
+            return
+        lines, start = [], 0
+        for product in self._pending:
+            line = (json.dumps(product) + '\n').encode('utf-8')
+            self._positions.append([product['id'], len(self._chunks), start, start + len(line)])
+            lines.append(line)
+            start += len(line)
+
+        compressed = zlib.compress(b''.join(lines), COMPRESSION_LEVEL)
+        self._chunks.append([self._file.tell(), len(compressed)])
+        self._file.write(compressed)
+        self._pending = []
+
+    def write_index(self) -> None:
+        self._positions.sort()
+        index = {
+            'chunks': self._chunks,
+            'product_ids': [position[0] for position in self._positions],
+            'positions': [position[1:] for position in self._positions]
+        }
+        index_bytes = zlib.compress(json.dumps(index, separators=(',', ':')).encode('utf-8'), COMPRESSION_LEVEL)
+        index_offset = self._file.tell()
+        self._file.write(index_bytes)
+        self._file.write(FOOTER.pack(index_offset, len(index_bytes), MAGIC))
+
+
+class IndexedSnapshotReader:
+    """
+    Memory maps an indexed snapshot. Single products are found through the index and only their chunk is decompressed,
+    while iterating goes through the whole file one chunk at a time.
+    """
+    def __init__(self, snapshot_file:str) -> None:
+        self._snapshot_file:str = snapshot_file
+        self._file = None
+        self._map = None
+        self._chunks:list = []
+        self._product_ids = array('q')
+        self._positions:list = []
+        self._cached_chunk:list = [None, None] # [chunk number, decompressed bytes] of the last chunk read
+
+    @property
+    def snapshot_file(self):
+        return self._snapshot_file
+
+    @property
+    def product_ids(self):
+        return self._product_ids
+
+    def __len__(self) -> int:
+        return len(self._product_ids)
+
+    def __enter__(self):
+        self._file = open(self.snapshot_file, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, index_length, magic = FOOTER.unpack(self._map[-FOOTER.size:])
+        if self._map[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            raise ValueError(f'Not an indexed snapshot: {self.snapshot_file}')
+
+        index = json.loads(zlib.decompress(self._map[index_offset:index_offset + index_length]))
+        self._chunks = index['chunks']
+        self._product_ids = array('q', index['product_ids'])
+        self._positions = index['positions']
+        return self
+
+    def __exit__(self, *exc_info):
+        self._map.close()
+        self._file.close()
+        self._map, self._file = None, None
+
+    def read_chunk(self, chunk:int) -> bytes:
+        if self._cached_chunk[0] != chunk:
+            offset, length = self._chunks[chunk]
+            self._cached_chunk = [chunk, zlib.decompress(self._map[offset:offset + length])]
+        return self._cached_chunk[1]
+
+    def get(self, product_id:int) -> dict|None:
+        # Decodes a single product, or returns None if it isn't in the snapshot
+        position = bisect_left(self._product_ids, product_id)
+        if position == len(self._product_ids) or self._product_ids[position] != product_id:
+            return None
+        chunk, start, end = self._positions[position]
+        return json.loads(self.read_chunk(chunk)[start:end])
+
+    def get_many(self, product_ids) -> list[dict]:
+        # Decodes the requested products which exist in the snapshot, decompressing each chunk involved only once
+        found = []
+        for product_id in set(product_ids):
+            position = bisect_left(self._product_ids, product_id)
+            if position < len(self._product_ids) and self._product_ids[position] == product_id:
+                found.append(self._positions[position])
+        return [json.loads(self.read_chunk(chunk)[start:end]) for chunk, start, end in sorted(found)]
+
+    def __iter__(self):
+        for chunk in range(len(self._chunks)):
+            for line in self.read_chunk(chunk).splitlines():
+                yield json.loads(line)
+
+
+def is_indexed(snapshot_file:str) -> bool:
+    return snapshot_file.endswith(f'.{INDEXED_EXTENSION}')
+
+def iter_indexed_snapshot(snapshot_file:str, product_ids:set|None=None):
+    # Yields the products of an indexed snapshot, all of them as a stream or only the requested ones
+    with IndexedSnapshotReader(snapshot_file) as reader:
+        if product_ids is None:
+            yield from reader
+        else:
+            yield from reader.get_many(product_ids)
+
+def convert_to_indexed(snapshot_file:str, output_file:str|None=None) -> str:
+    # Converts any other snapshot (json, NDJSON, delta or repository manifest) into an indexed snapshot
+    from delta_snapshots import iter_snapshot_products # Imported here, as delta_snapshots reads indexed snapshots too
+
+    output_file = output_file or f'{os.path.splitext(snapshot_file)[0]}.{INDEXED_EXTENSION}'
+    with IndexedSnapshotWriter(output_file) as writer:
+        for product in iter_snapshot_products(snapshot_file):
+            writer.write_products([product])
+    CONSOLE.print(f"[bold green]Converted {writer.products_count} products: {output_file}[/bold green]")
+    return output_file
+
+def convert_to_ndjson(snapshot_file:str, output_file:str|None=None) -> str:
+    # Converts an indexed snapshot back into a plain NDJSON snapshot
+    output_file = output_file or f'{os.path.splitext(snapshot_file)[0]}.ndjson'
+    with open(output_file, 'w', encoding='utf-8') as file:
+        for product in iter_indexed_snapshot(snapshot_file):
+            file.write(json.dumps(product) + '\n')
+    CONSOLE.print(f"[bold green]Converted {snapshot_file} into {output_file}[/bold green]")
+    return output_file
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts snapshots from and to the indexed format')
+    parser.add_argument('snapshot_file')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if is_indexed(args.snapshot_file):
+        convert_to_ndjson(args.snapshot_file, args.output)
+    else:
+        convert_to_indexed(args.snapshot_file, args.output)
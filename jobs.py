@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Iterable
+import asyncio
+import uuid
+
+QUEUED:str = 'queued'
+RUNNING:str = 'running'
+FINISHED:str = 'finished'
+FAILED:str = 'failed'
+CANCELLED:str = 'cancelled'
+
+
+class Job:
+    """
+    State of a background snapshot or restore, as reported by the jobs endpoints.
+    store_ids are the stores the job works on, when there's more than one (a batch snapshot, for instance).
+    """
+    def __init__(self, kind:str, store_id:str, store_ids:Iterable[str]|None=None) -> None:
+        self.id:str = uuid.uuid4().hex
+        self.kind:str = kind
+        self.store_id:str = str(store_id)
+        self.store_ids:list[str] = sorted({str(store_id) for store_id in store_ids}) if store_ids else [self.store_id]
+        self.status:str = QUEUED
+        self.phase:str|None = None
+        self.done:int = 0
+        self.total:int = 0
+        self.result_file:str|None = None
+        self.journal_file:str|None = None
+        self.summary:dict = dict()
+        self.error:str|None = None
+        self.created_at:datetime = datetime.now()
+        self.started_at:datetime|None = None
+        self.finished_at:datetime|None = None
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    def update_progress(self, phase:str, done:int, total:int) -> None:
+        # Progress callback handed to the ExecutionManager
+        self.phase, self.done, self.total = phase.strip(' .'), done, total
+
+    def progress(self) -> dict:
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'phase': self.phase,
+            'done': self.done,
+            'total': self.total,
+            'percent': round(100 * self.done / self.total, 1) if self.total else None
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            **self.progress(),
+            'kind': self.kind,
+            'store_id': self.store_id,
+            'store_ids': self.store_ids,
+            'summary': self.summary,
+            'error': self.error,
+            'has_result': self.result_file is not None,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class TooManyJobsError(Exception):
+    pass
+
+
+class JobManager:
+    """
+    Runs snapshot and restore jobs as tasks on the server event loop.
+    Running jobs are capped globally and per store, the rest wait in line as queued.
+    A job on several stores takes a slot of each of them, so it never runs alongside more jobs of a store than the cap allows.
+    CPU bound work (parsing and diffing) goes to a bounded thread pool, so it doesn't hold the event loop.
+    Ended jobs are forgotten once they're older than finished_job_ttl, or when more than max_finished_jobs pile up.
+    """
+    def __init__(self, max_running_jobs:int=4, max_running_jobs_per_store:int=1, max_queued_jobs:int=100, cpu_workers:int=2,
+                 finished_job_ttl:timedelta=timedelta(hours=24), max_finished_jobs:int=1000) -> None:
+        self._jobs:dict[str, Job] = dict()
+        self._finished_job_ttl:timedelta = finished_job_ttl
+        self._max_finished_jobs:int = max_finished_jobs
+        self._tasks:set = set()
+        self._max_running_jobs_per_store:int = max_running_jobs_per_store
+        self._max_queued_jobs:int = max_queued_jobs
+        self._global_slots = asyncio.Semaphore(max_running_jobs)
+        self._store_slots:dict[str, asyncio.Semaphore] = dict()
+        self._executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix='job-cpu')
+
+    @property
+    def executor(self):
+        return self._executor
+
+    def get(self, job_id:str) -> Job|None:
+        return self._jobs.get(job_id)
+
+    def list(self, store_id:str|None=None) -> list[Job]:
+        return [job for job in self._jobs.values() if store_id is None or job.store_id == str(store_id) or str(store_id) in job.store_ids]
+
+    def submit(self, kind:str, store_id:str, work:Callable[[Job], Awaitable], store_ids:Iterable[str]|None=None) -> Job:
+        # Registers the job and schedules work(job) on the running event loop. Returns right away
+        # store_ids lists the stores the job works on, when it isn't only store_id
+        self.evict_finished_jobs()
+        if sum(job.status == QUEUED for job in self._jobs.values()) >= self._max_queued_jobs:
+            raise TooManyJobsError('Too many jobs waiting to run, try again later')
+
+        job = Job(kind, store_id, store_ids)
+        self._jobs[job.id] = job
+        task = asyncio.create_task(self._run(job, work))
+        self._tasks.add(task) # Keeps a reference until it's done, so the task isn't garbage collected
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def evict_finished_jobs(self) -> None:
+        # Drops the ended jobs past their ttl, and the oldest ones above the cap. Their result files are left on disk
+        ended_jobs = sorted((job for job in self._jobs.values() if not job.is_active), key=lambda job: job.finished_at or job.created_at)
+        expired_before = datetime.now() - self._finished_job_ttl
+        for index, job in enumerate(ended_jobs):
+            if index < len(ended_jobs) - self._max_finished_jobs or (job.finished_at or job.created_at) < expired_before:
+                del self._jobs[job.id]
+
+    async def _run(self, job:Job, work:Callable[[Job], Awaitable]) -> None:
+        try:
+            async with AsyncExitStack() as slots:
+                # Stores are taken in id order, so two jobs sharing several stores can't each hold one the other waits for
+                for store_id in job.store_ids:
+                    await slots.enter_async_context(self._store_slots.setdefault(store_id, asyncio.Semaphore(self._max_running_jobs_per_store)))
+                await slots.enter_async_context(self._global_slots)
+                job.status = RUNNING
+                job.started_at = datetime.now()
+                await work(job)
+                job.status = FINISHED
+        except asyncio.CancelledError: # Server shutdown, queued or running
+            job.status = CANCELLED
+            job.error = 'Cancelled before finishing'
+            raise
+        except Exception as e:
+            job.status = FAILED
+            job.error = f'{type(e).__name__}: {e}'
+        finally:
+            job.finished_at = datetime.now()
+
+    async def shutdown(self) -> None:
+        # Cancels the pending jobs and releases the thread pool
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,33 +1,63 @@
-from auxiliary_functions import extract_pages, obtain_parameters, exclude_missing_variants, products_are_equal, clusterize, save_json_data
+from auxiliary_functions import extract_pages, shard_id_ranges, obtain_parameters, changed_fields, matches_product_filter, save_json_data, save_fingerprint_manifest, load_fingerprint_manifest
+from request_pool import AdaptiveLimiter, FairBudget, run_worker_pool, backoff_delay
+from restore_journal import RestoreJournal, RestoreSummary, step_outcome, NON_IDEMPOTENT_METHODS
+from client_pool import ClientPool, CLIENT_POOL
+from diff_engine import build_raw_catalog_frames, build_action_plan, build_parallel_action_plan, latest_copies, IGNORE, PUT
+from delta_snapshots import DeltaSnapshot, DELTA_EXTENSION, delta_watermark, iter_snapshot_products, utc_now
+from snapshot_repository import SnapshotRepository
+from indexed_snapshots import IndexedSnapshotWriter, INDEXED_EXTENSION
+from metrics import Metrics, METRICS
+from compact_catalog import CompactCatalog
 import asyncio
 import json
 import httpx
 from datetime import datetime
+from contextlib import ExitStack, contextmanager, nullcontext, suppress
+from concurrent.futures import Executor
 from rich.console import Console
-from rich.progress import track
+from rich.progress import Progress
 import pandas as pd
 import httpx
 import asyncio
-import numpy as np
 import itertools
-from pydantic_objects import Product
+from pydantic import ValidationError
+from pydantic_objects import Product, PRODUCT_LIST_ADAPTER
 import os
+import time
+from urllib.parse import urlencode
 
 CONSOLE = Console()
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+PARSE_BATCH_SIZE = 5000
+REPOSITORY_DIR = 'snapshots'
 
 class RequestManager:
     """
     Request handler. Executs the requests and Stores the responses.
     """
-    MAX_CLUSTER_SIZE:int = 40
+    MAX_CONCURRENCY:int = 40
+    MAX_RETRIES:int = 5
+    IDEMPOTENT_METHODS:tuple = ('GET', 'PUT', 'PATCH')
+    REQUEST_TIMEOUT:float = 60.0
+    MAX_PAGE_SIZE:int = 200
+    SHARDS_PER_WORKER:int = 4 # Shards are pulled by the workers one at a time, so the uneven ones balance out
     URL:str = 'https://api.tiendanube.com/v1'
     
-    def __init__(self, store_id, access_token) -> None:
+    def __init__(self, store_id, access_token, max_concurrency:int=MAX_CONCURRENCY, progress_callback=None, client_pool:ClientPool=CLIENT_POOL,
+                 request_budget:FairBudget|None=None, base_url:str|None=None, metrics:Metrics|None=None, sharded_fetch:bool=False) -> None:
         self._store_id = store_id
         self._access_token:str = access_token
-        self._url = f'{self.URL}/{store_id}'
+        self._url = f'{base_url or self.URL}/{store_id}' # base_url points the manager to another API, such as the benchmarks mock server
         self._headers:dict = self.build_headers()
+        self._limiter:AdaptiveLimiter = AdaptiveLimiter(max_concurrency)
+        self._progress_callback = progress_callback # progress_callback(phase, done, total), used instead of the console progress bars
+        self._client_pool:ClientPool = client_pool # Process wide by default, so connections outlive this manager
+        self._request_budget:FairBudget|None = request_budget # Global budget shared with other stores, see batch_snapshot
+        self._requests_sent:int = 0
+        self._metrics:Metrics = metrics or Metrics(parent=METRICS) # Per run metrics, which also feed the process wide ones
+        self._restore_summary:RestoreSummary|None = None
+        self._sharded_fetch:bool = sharded_fetch # Fetch the catalog by id ranges instead of page numbers, see iter_sharded_product_pages
+        self._fetch_check:dict|None = None
     
     @property
     def url(self):
@@ -45,6 +75,58 @@ class RequestManager:
     def store_id(self):
         return self._store_id
 
+    @property
+    def limiter(self):
+        return self._limiter
+
+    @property
+    def client_pool(self):
+        return self._client_pool
+
+    @property
+    def requests_sent(self):
+        return self._requests_sent
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def restore_summary(self):
+        return self._restore_summary
+
+    @property
+    def fetch_check(self):
+        # Products expected and fetched on the last sharded fetch
+        return self._fetch_check
+
+    def budget_slot(self):
+        # Slot of the global request budget, if this manager shares one with other stores
+        if self._request_budget is None:
+            return nullcontext()
+        return self._request_budget.slot(str(self.store_id))
+
+    @property
+    def progress_callback(self):
+        return self._progress_callback
+
+    @contextmanager
+    def track_progress(self, phase:str, total:int):
+        # Yields the function which advances the progress of the phase by one.
+        # Progress goes to the progress_callback when set (background jobs), or to a console progress bar otherwise
+        if self.progress_callback:
+            done = 0
+            def advance():
+                nonlocal done
+                done += 1
+                self.progress_callback(phase, done, total)
+            self.progress_callback(phase, done, total)
+            yield advance
+        else:
+            with Progress(console=CONSOLE) as progress:
+                progress_task = progress.add_task(phase, total=total)
+                yield lambda: progress.advance(progress_task)
+
 
     def build_headers(self) -> dict:
         headers = {
@@ -54,21 +136,55 @@ class RequestManager:
             }
         return headers
 
-    async def build_get_request_task(self, client:httpx.AsyncClient, url_overlap=None) -> list:
-        """
-        Crea y retorna la taréa de ejecución para cada request
-        Cada taréa se ejecutará posteriormente en su cluster correspondiente
-        """
+    async def send_request(self, client:httpx.AsyncClient, method:str, url:str, payload=None) -> httpx.Response:
+        # Executes a single request within the limiter slots, retrying up to MAX_RETRIES times.
+        # Throttled requests (429) are retried once the limiter pause is over.
+        # Server errors (5xx) and connection errors are retried with exponential backoff, but only
+        # for idempotent methods, or when the request never reached the server
+        for attempt in range(self.MAX_RETRIES + 1):
+            last_attempt = attempt == self.MAX_RETRIES
+            try:
+                async with self.limiter, self.budget_slot():
+                    self._requests_sent += 1
+                    self.metrics.request_started()
+                    start = time.perf_counter()
+                    try:
+                        response = await client.request(method, url, headers=self.headers, json=payload, timeout=self.REQUEST_TIMEOUT)
+                    finally:
+                        self.metrics.request_finished()
+            except httpx.TransportError as e:
+                self.metrics.observe_request(method, e.request.url.path, 'error', time.perf_counter() - start)
+                if last_attempt or not (method in self.IDEMPOTENT_METHODS or isinstance(e, httpx.ConnectError)):
+                    raise
+                self.metrics.count_retry('transport_error')
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            
+            self.metrics.observe_request(method, response.request.url.path, response.status_code, time.perf_counter() - start,
+                                         len(response.request.content), len(response.content))
+            self.limiter.update_from_response(response)
+            if response.status_code == 429 and not last_attempt:
+                self.metrics.count_retry('throttled')
+                continue
+            if response.is_server_error and method in self.IDEMPOTENT_METHODS and not last_attempt:
+                self.metrics.count_retry('server_error')
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            return response
+
+    async def fetch_page(self, client:httpx.AsyncClient, url_overlap=None) -> list:
+        # Fetches a single page of products
+        # Returns the response along with the page number it belongs to
         url = url_overlap if url_overlap else f'{self.url}/products'
         params = obtain_parameters(url)
-        page = params['page'][0] if len(params) > 0 else 1
-        response = client.get(url, headers=self.headers, timeout=None)
+        page = int(params['page'][0]) if 'page' in params else 1
+        response = await self.send_request(client, 'GET', url)
 
         return [response, page]
 
     def build_product_request(self, product_json:dict) -> list:
         # Builds the list to be used as an argument for the product request execution.
-        url = f'https://api.tiendanube.com/v1/{self.store_id}/products'
+        url = f'{self.url}/products'
         if 'id' in product_json:                # It's a put request
             url += f'/{product_json.pop('id')}' # So we add the id to the endpoint url 
         
@@ -77,15 +193,15 @@ class RequestManager:
         return [url, payload]
 
     def build_variants_put_request(self, product_id:str, variants_json:list) -> list:
-        # Builds the list to be used as an argument for the Variant PUT request execution.
-        url = f'https://api.tiendanube.com/v1/{self.store_id}/products/{product_id}/variants'
+        # Builds the list to be used as an argument for the Variant PUT/PATCH request execution.
+        url = f'{self.url}/products/{product_id}/variants'
         payload = variants_json
 
         return [url, payload]
     
     def build_variant_post_request(self, variant_json:dict) -> list:
         # Builds the list to be used as an argument for the Variant POST request execution.
-        url = f'https://api.tiendanube.com/v1/{self.store_id}/products/{variant_json.pop("product_id")}/variants'
+        url = f'{self.url}/products/{variant_json.pop("product_id")}/variants'
         payload = variant_json
         
         return [url, payload]
@@ -94,65 +210,195 @@ class RequestManager:
         # Executes the request based on the method string provided
         url, payload = request_content[0],request_content[1]
         
-        match method:
-            case 'PUT':
-                response = client.put(url, headers=self.headers, json=payload, timeout=None)
-            case 'POST':
-                response = client.post(url, headers=self.headers, json=payload, timeout=None)
-            case _:
-                CONSOLE.print([f'[bold red]No method available matching: {method}[/bold red]'])
-                raise httpx.RequestError(f'No method available matching: {method}')
+        if method not in ('PUT', 'PATCH', 'POST'):
+            CONSOLE.print([f'[bold red]No method available matching: {method}[/bold red]'])
+            raise httpx.RequestError(f'No method available matching: {method}')
         
-        return response
+        return await self.send_request(client, method, url, payload)
+
+    async def iter_product_pages(self, query:dict|None=None):
+        # Async generator which fetches every product page in the store
+        # And yields each one as soon as it arrives, in completion order.
+        # Only a bounded amount of pages is buffered, so the consumer sets the pace.
+        # query holds extra filters for the products endpoint (updated_at_min, fields, per_page...), kept on every page
+        # Pages hold MAX_PAGE_SIZE products unless the query says otherwise
+        query = {'per_page': self.MAX_PAGE_SIZE, **(query or {})}
+        if self._sharded_fetch:
+            async for page_products in self.iter_sharded_product_pages(query):
+                yield page_products
+            return
+
+        # Only the waits for pages count as fetch time, not what the consumer does with them in between
+        with self.metrics.timed_sections('fetch') as fetch_timer:
+            async with self._client_pool.borrow() as client:
+                # Fetches the first bundle of products
+                with fetch_timer.timing():
+                    response, page = await self.fetch_page(client, f'{self.url}/products?{urlencode(query)}')
+
+                if response.is_success: # If the first bundle is fetched properly
+                    # Extract and build the links for the subsequent requests
+                    pages = extract_pages(response.headers['link']) if 'link' in response.headers else []
+                    yield response.json()
+                else:
+                    CONSOLE.print(f'[bold red]Your request returned an error {response.text}[/bold red]')
+                    raise httpx.HTTPStatusError(f'Your request returned an error {response.status_code}', request=response.request, response=response)
+            
+                CONSOLE.print(f"[bold green]{len(pages)}[/bold green][bold blue] pages will be fetched by up to[/bold blue][bold green] {self.limiter.max_limit}[/bold green] [bold blue]concurrent workers[/bold blue]")
+                fetched_pages = asyncio.Queue(maxsize=self.limiter.max_limit)
+
+                async def fetch(url:str) -> None:
+                    # Each worker grabs the next page as soon as its previous one is handed over
+                    response, page = await self.fetch_page(client, url)
+                    if not response.is_success:
+                        raise httpx.HTTPStatusError(f'Your request returned an error {response.status_code}', request=response.request, response=response)
+                    await fetched_pages.put(response.json())
+
+                async def produce() -> None:
+                    try:
+                        await run_worker_pool(pages, fetch, self.limiter.max_limit)
+                    finally:
+                        await fetched_pages.put(None) # Signals the end of the pages
+
+                producer = asyncio.create_task(produce())
+                try:
+                    with self.track_progress('Fetching Pages... ', len(pages)) as advance:
+                        while True:
+                            with fetch_timer.timing():
+                                page_products = await fetched_pages.get()
+                            if page_products is None:
+                                break
+                            yield page_products
+                            advance()
+                    await producer # Raises any error found by the workers
+                finally:
+                    producer.cancel()
+
+    async def iter_sharded_product_pages(self, query:dict|None=None):
+        # Async generator which fetches the catalog split into id ranges, walked in parallel with since_id cursors.
+        # Cursors don't go through deep page offsets, and a product changing mid-fetch can't shift the pages of the others.
+        # Products are yielded once even if a range returns them twice, and the count is checked against x-total-count
+        query = {'per_page': self.MAX_PAGE_SIZE, **(query or {})}
+        per_page = int(query['per_page'])
+        seen_ids, duplicates = set(), 0
+
+        def unseen(products:list) -> list:
+            nonlocal duplicates
+            fresh = [product for product in products if product['id'] not in seen_ids]
+            duplicates += len(products) - len(fresh)
+            seen_ids.update(product['id'] for product in fresh)
+            return fresh
+
+        async def fetch_after(client:httpx.AsyncClient, since_id:int) -> list:
+            response = await self.send_request(client, 'GET', f'{self.url}/products?{urlencode({**query, "since_id": since_id})}')
+            if response.status_code == 404: # No products after since_id
+                return []
+            if not response.is_success:
+                raise httpx.HTTPStatusError(f'Your request returned an error {response.status_code}', request=response.request, response=response)
+            return response.json()
+
+        with self.metrics.timed_sections('fetch') as fetch_timer: # Only the waits for pages count, see iter_product_pages
+            async with self._client_pool.borrow() as client:
+                # The newest product bounds the id ranges, and its response holds the total amount of products matching the query
+                probe_query = {**query, 'per_page': 1, 'fields': 'id', 'sort_by': 'created-at-descending'}
+                with fetch_timer.timing():
+                    response = await self.send_request(client, 'GET', f'{self.url}/products?{urlencode(probe_query)}')
+                if response.status_code == 404: # Empty store
+                    self._fetch_check = {'expected': 0, 'fetched': 0, 'duplicates': 0}
+                    return
+                if not response.is_success:
+                    CONSOLE.print(f'[bold red]Your request returned an error {response.text}[/bold red]')
+                    raise httpx.HTTPStatusError(f'Your request returned an error {response.status_code}', request=response.request, response=response)
+                expected = int(response.headers['x-total-count']) if 'x-total-count' in response.headers else None
+                newest_id = response.json()[0]['id']
+
+                with fetch_timer.timing():
+                    first_page = await fetch_after(client, 0)
+                yield unseen(first_page)
+                if len(first_page) < per_page:
+                    id_ranges = []
+                else:
+                    pages = -(-(expected or 0) // per_page) - 1
+                    id_ranges = shard_id_ranges(first_page[-1]['id'], max(newest_id, first_page[-1]['id']), max(1, min(pages, self.limiter.max_limit * self.SHARDS_PER_WORKER)))
+
+                CONSOLE.print(f"[bold green]{len(id_ranges)}[/bold green][bold blue] id ranges will be fetched by up to[/bold blue][bold green] {self.limiter.max_limit}[/bold green] [bold blue]concurrent workers[/bold blue]")
+                fetched_pages = asyncio.Queue(maxsize=self.limiter.max_limit)
+
+                async def fetch_range(id_range:list) -> None:
+                    # Walks the range with since_id cursors. The page crossing its end is cut there, the next range covers the rest
+                    since_id, last_id = id_range
+                    while True:
+                        products = await fetch_after(client, since_id)
+                        in_range = [product for product in products if last_id is None or product['id'] <= last_id]
+                        if in_range:
+                            await fetched_pages.put(in_range)
+                        if len(products) < per_page or len(in_range) < len(products):
+                            return
+                        since_id = products[-1]['id']
+
+                async def produce() -> None:
+                    try:
+                        await run_worker_pool(id_ranges, fetch_range, self.limiter.max_limit)
+                    finally:
+                        await fetched_pages.put(None) # Signals the end of the ranges
+
+                producer = asyncio.create_task(produce())
+                try:
+                    with self.track_progress('Fetching Products... ', expected or 0) as advance:
+                        for _ in first_page:
+                            advance()
+                        while True:
+                            with fetch_timer.timing():
+                                page_products = await fetched_pages.get()
+                            if page_products is None:
+                                break
+                            yield unseen(page_products)
+                            for _ in page_products:
+                                advance()
+                    await producer # Raises any error found by the workers
+                finally:
+                    producer.cancel()
+
+        self._fetch_check = {'expected': expected, 'fetched': len(seen_ids), 'duplicates': duplicates}
+        if expected is not None and expected != len(seen_ids):
+            CONSOLE.print(f"[bold yellow]The store reported {expected} products but {len(seen_ids)} were fetched, the catalog changed during the fetch[/bold yellow]")
 
     async def gather_products(self) -> list:
         # Fetches evey product in the store
-        # And returns it in json and dataframe formats
-        results_jsons_list = []
-        results_dfs_list = []
-
-        async with httpx.AsyncClient() as client:
-            # Fetches the first bundle of products
-            first_request = await asyncio.create_task(self.build_get_request_task(client))
-            response:httpx.Response = await asyncio.gather(first_request[0])
-            response = response[0]
-
-            if response.is_success: # If the first bundle is fetched properly
-                results_dfs_list.append(pd.DataFrame(response.json()))
-                results_jsons_list.append(response.json())
-                pages = extract_pages(response.headers['link']) # Extract and build the links for the subsequent requests
-            else:
-                CONSOLE.print(f'[bold red]Your request returned an error {response.text}[/bold red]')
-                raise httpx.HTTPStatusError(f'Your request returned an error {response.status_code}')
-            
-            # Build the rest of the GET requests to fetch, based on the extracted pages. 
-            tasks = [asyncio.create_task(self.build_get_request_task(client, url)) for url in pages]
-            #task_clusters = [list(array) for array in (np.array_split(tasks,int(np.ceil(len(tasks)/self.MAX_CLUSTER_SIZE))) )]
-            task_clusters = clusterize(tasks, self.MAX_CLUSTER_SIZE)
-
-            CONSOLE.print(f"[bold green]{len(tasks)}[/bold green][bold blue] tasks have been divided into[/bold blue][bold green] {len(task_clusters)}[/bold green] [bold blue]clusters[/bold blue]")
-            for cluster in track(task_clusters, description='Fetching Clusters... '):
-                cluster_plan = await asyncio.gather(*cluster)
-                rq_tasks = [task[0] for task in cluster_plan]
-                # rq_pages = [task[1] for task in cluster_plan]
-                
-                responses = await asyncio.gather(*rq_tasks)
+        # And returns them in json format
+        results_json = []
+        async for page_products in self.iter_product_pages():
+            results_json.extend(page_products)
+        
+        return results_json
+
+    async def gather_product_ids(self) -> set:
+        # Fetches only the id of every product in the store, using the biggest pages allowed
+        product_ids = set()
+        async for page_products in self.iter_product_pages({'fields': 'id', 'per_page': self.MAX_PAGE_SIZE}):
+            product_ids.update(product['id'] for product in page_products)
+        return product_ids
 
-                for response in responses:
+    async def fetch_products_by_id(self, product_ids:list) -> list:
+        # Fetches only the given products, one request each, with up to max_limit workers
+        # Products which don't exist anymore (404) are left out of the result
+        products_json = []
+        async with self._client_pool.borrow() as client:
+            with self.metrics.phase('fetch'), self.track_progress('Fetching Products... ', len(product_ids)) as advance:
+                async def fetch(product_id:int) -> None:
+                    response = await self.send_request(client, 'GET', f'{self.url}/products/{product_id}')
                     if response.is_success:
-                        results_dfs_list.append(pd.DataFrame(response.json()))
-                        results_jsons_list.append(response.json())
-                    else:
-                        raise httpx.HTTPStatusError(f'Your request returned an error {response.status_code}')
-            
-        results_json = list(itertools.chain(*results_jsons_list))
-        results_df = pd.concat(results_dfs_list)
-        
-        return [results_df, results_json]
+                        products_json.append(response.json())
+                    elif response.status_code != 404:
+                        raise httpx.HTTPStatusError(f'Your request returned an error {response.status_code}', request=response.request, response=response)
+                    advance()
+
+                await run_worker_pool(product_ids, fetch, self.limiter.max_limit)
+        return products_json
     
-    async def build_tasks(self, row:pd.Series) -> pd.Series:
-        # Row method to build the method tasks within the working dataframe
-        row['product_request'] = self.build_product_request(row['product_json'])
+    def build_tasks(self, row:pd.Series) -> pd.Series:
+        # Row method to build the request contents within the working dataframe
+        if row['product_json']: # None when only the variants changed
+            row['product_request'] = self.build_product_request(row['product_json'])
         
         if row['variants_json']: #If it's not None
             # Extract the product ID and remove it from the JSON
@@ -165,76 +411,164 @@ class RequestManager:
             row['variant_post_request'] = self.build_variants_put_request(product_id, row['missing_variants_json'] )
         
         return row
-        
-    async def prepare_execution(self, row:pd.Series, client:httpx.AsyncClient) -> pd.Series:
-        # Row method which builds the async request execution tasks for further clustering and awaiting
-        # And stores them in their respective columns
-        product_request:list = row['product_request']
-        variant_put_request:list = row['variant_put_request']
-        variant_post_request:list = row['variant_post_request']
-
-        row['product_response'] = asyncio.create_task(self.execute_request(client, request_content=product_request, method=row['action']))
-        if variant_put_request:
-            row['variant_put_response'] = asyncio.create_task(self.execute_request(client, request_content=variant_put_request, method='PUT'))
-        if variant_post_request:
-            row['variant_post_response'] = [asyncio.create_task(self.execute_request(client, request_content=[variant_post_request[0], payload], method='POST'))
-                                            for payload in variant_post_request[1]]
-        return row
-        
 
-    async def restore_products(self, df:pd.DataFrame) -> pd.DataFrame:
+    def build_job_chain(self, row:pd.Series) -> list:
+        # Builds the ordered [response column, method, request_content] steps for a single product:
+        # product PUT/POST first, then the changed variants PATCH, then each variant POST
+        job_chain = []
+        if row['product_request']:
+            job_chain.append(['product_response', row['action'], row['product_request']])
+        if row['variant_put_request']: # Only the changed variants are sent, so they're patched in place
+            job_chain.append(['variant_put_response', 'PATCH', row['variant_put_request']])
+        if row['variant_post_request']:
+            url, payloads = row['variant_post_request']
+            job_chain.extend(['variant_post_response', 'POST', [url, payload]] for payload in payloads)
+        return job_chain
+
+    async def execute_job_chain(self, client:httpx.AsyncClient, job_chain:list, start:int=0, on_step=None, on_start=None) -> list:
+        # Runs the steps of a product chain in order, starting at the provided step. A failed step stops the chain,
+        # and the steps that didn't run are left as None. Only the compact outcome of each step is kept (see step_outcome),
+        # so the responses are released as soon as they're recorded. Request errors are recorded the same way
+        # on_step(step, outcome) is called as soon as each step completes, and on_start(step, method) right before sending a POST
+        outcomes = [None] * len(job_chain)
+        for index in range(start, len(job_chain)):
+            column, method, request_content = job_chain[index]
+            if on_start and method in NON_IDEMPOTENT_METHODS:
+                on_start(index, method)
+            start_time = time.perf_counter()
+            try:
+                response = await self.execute_request(client, request_content, method)
+            except httpx.HTTPError as e:
+                response = e
+            outcomes[index] = step_outcome(column, method, response, time.perf_counter() - start_time)
+            response = None
+            if on_step:
+                on_step(index, outcomes[index])
+            if not RestoreJournal.is_success(outcomes[index]):
+                break
+        return outcomes
+
+    async def execute_job_chains(self, job_chains:dict, max_concurrency:int|None=None, journal:RestoreJournal|None=None, start_steps:dict|None=None) -> dict:
+        # Executes the job chains (product_id -> steps) with a bounded pool of workers, which pull one product at a time.
+        # The limiter sets how many requests are in flight. Every completed step is recorded on the journal if provided
+        # Returns the step outcomes for each product chain, and keeps their counts on restore_summary
+        workers = min(max_concurrency or self.limiter.max_limit, self.limiter.max_limit)
+        start_steps = start_steps or dict()
+        chain_responses = dict()
+        summary = journal.summary if journal else RestoreSummary()
+        record_step = journal.record_step if journal else (lambda product_id, step, outcome: summary.add(product_id, outcome))
+        record_started = journal.record_started if journal else None
+        self._restore_summary = summary
+
+        CONSOLE.print(f"[bold green]{len(job_chains)}[/bold green][bold blue] products will be restored by up to[/bold blue][bold green] {workers}[/bold green] [bold blue]concurrent workers[/bold blue]")
+        async with self._client_pool.borrow() as client:
+            with self.metrics.phase('execute'), self.track_progress('Restoring Products... ', len(job_chains)) as advance:
+
+                async def restore(product_id) -> None:
+                    on_step = lambda step, outcome: record_step(product_id, step, outcome)
+                    on_start = (lambda step, method: record_started(product_id, step, method)) if record_started else None
+                    chain_responses[product_id] = await self.execute_job_chain(client, job_chains[product_id], start_steps.get(product_id, 0), on_step, on_start)
+                    advance()
+
+                await run_worker_pool(job_chains, restore, workers)
+
+        CONSOLE.print(f"[bold green]FINISHED processing requests[/bold green]")
+        return chain_responses
+
+    async def restore_products(self, df:pd.DataFrame, max_concurrency:int|None=None, journal_file:str|None=None) -> pd.DataFrame:
         # Executes the restore function based on the actions dataframe.
+        # The request chains for every product are planned first, and written to the journal file if provided,
+        # so an interrupted restore can be picked up later with resume_restore
         df[['product_request', 'variant_put_request', 'variant_post_request',
             'product_response', 'variant_put_response', 'variant_post_response']] = '' # Add execution and diagnosis columns
         
-        CONSOLE.print(f"[bold blue]Building tasks for each product[/bold blue]")
-        request_content_tasks = [asyncio.create_task(self.build_tasks(row)) for _, row in df.iterrows()] # Populate the request columns
-        contents_list = await asyncio.gather(*request_content_tasks)
-       
-        df = pd.DataFrame(contents_list) # Replace the main dataframe with the updated version
-
-        CONSOLE.print(f"[bold blue]Preparing to execute requests[/bold blue]")
-        async with httpx.AsyncClient() as client:
-            tasks = [asyncio.create_task(self.prepare_execution(row, client)) for _,row in df.iterrows()] # Build the actual request tasks
-            ready_task_rows = await asyncio.gather(*tasks)
-            df = pd.DataFrame(ready_task_rows) # Replace the main dataframe with the updated version
-
-            product_tasks = df['product_response'].to_list()
-            variant_put_tasks = [_ for _ in df['variant_put_response'].to_list() if _ != '']
-            variant_post_tasks = list()
-            
-            grouped_variant_posts = df['variant_post_response'].to_list()
-            for task_group in grouped_variant_posts: # Extract the post tasks from comfy little lists
-                for task in task_group:
-                    variant_post_tasks.append(task)
+        CONSOLE.print(f"[bold blue]Building the request chains for each product[/bold blue]")
+        with self.metrics.phase('payload'):
+            df = pd.DataFrame([self.build_tasks(row) for _, row in df.iterrows()]) # Populate the request columns
+            job_chains = {int(product_id): self.build_job_chain(row) for product_id, (_, row) in zip(df['product_id'], df.iterrows())}
+        df = df.drop(columns=['read_product_object', 'fetched_product_object'], errors='ignore') # Not needed once the requests are built
+        
+        if journal_file:
+            with RestoreJournal(journal_file) as journal:
+                journal.write_plan(self.store_id, job_chains)
+                CONSOLE.print(f"[bold blue]Restore plan written to the journal: {journal_file}[/bold blue]")
+                chain_responses = await self.execute_job_chains(job_chains, max_concurrency, journal)
+        else:
+            chain_responses = await self.execute_job_chains(job_chains, max_concurrency)
 
-            product_task_clusters = clusterize(product_tasks, self.MAX_CLUSTER_SIZE)
-            variant_task_clusters = clusterize(variant_put_tasks+variant_post_tasks, self.MAX_CLUSTER_SIZE)
+        CONSOLE.print(f"[bold blue]Preparing log dataframe[/bold blue]")
+        return self.build_responses_dataframe(df, job_chains, chain_responses)
 
-            CONSOLE.print(f"[bold green]{len(product_tasks)}[/bold green][bold blue] tasks have been divided into[/bold blue][bold green] {len(product_task_clusters)}[/bold green] [bold blue]clusters for the Product Actions[/bold blue]")
-            CONSOLE.print(f"[bold green]{len(variant_put_tasks+variant_post_tasks)}[/bold green][bold blue] tasks have been divided into[/bold blue][bold green] {len(variant_task_clusters)}[/bold green] [bold blue]clusters for the Variant Actions[/bold blue]")
+    async def resume_restore(self, journal_file:str, max_concurrency:int|None=None, failed_only:bool=False) -> pd.DataFrame:
+        # Continues an interrupted restore from its journal. Steps which already succeeded are skipped,
+        # and each product chain picks up from its first pending step. New results are appended to the same journal
+        # With failed_only just the failed steps are replayed, and the chains that never started are left alone
+        journal = RestoreJournal(journal_file)
+        store_id, job_chains, start_steps = journal.load(failed_only)
+        if store_id != str(self.store_id):
+            raise ValueError(f'The journal {journal_file} belongs to store {store_id}, not {self.store_id}')
+        
+        with journal:
+            skipped = await self.settle_in_doubt_steps(journal, job_chains, start_steps)
+            pending_chains = {product_id: job_chain for product_id, job_chain in job_chains.items()
+                              if start_steps[product_id] < len(job_chain) and product_id not in skipped}
+            if failed_only:
+                CONSOLE.print(f"[bold green]{len(pending_chains)}[/bold green][bold blue] products have failed steps to replay[/bold blue]")
+            else:
+                CONSOLE.print(f"[bold green]{len(job_chains) - len(pending_chains) - len(skipped)}[/bold green][bold blue] products were already restored[/bold blue]")
+            chain_responses = await self.execute_job_chains(pending_chains, max_concurrency, journal, start_steps)
+        
+        df = pd.DataFrame({'product_id': list(pending_chains.keys())})
+        return self.build_responses_dataframe(df, pending_chains, chain_responses)
 
-            processed_product_responses = dict()
-            processed_variant_responses = dict()
+    async def settle_in_doubt_steps(self, journal:RestoreJournal, job_chains:dict, start_steps:dict) -> set:
+        # POSTs sent on the interrupted run whose outcome was never recorded may have been applied, so they aren't simply sent again.
+        # Variant POSTs are checked against the store: when the product already has a variant with the same values the step
+        # is recorded as done and its chain moves on, otherwise it's sent again. Created products get a new id, so there's
+        # no way to tell if a product POST went through: those chains are skipped with a warning, to be checked by hand.
+        # Updates start_steps in place, and returns the ids of the skipped products
+        skipped = set()
+        async with self._client_pool.borrow() as client:
+            for product_id, step in journal.in_doubt.items():
+                if product_id not in job_chains:
+                    continue
+                column, method, (url, payload) = job_chains[product_id][step]
+                variant_id = None
+                if column == 'variant_post_response' and payload.get('values'):
+                    response = await self.send_request(client, 'GET', url.removesuffix('/variants'))
+                    if response.is_success:
+                        variant_id = next((variant['id'] for variant in response.json()['variants'] if variant.get('values') == payload['values']), None)
+                        if variant_id is None: # It never got to the store, so it's safe to send it again
+                            continue
 
-            for cluster in track(product_task_clusters, description='Executing Product Clusters... '):
-                cluster_plan = await asyncio.gather(*cluster)
-                responses = await asyncio.gather(*cluster_plan)
-                processed_product_responses.update(dict(zip(cluster,responses)))
-            
-            for cluster in track(variant_task_clusters, description='Executing Variant Clusters... '):
-                cluster_plan = await asyncio.gather(*cluster)
-                responses = await asyncio.gather(*cluster_plan)
-                processed_variant_responses.update(dict(zip(cluster,responses)))
-
-            CONSOLE.print(f"[bold green]FINISHED processing requests[/bold green]")
-            CONSOLE.print(f"[bold blue]Preparing log dataframe[/bold blue]")
-            #df['product_response'] = df['product_response'].map(processed_product_responses).fillna('non value')
-            #Once everything is executed, store the responses by replacing the completed tasks
-            df['product_response'] = df['product_response'].apply(lambda x: processed_product_responses.get(x, x))
-            df['variant_put_response'] = df['variant_put_response'].apply(lambda x: processed_variant_responses.get(x, x))
-            df['variant_post_response'] = df['variant_post_response'].apply(lambda lst: [processed_variant_responses.get(x, x) for x in lst])
+                if variant_id is not None:
+                    journal.record_step(product_id, step, {'operation': column.removesuffix('_response'), 'method': method, 'status': response.status_code,
+                                                           'latency_ms': 0.0, 'resource_id': variant_id, 'error': None})
+                    start_steps[product_id] = step + 1
+                else:
+                    skipped.add(product_id)
 
+        if skipped:
+            CONSOLE.print(f"[bold yellow]{len(skipped)} products were skipped because a POST was sent without recording its outcome, "
+                          f"so it may have been applied. Check them in the store before restoring them again: {sorted(skipped)}[/bold yellow]")
+        return skipped
+
+    def build_responses_dataframe(self, df:pd.DataFrame, job_chains:dict, chain_responses:dict) -> pd.DataFrame:
+        # Stores the step outcomes of each chain in their respective response columns
+        df = df.reset_index(drop=True)
+        for column in ['product_response', 'variant_put_response', 'variant_post_response']:
+            df[column] = ''
+        df['variant_post_response'] = [[] for _ in range(len(df))]
+
+        for index, product_id in enumerate(df['product_id']):
+            job_chain = job_chains[int(product_id)]
+            for (column, _, _), response in zip(job_chain, chain_responses.get(int(product_id), [])):
+                if response is None: # The step didn't run on this execution
+                    continue
+                if column == 'variant_post_response':
+                    df.at[index, column].append(response)
+                else:
+                    df.at[index, column] = response
         return df
         
 
@@ -243,15 +577,30 @@ class ExecutionManager:
     Builds, stores and handles the information necessary to execute the requests.
     Uses RequestManager to run the requests, and logs the result. TODO: Create a LogManager class.
     """
-    def __init__(self, store_id, access_token):
+    def __init__(self, store_id, access_token, diff_workers:int=1, progress_callback=None,
+                 max_concurrency:int=RequestManager.MAX_CONCURRENCY, request_budget:FairBudget|None=None, base_url:str|None=None,
+                 client_pool:ClientPool=CLIENT_POOL, sharded_fetch:bool=False):
         self._store_id:str = store_id
         self._access_token:str = access_token
+        self._diff_workers:int = diff_workers # Processes used to parse and diff the catalogs. 1 keeps everything in this process
+        self._progress_callback = progress_callback
+        self._max_concurrency:int = max_concurrency
+        self._request_budget:FairBudget|None = request_budget
+        self._base_url:str|None = base_url
+        self._client_pool:ClientPool = client_pool
+        self._sharded_fetch:bool = sharded_fetch # Full catalog fetches are split into id ranges fetched in parallel
+        self._metrics:Metrics = Metrics(parent=METRICS) # Shared with the request manager, so the run summary covers every phase
         self._request_manager:RequestManager = self.build_request_manager()
         self._fetched_products_json = dict()
         self._last_exported_json = None
         self._read_products_dataframe = pd.DataFrame()
+        self._read_catalog:CompactCatalog|None = None # Columnar read products, when not loaded lazily
         self._tasks_dataframe = pd.DataFrame()
         self._ignored_tasks = pd.DataFrame()
+        self._lazy_loading:bool = False
+        self._last_journal_file = None
+        self._read_fingerprints = dict()
+        self._fetched_at:str|None = None
         
     
     @property
@@ -282,6 +631,22 @@ class ExecutionManager:
     def ignored_tasks(self):
         return self._ignored_tasks
 
+    @property
+    def diff_workers(self):
+        return self._diff_workers
+
+    @property
+    def last_journal_file(self):
+        return self._last_journal_file
+
+    @property
+    def request_manager(self):
+        return self._request_manager
+
+    @property
+    def metrics(self):
+        return self._metrics
+
     @read_products_dataframe.setter
     def read_products_dataframe(self, new_dataframe:pd.DataFrame) -> None:
         self._read_products_dataframe = new_dataframe
@@ -295,14 +660,27 @@ class ExecutionManager:
         self._ignored_tasks = new_dataframe
 
     def build_request_manager(self)-> RequestManager:
-        return RequestManager(self.store_id, self.access_token)
+        return RequestManager(self.store_id, self.access_token, max_concurrency=self._max_concurrency,
+                              progress_callback=self._progress_callback, request_budget=self._request_budget, base_url=self._base_url,
+                              client_pool=self._client_pool, metrics=self._metrics, sharded_fetch=self._sharded_fetch)
+
+    async def run_cpu_bound(self, executor:Executor|None, function, *args):
+        # Runs parsing and diffing work on the provided executor, so it doesn't block the event loop
+        # Without an executor it simply runs in place
+        if executor is None:
+            return function(*args)
+        return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
     
-    def build_fetched_products_json(self) -> None:
+    async def build_fetched_products_json_async(self) -> None:
         # Gets every product from the designated store
         # And holds the json in memory
         CONSOLE.print(f"[bold blue]Attempting to fetch products[/bold blue]")
+        self._fetched_at = utc_now()
+        self._fetched_products_json = await self._request_manager.gather_products()
+
+    def build_fetched_products_json(self) -> None:
         try:
-            self._fetched_products_json = asyncio.run(self._request_manager.gather_products())[1]
+            asyncio.run(self.build_fetched_products_json_async())
         except Exception as e:
             CONSOLE.print("[bold red]There was an error gathering the products. The process was aborted and no changes were made[/bold red]")
             CONSOLE.print(f"[bold yellow]{e}[/bold yellow]")
@@ -315,6 +693,8 @@ class ExecutionManager:
             json_file_export = os.path.join(SCRIPT_DIR, f'{self.store_id} - Snapshot {datetime.now().strftime("%Y-%m-%d %H:%M")}.json')
             
             save_json_data(json_file_export, self.fetched_products_json)
+            fingerprints = {str(product.id): product.fingerprint_entry() for product in self.parse_json(self.fetched_products_json)}
+            save_fingerprint_manifest(json_file_export, fingerprints, self._fetched_at)
             
             self._last_exported_json = json_file_export
             CONSOLE.print(f"[bold green]Successfully exported JSON: {json_file_export}[/bold green]")
@@ -322,32 +702,224 @@ class ExecutionManager:
         else:
             CONSOLE.print("[bold red]There's no json stored for export. Please load or generate a json first[/bold red]")
 
-    def parse_json(self, json_obj:dict) -> list[Product|None]:
+    def build_snapshot_filename(self, extension:str='ndjson') -> str:
+        return os.path.join(SCRIPT_DIR, f'{self.store_id} - Snapshot {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}.{extension}')
+
+    async def iter_snapshot_ndjson(self, json_file:str|None=None):
+        # Async generator which yields the snapshot as NDJSON bytes, one chunk per page, as soon as each page is fetched
+        # When a json_file is provided the same bytes are written to it in the same pass, along with its manifest.
+        # Only complete snapshots get the final name, so the partial file is discarded if anything fails
+        partial_file = f'{json_file}.part' if json_file else None
+        fingerprints, started_at = dict(), utc_now()
+        file = open(partial_file, 'wb') if json_file else None
+        try:
+            async for page_products in self._request_manager.iter_product_pages():
+                chunk = ''.join(f'{json.dumps(product)}\n' for product in page_products).encode('utf-8')
+                if file:
+                    file.write(chunk)
+                    fingerprints.update({str(product['id']): Product(**product).fingerprint_entry() for product in page_products})
+                yield chunk
+        except BaseException: # Includes the client disconnecting from a streamed response
+            if file:
+                file.close()
+                with suppress(OSError):
+                    os.remove(partial_file)
+            raise
+        
+        if file:
+            file.close()
+            os.replace(partial_file, json_file)
+            save_fingerprint_manifest(json_file, fingerprints, started_at)
+            self._last_exported_json = json_file
+            CONSOLE.print(f"[bold green]Successfully exported {len(fingerprints)} products: {json_file}[/bold green]")
+
+    async def save_snapshot_stream_async(self) -> str:
+        # Fetches the products straight into an NDJSON file in the script directory, without holding the catalog in memory
+        # Returns the full path to the file
+        CONSOLE.print(f"[bold blue]Streaming products into an NDJSON snapshot[/bold blue]")
+        json_file_export = self.build_snapshot_filename()
+        async for _ in self.iter_snapshot_ndjson(json_file_export):
+            pass
+        return json_file_export
+
+    async def save_delta_snapshot_async(self, base_snapshot:str) -> str:
+        # Fetches only the products updated since the base snapshot (a full snapshot or a previous delta)
+        # and stores them as a delta linked to it. Deleted products are found with an id-only pass over the store.
+        # Returns the full path to the delta file, which can be rebuilt into a full snapshot with delta_snapshots.py
+        updated_at_min, started_at = delta_watermark(base_snapshot), utc_now()
+        CONSOLE.print(f"[bold blue]Fetching the products updated since {updated_at_min}[/bold blue]")
+        delta_file = self.build_snapshot_filename(DELTA_EXTENSION)
+        partial_file = f'{delta_file}.part'
+        try:
+            with DeltaSnapshot(partial_file) as delta:
+                delta.write_header(self.store_id, base_snapshot, updated_at_min, started_at)
+                updated_ids = set()
+                async for page_products in self._request_manager.iter_product_pages({'updated_at_min': updated_at_min}):
+                    delta.write_products(page_products)
+                    updated_ids.update(product['id'] for product in page_products)
+                
+                CONSOLE.print(f"[bold blue]Looking for deleted products[/bold blue]")
+                current_ids = await self._request_manager.gather_product_ids()
+                base_ids = {product['id'] for product in iter_snapshot_products(base_snapshot)}
+                delta.write_deleted(sorted((base_ids | updated_ids) - current_ids))
+        except BaseException:
+            with suppress(OSError): # The partial file may not exist yet, and a failed cleanup mustn't hide the original error
+                os.remove(partial_file)
+            raise
+
+        os.replace(partial_file, delta_file)
+        self._last_exported_json = delta_file
+        CONSOLE.print(f"[bold green]Successfully exported {len(updated_ids)} updated products and {len((base_ids | updated_ids) - current_ids)} deletions: {delta_file}[/bold green]")
+        return delta_file
+
+    def save_delta_snapshot(self, base_snapshot:str) -> str:
+        return asyncio.run(self.save_delta_snapshot_async(base_snapshot))
+
+    async def save_repository_snapshot_async(self, repository_dir:str|None=None) -> str:
+        # Fetches the products into the snapshot repository. Only the products that changed since any previous
+        # snapshot are written, the rest are referenced by the hash of their content
+        # Returns the full path to the snapshot manifest
+        repository = SnapshotRepository(repository_dir or os.path.join(SCRIPT_DIR, REPOSITORY_DIR))
+        CONSOLE.print(f"[bold blue]Storing products into the snapshot repository {repository.root_dir}[/bold blue]")
+        products, new_objects, started_at = [], 0, utc_now()
+        loop = asyncio.get_running_loop()
+        with ExitStack() as repository_lock:
+            # Compressing and writing the objects happens off the event loop, and so does waiting on a garbage collection in progress
+            await loop.run_in_executor(None, repository_lock.enter_context, repository.lock())
+            async for page_products in self._request_manager.iter_product_pages():
+                page_pairs, page_new_objects = await loop.run_in_executor(None, repository.put_products, page_products)
+                products.extend(page_pairs)
+                new_objects += page_new_objects
+
+            manifest_file = await loop.run_in_executor(None, repository.save_manifest, repository.build_manifest_filename(self.store_id),
+                                                       self.store_id, products, started_at)
+        self._last_exported_json = manifest_file
+        CONSOLE.print(f"[bold green]Successfully stored {len(products)} products, {new_objects} of them new or changed: {manifest_file}[/bold green]")
+        return manifest_file
+
+    async def save_indexed_snapshot_async(self) -> str:
+        # Fetches the products into an indexed snapshot (compressed chunks plus a product id index) in the script directory
+        # Returns the full path to the file
+        CONSOLE.print(f"[bold blue]Streaming products into an indexed snapshot[/bold blue]")
+        json_file_export = self.build_snapshot_filename(INDEXED_EXTENSION)
+        partial_file = f'{json_file_export}.part'
+        fingerprints, started_at = dict(), utc_now()
+        try:
+            with IndexedSnapshotWriter(partial_file) as writer:
+                async for page_products in self._request_manager.iter_product_pages():
+                    writer.write_products(page_products)
+                    fingerprints.update({str(product['id']): Product(**product).fingerprint_entry() for product in page_products})
+        except BaseException:
+            with suppress(OSError):
+                os.remove(partial_file)
+            raise
+
+        os.replace(partial_file, json_file_export)
+        save_fingerprint_manifest(json_file_export, fingerprints, started_at)
+        self._last_exported_json = json_file_export
+        CONSOLE.print(f"[bold green]Successfully exported {len(fingerprints)} products: {json_file_export}[/bold green]")
+        return json_file_export
+
+    def save_snapshot_stream(self) -> str:
+        try:
+            return asyncio.run(self.save_snapshot_stream_async())
+        except Exception as e:
+            CONSOLE.print("[bold red]There was an error gathering the products. The snapshot was discarded[/bold red]")
+            CONSOLE.print(f"[bold yellow]{e}[/bold yellow]")
+            return None
+
+    def parse_json(self, json_obj:list) -> list[Product|None]:
         # Converts the products on the provided JSON to the Product object
-        # With it's respective validations
+        # With it's respective validations, done in bulk for the whole list
         products_list = []
         
         CONSOLE.print(f"[bold blue]Parsing products[/bold blue]")
         if len(json_obj) > 0:
-            products_list = [Product(**product) for product in json_obj] # Unpacks and converts
+            products_list = PRODUCT_LIST_ADAPTER.validate_python(json_obj)
         CONSOLE.print(f"[bold green]Successfully parsed {len(products_list)} products![/bold green]")
         return products_list
 
-    def load_json_file(self, json_file:str) -> None:
-        # Reads a json backup file, parses it into Product objects
-        # And stores them as a dataframe in memory
+    def parse_json_stream(self, json_items, batch_size:int=PARSE_BATCH_SIZE) -> list[Product]:
+        # Validates a stream of product jsons in bulk batches, so the raw jsons of only one batch are alive at a time
+        CONSOLE.print(f"[bold blue]Parsing products[/bold blue]")
+        products_list = []
+        while batch := list(itertools.islice(json_items, batch_size)):
+            products_list.extend(PRODUCT_LIST_ADAPTER.validate_python(batch))
+        CONSOLE.print(f"[bold green]Successfully parsed {len(products_list)} products![/bold green]")
+        return products_list
+
+    def materialize_product(self, product:Product|dict) -> Product:
+        # Builds the Product object for a lazily loaded product json, reusing the manifest fingerprints if available
+        if isinstance(product, Product):
+            return product
+        product = Product(**product)
+        if str(product.id) in self._read_fingerprints:
+            product.load_fingerprints(self._read_fingerprints[str(product.id)])
+        return product
+
+    def build_catalog(self, json_items, fingerprints:dict|None=None) -> CompactCatalog:
+        # Validates the product jsons in bulk batches into a compact columnar catalog
+        CONSOLE.print(f"[bold blue]Parsing products[/bold blue]")
+        catalog = CompactCatalog.from_json(json_items, fingerprints, PARSE_BATCH_SIZE)
+        CONSOLE.print(f"[bold green]Successfully parsed {len(catalog)} products![/bold green]")
+        return catalog
+
+    def read_product_ids(self) -> set:
+        if self._read_catalog is not None:
+            return set(self._read_catalog.product_ids.tolist())
+        return {product['id'] for product in self.read_products_dataframe['read_product_object']}
+
+    def load_json_file(self, json_file:str, lazy:bool=False, product_ids:set|None=None) -> None:
+        # Reads a json backup file, validates it into a compact columnar catalog (see CompactCatalog)
+        # And keeps its products dataframe in memory. Product objects are only rebuilt for the products that need a request.
+        # On lazy mode the products are kept as raw jsons, and only the ones detected as changed
+        # are converted into Product objects when building the actions
+        # With diff_workers > 1 they're kept raw too, since the diff processes parse them anyway
+        # product_ids limits the read products to the given ids. Indexed snapshots and manifests decode only those
         CONSOLE.print(f"[bold blue]Attempting to read json file {json_file}[/bold blue]")
+        self._lazy_loading = lazy
+        keep_raw = lazy or self.diff_workers > 1
+        self._read_fingerprints = load_fingerprint_manifest(json_file) # Skips hashing the read products when the snapshot has a manifest
+        
+        # JSON arrays and NDJSON files are both decoded incrementally, straight into the validation batches
+        # Delta snapshots are rebuilt on the fly from their chain, and repository manifests read from their objects
         try:
-            with open(json_file, 'r') as file:
-                json_data = json.load(file)
+            with self.metrics.phase('parse'):
+                json_items = iter_snapshot_products(json_file, product_ids)
+                if keep_raw:
+                    json_data = list(json_items)
+                else:
+                    CONSOLE.print(f"[bold blue]Working on read products[/bold blue]")
+                    if self._read_fingerprints:
+                        CONSOLE.print(f"[bold blue]Reusing the fingerprints from the snapshot manifest[/bold blue]")
+                    read_catalog = self.build_catalog(json_items, self._read_fingerprints)
+        except ValidationError:
+            raise
         except Exception as e:
             CONSOLE.print(f"[bold red]Failed reading json file {json_file}, \nException message: {e}[/bold red]")
             raise BufferError(f'Error loading file: {json_file}')
         
-        CONSOLE.print(f"[bold blue]Working on read products[/bold blue]")
-        products_list = self.parse_json(json_data)
+        if keep_raw:
+            CONSOLE.print(f"[bold blue]Keeping {len(json_data)} read products unparsed until they're needed[/bold blue]")
+            self._read_catalog = None
+            self.read_products_dataframe = pd.DataFrame({'read_product_object':json_data})
+            return
+
+        self._read_catalog = read_catalog
+        self.read_products_dataframe = read_catalog.products_frame()
 
-        self.read_products_dataframe = pd.DataFrame({'read_product_object':products_list})
+    def select_product_ids(self, json_file:str, product_ids:set|None=None, category_id:int|None=None, sku_prefix:str|None=None) -> set:
+        # Ids of the snapshot products to restore: the given ids, narrowed down by category and/or SKU prefix when provided
+        if category_id is None and sku_prefix is None:
+            return set(product_ids)
+        return {product['id'] for product in iter_snapshot_products(json_file, product_ids)
+                if matches_product_filter(product, category_id, sku_prefix)}
+
+    async def build_targeted_fetched_products_json_async(self, product_ids:set) -> None:
+        # Fetches only the products to restore by id, instead of every page in the store
+        CONSOLE.print(f"[bold blue]Attempting to fetch[/bold blue] [bold green]{len(product_ids)}[/bold green] [bold blue]products[/bold blue]")
+        self._fetched_at = utc_now()
+        self._fetched_products_json = await self._request_manager.fetch_products_by_id(sorted(product_ids))
 
     def is_ready_for_restore(self) -> bool:
         # Pre-restore validations
@@ -356,68 +928,151 @@ class ExecutionManager:
         except:
             return False
 
-    def evaluate_action(self, row:pd.Series) -> pd.Series:
-        # Row function which determines what will be done for the elements in the
-        # dataframe
-        read_product = row['read_product_object']
-        fetched_product = row['fetched_product_object']
-        action = 'IGNORE'
-
-        if pd.isna(fetched_product): #Product doesn't exist currently, so it was deleted
-            action = 'POST'
-        elif not products_are_equal(read_product, fetched_product): # Changes were made to the product
-            action = 'PUT'
-
-        return pd.Series([read_product, fetched_product, action])
-
-    def extract_product_and_variants_json(self, row:pd.Series) -> pd.Series:
-        # Row function Which evaluates the correct JSON format for each object and conerts it accordingly
-        # finally it returns the series object to be assigned in their respective json rows
-        read_obj: Product = row['read_product_object']
-        fetched_obj: Product = row['fetched_product_object']
-        action:str = row['action']
+    def extract_product_and_variants_json(self, read_obj:Product, action:str, missing_variant_ids:list, fetched_obj:Product|None=None) -> list:
+        # Evaluates the correct JSON format for the product and converts it accordingly
+        # finally it returns the product, variants and missing variants jsons.
+        # For PUT actions only the fields and variants which differ from the fetched product are kept,
+        # and the product json is None when none of its own fields changed
         # extract variants which were deleted, and format them for POST
-        missing_variants: list = exclude_missing_variants(read_obj, fetched_obj) if not pd.isna(fetched_obj) else list()
+        missing_variants: list = [read_obj.variants_dict[f'{variant}'] for variant in missing_variant_ids]
+        if missing_variants:
+            read_obj.remove_variants(missing_variant_ids)
         missing_variants = [variant.to_json('POST') for variant in missing_variants]
 
         json_read_obj = read_obj.to_json(method=action) # Convert products to the necessary json format
         variants = json_read_obj.pop('variants') if action == 'PUT' else None # And extract the variants to update separately
 
-        return pd.Series([json_read_obj, variants, missing_variants])
+        if action == 'PUT' and fetched_obj is not None:
+            json_fetched_obj = fetched_obj.to_json(method='PUT')
+            fetched_variants = {variant['id']: variant for variant in json_fetched_obj.pop('variants')}
+
+            product_changes = changed_fields(json_read_obj, json_fetched_obj)
+            json_read_obj = {'id': read_obj.id, **product_changes} if product_changes else None
+
+            variants = [{'id': variant['id'], 'product_id': variant['product_id'], **variant_changes}
+                        for variant in variants
+                        if (variant_changes := changed_fields(variant, fetched_variants.get(variant['id'], {})))]
+            variants = variants or None
+
+        return [json_read_obj, variants, missing_variants]
+
+    def confirm_lazy_actions(self, plan:pd.DataFrame, read_items:list, fetched_by_id:dict) -> pd.DataFrame:
+        # Raw fingerprints flag any difference in the jsons, so the products they mark as changed
+        # are parsed and compared again through their Product fingerprints
+        for index in plan.index[plan['action'] == PUT]:
+            read_product = self.materialize_product(read_items[index])
+            fetched_by_id[read_product.id] = Product(**fetched_by_id[read_product.id])
+            read_items[index] = read_product
+            if read_product.fingerprint == fetched_by_id[read_product.id].fingerprint:
+                plan.at[index, 'action'] = IGNORE
+        return plan
 
     def build_actions_dataframe(self) -> pd.DataFrame:
-        # Compares the read products vs the fetched products dataframes, and evaluates which actions to take
-        # Returns the dataframe with the actions included
-        df_read = self.read_products_dataframe
-        df_read['product_id'] = df_read['read_product_object'].apply(lambda x: x.id) # Extract the product ids
-        
-        CONSOLE.print(f"[bold blue]Building fetched products dataframe[/bold blue]")
-        df_fetched = pd.DataFrame({'fetched_product_object':self.parse_json(self.fetched_products_json)}) # Build fetched objects df
-        df_fetched['product_id'] = df_fetched['fetched_product_object'].apply(lambda x: x.id) # Extract the product ids for them
+        # Compares the read products vs the fetched products, and evaluates which actions to take in bulk
+        # Returns the dataframe with the actions included, for the products which need to be restored
+        read_catalog, read_items = self._read_catalog, None
+        fetched_json = latest_copies(self.fetched_products_json) # Products listed twice by the fetch are compared against their last copy
 
-        df = pd.merge(df_read, df_fetched, on='product_id', how='left') # left join read vs fetched
+        CONSOLE.print(f"[bold blue]Building fetched products catalog[/bold blue]")
+        if self.diff_workers > 1: # Parsing and diffing are sharded by product id across a process pool
+            read_items = self.read_products_dataframe['read_product_object'].to_list() # Kept raw by load_json_file
+            fetched_by_id = {product['id']: product for product in fetched_json}
+            CONSOLE.print(f"[bold blue]Evaluating actions to take on[/bold blue] [bold green]{self.diff_workers}[/bold green] [bold blue]processes[/bold blue]")
+            with self.metrics.phase('diff'): # Parsing happens on the diff processes too
+                plan = build_parallel_action_plan(read_items, fetched_json, self.diff_workers)
+        elif self._lazy_loading: # Only the products whose raw jsons differ get parsed
+            read_items = self.read_products_dataframe['read_product_object'].to_list()
+            fetched_by_id = {product['id']: product for product in fetched_json}
+            CONSOLE.print(f"[bold blue]Evaluating actions to take[/bold blue]")
+            with self.metrics.phase('diff'):
+                plan = build_action_plan(build_raw_catalog_frames(read_items), build_raw_catalog_frames(fetched_json))
+                plan = self.confirm_lazy_actions(plan, read_items, fetched_by_id)
+        else: # Both catalogs are compared through their columns, and Product objects are rebuilt only for the products with an action
+            with self.metrics.phase('parse'):
+                fetched_catalog: CompactCatalog = self.build_catalog(fetched_json)
+            CONSOLE.print(f"[bold blue]Evaluating actions to take[/bold blue]")
+            with self.metrics.phase('diff'):
+                plan = build_action_plan(read_catalog.frames(), fetched_catalog.frames())
+        if read_items is not None:
+            plan['read_product_object'] = read_items # The plan keeps the order of the read products
+        self.ignored_tasks = plan[plan['action'] == IGNORE]
         
-        CONSOLE.print(f"[bold blue]Evaluating actions to take[/bold blue]")
-        df[['read_product_object','fetched_product_object','action']] = df.apply(self.evaluate_action, axis=1) 
-        self.ignored_tasks = df[df['action'] == 'IGNORE']
-        
-        df = df[df['action'] != 'IGNORE']
+        df = plan[plan['action'] != IGNORE].copy()
         if not df.empty:
             CONSOLE.print(f"[bold blue]Extracting pertinent data[/bold blue]")
-            df[['product_json', 'variants_json', 'missing_variants_json']] = df.apply(self.extract_product_and_variants_json, axis=1) # split variant data for PUT operations
+            with self.metrics.phase('payload'):
+                if read_items is None:
+                    df['read_product_object'] = [read_catalog.product(product_id) for product_id in df['product_id']]
+                    fetched_by_id = {product_id: fetched_catalog.product(product_id) for product_id in df.loc[df['action'] == PUT, 'product_id']}
+                else:
+                    df['read_product_object'] = [self.materialize_product(read_obj) for read_obj in df['read_product_object']]
+                fetched_items = [fetched_by_id.get(product_id) for product_id in df['product_id']]
+                df['fetched_product_object'] = [Product(**item) if isinstance(item, dict) else item for item in fetched_items]
+                extracted_jsons = [self.extract_product_and_variants_json(read_obj, action, missing_variant_ids, fetched_obj) # split variant data for PUT operations
+                                   for read_obj, action, missing_variant_ids, fetched_obj
+                                   in zip(df['read_product_object'], df['action'], df['missing_variant_ids'], df['fetched_product_object'])]
+                df['product_json'], df['variants_json'], df['missing_variants_json'] = [list(column) for column in zip(*extracted_jsons)]
         return df
 
-    def execute_snapshot_restore(self):
+    def build_journal_file(self) -> str:
+        return os.path.join(SCRIPT_DIR, f'{self.store_id} - Restore {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}.journal.ndjson')
+
+    def save_run_summary(self, summary_file:str|None=None) -> str:
+        # Writes the phase timings and request metrics of this run as json, for later comparison between runs
+        summary_file = summary_file or os.path.join(SCRIPT_DIR, f'{self.store_id} - Run {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}.metrics.json')
+        save_json_data(summary_file, {'store_id': str(self.store_id), **self.metrics.summary()})
+        CONSOLE.print(f"[bold green]Run summary saved: {summary_file}[/bold green]")
+        return summary_file
+
+    async def execute_snapshot_restore_async(self, journal_file:str|None=None, executor:Executor|None=None):
+        # Restores the read products. Every planned and completed request is written to the journal file,
+        # so the restore can be resumed with resume_snapshot_restore if it gets interrupted
+        # The diff runs on the executor if one is provided
         if self.is_ready_for_restore():
-            actions: pd.DataFrame = self.build_actions_dataframe()
+            actions: pd.DataFrame = await self.run_cpu_bound(executor, self.build_actions_dataframe)
             if not actions.empty:
                 CONSOLE.print(f'[bold blue]Preparing to restore: [/bold blue] [bold green]{actions['product_id'].size}[/bold green] [bold blue]products[/bold blue]')
-                results: pd.DataFrame = asyncio.run(self._request_manager.restore_products(actions))
+                journal_file = journal_file or self.build_journal_file()
+                self._last_journal_file = journal_file
+                results: pd.DataFrame = await self._request_manager.restore_products(actions, journal_file=journal_file)
                 return results
             else:
                 CONSOLE.print(f'[bold red]No actions to perform[/bold red]')
                 return actions
 
+    def execute_snapshot_restore(self, journal_file:str|None=None):
+        return asyncio.run(self.execute_snapshot_restore_async(journal_file))
+
+    async def resume_snapshot_restore_async(self, journal_file:str, failed_only:bool=False) -> pd.DataFrame:
+        # Resumes an interrupted restore from its journal, without fetching or diffing the store again
+        # With failed_only, only the steps that failed are replayed
+        CONSOLE.print(f"[bold blue]{'Replaying the failed steps' if failed_only else 'Resuming restore'} from journal {journal_file}[/bold blue]")
+        self._last_journal_file = journal_file
+        results: pd.DataFrame = await self._request_manager.resume_restore(journal_file, failed_only=failed_only)
+        return results
+
+    def resume_snapshot_restore(self, journal_file:str, failed_only:bool=False) -> pd.DataFrame:
+        return asyncio.run(self.resume_snapshot_restore_async(journal_file, failed_only))
+
+    async def execute_targeted_restore_async(self, json_file:str, product_ids:set|None=None, category_id:int|None=None, sku_prefix:str|None=None,
+                                             lazy:bool=False, journal_file:str|None=None, executor:Executor|None=None):
+        # Restores only the selected products: reads just their records from the snapshot and fetches just them from the store,
+        # so the rest of the catalog is neither read, fetched nor diffed
+        if product_ids is None and category_id is None and sku_prefix is None:
+            raise ValueError('A targeted restore needs product ids, a category id or a SKU prefix')
+        selected_ids = await self.run_cpu_bound(executor, self.select_product_ids, json_file, product_ids, category_id, sku_prefix)
+        CONSOLE.print(f"[bold green]{len(selected_ids)}[/bold green] [bold blue]products were selected for a targeted restore[/bold blue]")
+        if not selected_ids:
+            CONSOLE.print(f'[bold red]No products in the snapshot match the selection[/bold red]')
+            return pd.DataFrame()
+
+        await self.run_cpu_bound(executor, self.load_json_file, json_file, lazy, selected_ids)
+        await self.build_targeted_fetched_products_json_async(self.read_product_ids())
+        return await self.execute_snapshot_restore_async(journal_file, executor)
+
+    def execute_targeted_restore(self, json_file:str, product_ids:set|None=None, category_id:int|None=None, sku_prefix:str|None=None, lazy:bool=False):
+        return asyncio.run(self.execute_targeted_restore_async(json_file, product_ids, category_id, sku_prefix, lazy))
+
 
 if __name__ == "__main__":
 
@@ -438,6 +1093,7 @@ if __name__ == "__main__":
     execution_manager.load_json_file(json_file)
     
     results = execution_manager.execute_snapshot_restore()
+    execution_manager.save_run_summary()
     print('yey')
     
 
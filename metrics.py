@@ -0,0 +1,250 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import re
+import threading
+import time
+
+METRIC_PREFIX:str = 'snapshot'
+LATENCY_BUCKETS:tuple = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PHASE_BUCKETS:tuple = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_label(path:str) -> str:
+    # Replaces the store, product and variant ids of an API path, so every endpoint is a single label
+    return ID_SEGMENT.sub('/{id}', path)
+
+
+class Histogram:
+    """
+    Fixed bucket histogram. Only the count of each bucket is kept, so observing a value is a bisect and an increment.
+    """
+    __slots__ = ('_buckets', '_counts', '_sum', '_count')
+
+    def __init__(self, buckets:tuple) -> None:
+        self._buckets:tuple = buckets
+        self._counts:list = [0] * (len(buckets) + 1) # The last one is +Inf
+        self._sum:float = 0.0
+        self._count:int = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def observe(self, value:float) -> None:
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def cumulative_counts(self) -> list:
+        # [upper bound, observations up to it] pairs, as Prometheus expects them
+        total, cumulative = 0, []
+        for bound, count in zip(self._buckets + (float('inf'),), self._counts):
+            total += count
+            cumulative.append([bound, total])
+        return cumulative
+
+    def quantile(self, q:float) -> float|None:
+        # Upper bound of the bucket holding the quantile, so it's an estimate on the high side
+        if not self._count:
+            return None
+        rank = q * self._count
+        for bound, total in self.cumulative_counts():
+            if total >= rank:
+                return bound if bound != float('inf') else self._buckets[-1]
+
+
+class PhaseTimer:
+    """
+    Adds up the time spent in the timed sections of a phase. Lets async generators time just their own awaits,
+    leaving out whatever their consumer does between items.
+    """
+    __slots__ = ('_seconds',)
+
+    def __init__(self) -> None:
+        self._seconds:float = 0.0
+
+    @property
+    def seconds(self):
+        return self._seconds
+
+    @contextmanager
+    def timing(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._seconds += time.perf_counter() - start
+
+
+class Metrics:
+    """
+    Timings and request counters of the snapshot and restore runs.
+    Every ExecutionManager records into its own instance, which forwards everything to its parent,
+    so each run gets its own summary while the process wide METRICS feeds the /metrics endpoint.
+    Safe to use from the executor threads that parse and diff.
+    """
+    def __init__(self, parent=None) -> None:
+        self._parent:Metrics|None = parent
+        self._lock = threading.Lock()
+        self._started_at:str = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self._started:float = time.monotonic()
+        self._requests:Counter = Counter()    # (method, endpoint, status) -> requests
+        self._latencies:dict = dict()         # (method, endpoint) -> Histogram
+        self._phases:dict = dict()            # phase -> Histogram
+        self._retries:Counter = Counter()     # reason -> retries
+        self._throttled:int = 0
+        self._bytes_sent:int = 0
+        self._bytes_received:int = 0
+        self._in_flight:int = 0
+        self._max_in_flight:int = 0
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def observe_request(self, method:str, path:str, status:int|str, seconds:float, bytes_sent:int=0, bytes_received:int=0) -> None:
+        # status is the response status code, or 'error' when the request failed without a response
+        endpoint = endpoint_label(path)
+        with self._lock:
+            self._requests[(method, endpoint, str(status))] += 1
+            histogram = self._latencies.get((method, endpoint))
+            if histogram is None:
+                histogram = self._latencies[(method, endpoint)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            self._throttled += status == 429
+            self._bytes_sent += bytes_sent
+            self._bytes_received += bytes_received
+        if self._parent:
+            self._parent.observe_request(method, path, status, seconds, bytes_sent, bytes_received)
+
+    def count_retry(self, reason:str) -> None:
+        # reason: throttled, server_error or transport_error
+        with self._lock:
+            self._retries[reason] += 1
+        if self._parent:
+            self._parent.count_retry(reason)
+
+    def request_started(self) -> None:
+        with self._lock:
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        if self._parent:
+            self._parent.request_started()
+
+    def request_finished(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        if self._parent:
+            self._parent.request_finished()
+
+    def observe_phase(self, phase:str, seconds:float) -> None:
+        with self._lock:
+            histogram = self._phases.get(phase)
+            if histogram is None:
+                histogram = self._phases[phase] = Histogram(PHASE_BUCKETS)
+            histogram.observe(seconds)
+        if self._parent:
+            self._parent.observe_phase(phase, seconds)
+
+    @contextmanager
+    def phase(self, phase:str):
+        # Times the block as one execution of the phase (fetch, parse, diff, payload or execute), even if it raises
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - start)
+
+    @contextmanager
+    def timed_sections(self, phase:str):
+        # Like phase, but only the sections timed through the yielded PhaseTimer count, observed as one execution of the phase
+        timer = PhaseTimer()
+        try:
+            yield timer
+        finally:
+            self.observe_phase(phase, timer.seconds)
+
+    def summary(self) -> dict:
+        # Machine readable summary of everything recorded so far. Latency percentiles are bucket upper bounds
+        with self._lock:
+            by_status, by_endpoint = Counter(), dict()
+            for (method, endpoint, status), count in self._requests.items():
+                by_status[status] += count
+            for (method, endpoint), histogram in sorted(self._latencies.items()):
+                by_endpoint[f'{method} {endpoint}'] = {
+                    'requests': histogram.count,
+                    'mean_ms': round(1000 * histogram.sum / histogram.count, 2),
+                    'p50_ms': round(1000 * histogram.quantile(0.5), 2),
+                    'p99_ms': round(1000 * histogram.quantile(0.99), 2)
+                }
+            return {
+                'started_at': self._started_at,
+                'elapsed_seconds': round(time.monotonic() - self._started, 3),
+                'phases': {phase: {'runs': histogram.count, 'seconds': round(histogram.sum, 3)} for phase, histogram in self._phases.items()},
+                'requests': sum(by_status.values()),
+                'requests_by_status': dict(sorted(by_status.items())),
+                'endpoints': by_endpoint,
+                'throttled': self._throttled,
+                'retries': dict(self._retries),
+                'bytes_sent': self._bytes_sent,
+                'bytes_received': self._bytes_received,
+                'max_in_flight': self._max_in_flight
+            }
+
+    def render_prometheus(self) -> str:
+        # Prometheus text exposition format (version 0.0.4)
+        lines = []
+        def metric(name:str, kind:str, description:str) -> str:
+            name = f'{METRIC_PREFIX}_{name}'
+            lines.extend([f'# HELP {name} {description}', f'# TYPE {name} {kind}'])
+            return name
+
+        def histogram_lines(name:str, labels:str, histogram:Histogram) -> None:
+            for bound, total in histogram.cumulative_counts():
+                upper_bound = '+Inf' if bound == float('inf') else bound
+                lines.append(f'{name}_bucket{{{labels},le="{upper_bound}"}} {total}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+            lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+        with self._lock:
+            name = metric('requests_total', 'counter', 'API requests sent, by method, endpoint and status code')
+            for (method, endpoint, status), count in sorted(self._requests.items()):
+                lines.append(f'{name}{{method="{method}",endpoint="{endpoint}",status="{status}"}} {count}')
+
+            name = metric('request_duration_seconds', 'histogram', 'API request latency, by method and endpoint')
+            for (method, endpoint), histogram in sorted(self._latencies.items()):
+                histogram_lines(name, f'method="{method}",endpoint="{endpoint}"', histogram)
+
+            name = metric('throttled_requests_total', 'counter', 'API requests answered with a 429')
+            lines.append(f'{name} {self._throttled}')
+
+            name = metric('retries_total', 'counter', 'API requests retried, by reason')
+            for reason, count in sorted(self._retries.items()):
+                lines.append(f'{name}{{reason="{reason}"}} {count}')
+
+            name = metric('requests_in_flight', 'gauge', 'API requests currently in flight')
+            lines.append(f'{name} {self._in_flight}')
+
+            name = metric('sent_bytes_total', 'counter', 'Request body bytes sent to the API')
+            lines.append(f'{name} {self._bytes_sent}')
+            name = metric('received_bytes_total', 'counter', 'Response body bytes received from the API')
+            lines.append(f'{name} {self._bytes_received}')
+
+            name = metric('phase_duration_seconds', 'histogram', 'Duration of the fetch, parse, diff, payload and execute phases')
+            for phase, histogram in sorted(self._phases.items()):
+                histogram_lines(name, f'phase="{phase}"', histogram)
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
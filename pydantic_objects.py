@@ -1,7 +1,7 @@
-from pydantic import BaseModel, conint, PrivateAttr
+from pydantic import BaseModel, conint, PrivateAttr, TypeAdapter
 from typing import Optional, List, Union, Dict
 import json
-from auxiliary_functions import jsonify
+from auxiliary_functions import serialize, canonical_hash, serialization_plan, project_raw
 
 class LanguageString(BaseModel):
     es: Optional[str] = None
@@ -51,11 +51,17 @@ class Variant(BaseModel):
         'PUT': ['created_at', 'updated_at', '_exclusion_list'],
         'POST': ['id', 'created_at', 'updated_at', 'image_id', 'inventory_levels', 'position', '_exclusion_list']
     })
+    _fingerprint: Optional[str] = PrivateAttr(default=None)
 
+    @property
+    def fingerprint(self) -> str:
+        # Hash of the PUT representation. Computed once, then cached
+        if self._fingerprint is None:
+            self._fingerprint = canonical_hash(self.to_json('PUT'))
+        return self._fingerprint
 
     def to_json(self, method='FULL') -> dict:
-        obj = self.model_copy()
-        json_object = jsonify(obj, method)
+        json_object = serialize(self, method)
         return json_object
                             
 
@@ -123,6 +129,7 @@ class Product(BaseModel):
         'PUT': ['created_at','canonical_url', 'updated_at',  'images', '_exclusion_list'],
         'POST': ['id','canonical_url', 'created_at', 'updated_at', 'images', '_exclusion_list']
     })
+    _fingerprint: Optional[str] = PrivateAttr(default=None)
 
     @property
     def variants_list(self) -> list:
@@ -136,14 +143,39 @@ class Product(BaseModel):
     def variants_dict(self) -> dict: 
         return {f'{variant.id}': variant for variant in self.variants}
 
+    @property
+    def fingerprint(self) -> str:
+        # Hash of the PUT representation, which is the one used to compare products. Computed once, then cached
+        if self._fingerprint is None:
+            self._fingerprint = canonical_hash(self.to_json('PUT'))
+        return self._fingerprint
+
+    @classmethod
+    def raw_fingerprint(cls, product_json:dict) -> str:
+        # Hash of the PUT fields of an unvalidated product json. Only comparable against other raw fingerprints
+        return canonical_hash(project_raw(product_json, serialization_plan(cls, 'PUT')))
+
+    def fingerprint_entry(self) -> dict:
+        # Fingerprints of the product and its variants, as stored on the snapshot manifest
+        return {
+            'fingerprint': self.fingerprint,
+            'variants': {str(variant.id): variant.fingerprint for variant in self.variants}
+        }
+
+    def load_fingerprints(self, manifest_entry:dict) -> None:
+        # Reuses the fingerprints stored on a snapshot manifest instead of computing them
+        self._fingerprint = manifest_entry['fingerprint']
+        variant_fingerprints = manifest_entry['variants']
+        for variant in self.variants:
+            variant._fingerprint = variant_fingerprints.get(str(variant.id))
+
     def tweak(self, json_object):
         json_object['categories'] = [item['id'] for item in json_object['categories']]
         return json_object
         
 
     def to_json(self, method='FULL') -> dict:
-        obj = self.model_copy()
-        json_object = jsonify(obj, method)
+        json_object = serialize(self, method)
         json_object = self.tweak(json_object)
         return json_object
     
@@ -151,11 +183,15 @@ class Product(BaseModel):
         for variant in variants_to_remove:
             variant = self.variants_dict[f'{variant}']
             self.variants.remove(variant)
+        self._fingerprint = None # The content changed, so it needs to be hashed again
     
     def __repr__(self):
         return f'Product Object: id={self.id}, name={self.name.es}, variants={self.variants_list}, categories={self.categories_list}'
 
 
+PRODUCT_LIST_ADAPTER = TypeAdapter(List[Product]) # Validates whole product lists in bulk, straight from json bytes
+
+
 if __name__ == '__main__':
     json_file = '3734860 - Snapshot product 184139334.json'
     
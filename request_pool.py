@@ -0,0 +1,215 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Iterable
+import asyncio
+import random
+import time
+import httpx
+
+DEFAULT_BACKOFF:float = 1.0
+MAX_BACKOFF:float = 30.0
+
+
+def seconds_until_slots(headers:httpx.Headers, slots:int) -> float|None:
+    # Estimates how long the API leaky bucket needs to free the requested amount of slots
+    # based on the x-rate-limit-* headers. Returns None when the headers are not present
+    try:
+        bucket_size = int(headers['x-rate-limit-limit'])
+        remaining = int(headers['x-rate-limit-remaining'])
+        reset = int(headers['x-rate-limit-reset']) / 1000 # Milliseconds until the bucket is empty
+    except (KeyError, ValueError):
+        return None
+
+    used = bucket_size - remaining
+    needed = slots - remaining
+    if used <= 0 or needed <= 0:
+        return 0.0
+    return reset * min(needed, used) / used
+
+def backoff_delay(attempt:int) -> float:
+    # Exponential backoff with full jitter for the failed attempt number (starting at 0)
+    return random.uniform(0, min(MAX_BACKOFF, DEFAULT_BACKOFF * 2 ** attempt))
+
+def retry_after(response:httpx.Response, slots:int=1) -> float:
+    # Seconds to wait before retrying a throttled request
+    if 'retry-after' in response.headers:
+        try:
+            return float(response.headers['retry-after'])
+        except ValueError:
+            pass
+    wait = seconds_until_slots(response.headers, slots)
+    return wait if wait else DEFAULT_BACKOFF
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limiter for the API requests.
+    Starts at max_limit, and adjusts the amount of requests allowed in flight according to
+    the rate-limit headers and 429 responses returned by the API (AIMD).
+    """
+    def __init__(self, max_limit:int=40, min_limit:int=1) -> None:
+        self._max_limit:int = max_limit
+        self._min_limit:int = min_limit
+        self._limit:int = max_limit
+        self._in_flight:int = 0
+        self._waiters:deque = deque()
+        self._resume_at:float = 0.0
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def max_limit(self):
+        return self._max_limit
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    async def acquire(self) -> None:
+        # Waits for a free slot, and for any throttling pause to end
+        while True:
+            delay = self._resume_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if self._in_flight < self._limit:
+                break
+            await self._wait()
+        self._in_flight += 1
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._wake()
+
+    async def _wait(self) -> None:
+        # Futures are created on demand so the limiter isn't bound to a single event loop
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            else: # It was already woken up, so the wake up goes to the next in line
+                self._wake()
+            raise
+
+    def _wake(self) -> None:
+        free_slots = self._limit - self._in_flight
+        while free_slots > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
+
+    def pause(self, seconds:float) -> None:
+        # Holds every new request until the given amount of seconds has passed
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def update_from_response(self, response:httpx.Response) -> None:
+        # Adjusts the limit based on the response received.
+        # 429s halve the limit and pause the requests, a nearly empty bucket shrinks it by one,
+        # and any other response grows it back by one up to max_limit.
+        if response.status_code == 429:
+            self._limit = max(self._min_limit, self._limit // 2)
+            self.pause(retry_after(response, self._limit))
+            return
+
+        try:
+            bucket_size = int(response.headers['x-rate-limit-limit'])
+            remaining = int(response.headers['x-rate-limit-remaining'])
+        except (KeyError, ValueError):
+            bucket_size, remaining = None, None
+
+        if remaining is not None and remaining <= max(1, bucket_size // 10):
+            self._limit = max(self._min_limit, self._limit - 1)
+            if remaining == 0:
+                self.pause(seconds_until_slots(response.headers, 1) or DEFAULT_BACKOFF)
+        else:
+            self._limit = min(self._max_limit, self._limit + 1)
+            self._wake()
+
+
+class FairBudget:
+    """
+    Global budget of requests in flight, shared by the request managers of several stores.
+    When it's exhausted the waiting requests are queued by store, and every freed slot goes to the
+    next store in line (round robin), so a store with many waiting requests can't starve the others.
+    """
+    def __init__(self, limit:int=200) -> None:
+        self._limit:int = limit
+        self._in_flight:int = 0
+        self._waiters:dict[str, deque] = dict() # Store -> its waiting futures. Insertion order is the round robin order
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @asynccontextmanager
+    async def slot(self, key:str):
+        await self.acquire(key)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    async def acquire(self, key:str) -> None:
+        if self._in_flight < self._limit and not self._waiters:
+            self._in_flight += 1
+            return
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled(): # The slot was granted right before the cancellation
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._grant()
+
+    def _grant(self) -> None:
+        # Hands the free slots out one store at a time. A store that still has requests waiting goes back to the end of the line
+        while self._in_flight < self._limit and self._waiters:
+            key = next(iter(self._waiters))
+            waiters = self._waiters.pop(key)
+            waiter = waiters.popleft()
+            if waiters:
+                self._waiters[key] = waiters
+            if not waiter.done(): # Cancelled waiters are simply dropped
+                self._in_flight += 1
+                waiter.set_result(None)
+
+
+async def run_worker_pool(items:Iterable, handler:Callable[..., Awaitable], workers:int) -> None:
+    # Runs handler(item) for every item, with a fixed amount of workers pulling from the same iterator.
+    # Each worker starts the next item as soon as it finishes the previous one, so a slow item
+    # only holds its own worker. The first exception cancels the remaining workers and is re-raised.
+    iterator = iter(items)
+
+    async def worker():
+        for item in iterator:
+            await handler(item)
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            for _ in range(workers):
+                group.create_task(worker())
+    except ExceptionGroup as group_error:
+        raise group_error.exceptions[0]
@@ -0,0 +1,193 @@
+from collections import Counter
+from datetime import datetime
+import argparse
+import httpx
+import json
+import os
+
+ERROR_BODY_LIMIT:int = 500
+NON_IDEMPOTENT_METHODS:tuple = ('POST',) # Sending them twice creates the resource twice
+
+
+def step_outcome(column:str, method:str, response:httpx.Response|Exception, seconds:float) -> dict:
+    # Compact result of an executed step, so the response and its body can be released right away
+    # Only a truncated error body is kept, and the id of the resource created by successful POSTs
+    outcome = {'operation': column.removesuffix('_response'), 'method': method, 'status': None,
+               'latency_ms': round(seconds * 1000, 1), 'resource_id': None, 'error': None}
+    if not isinstance(response, httpx.Response):
+        outcome['error'] = f'{type(response).__name__}: {response}'[:ERROR_BODY_LIMIT]
+        return outcome
+
+    outcome['status'] = response.status_code
+    if not response.is_success:
+        outcome['error'] = response.text[:ERROR_BODY_LIMIT]
+    elif method == 'POST':
+        try:
+            body = response.json()
+            outcome['resource_id'] = body.get('id') if isinstance(body, dict) else None
+        except ValueError:
+            pass
+    return outcome
+
+
+class RestoreSummary:
+    """
+    Running counts of a restore: executed operations by action and status, their total latency,
+    and the products whose last executed step failed.
+    """
+    def __init__(self) -> None:
+        self._counts:Counter = Counter() # (method operation, status) -> operations
+        self._latency_ms:float = 0.0
+        self._products:set = set()
+        self._failed_products:set = set()
+
+    @property
+    def failed_products(self):
+        return self._failed_products
+
+    def add(self, product_id, outcome:dict) -> None:
+        self._counts[(f"{outcome['method']} {outcome['operation']}", str(outcome['status'] or 'error'))] += 1
+        self._latency_ms += outcome.get('latency_ms') or 0.0
+        self._products.add(product_id)
+        if RestoreJournal.is_success(outcome):
+            self._failed_products.discard(product_id)
+        else:
+            self._failed_products.add(product_id)
+
+    def to_dict(self) -> dict:
+        by_action = dict()
+        for (action, status), count in sorted(self._counts.items()):
+            by_action.setdefault(action, dict())[status] = count
+        return {
+            'products': len(self._products),
+            'failed_products': len(self._failed_products),
+            'operations': sum(self._counts.values()),
+            'by_action': by_action,
+            'latency_ms': round(self._latency_ms, 1)
+        }
+
+
+class RestoreJournal:
+    """
+    Append-only journal of a restore, stored as NDJSON.
+    The whole plan is written before any request is sent, and every executed step is appended as it completes,
+    so an interrupted restore can be resumed from the file alone.
+    Records:
+        {"type": "header", "store_id": ..., "created_at": ...}
+        {"type": "plan", "product_id": ..., "steps": [[response_column, method, url, payload], ...]}
+        {"type": "started", "product_id": ..., "step": ..., "method": ...}   Written right before sending a non idempotent step
+        {"type": "done", "product_id": ..., "step": ..., "operation": ..., "method": ..., "status": ..., "latency_ms": ..., "resource_id": ..., "error": ...}
+    The done records are the restore result log: failed steps can be replayed from it with load(failed_only=True).
+    A started step without a done record was sent but its outcome was lost, so it may have been applied: see in_doubt.
+    """
+    def __init__(self, journal_file:str) -> None:
+        self._journal_file:str = journal_file
+        self._file = None
+        self._summary:RestoreSummary = RestoreSummary() # Steps recorded or loaded through this journal
+        self._in_doubt:dict = dict() # product_id -> pending step which was started but never recorded, filled by load
+
+    @property
+    def journal_file(self):
+        return self._journal_file
+
+    @property
+    def summary(self):
+        return self._summary
+
+    @property
+    def in_doubt(self):
+        return self._in_doubt
+
+    def __enter__(self):
+        self._file = open(self.journal_file, 'a', encoding='utf-8')
+        if self._file.tell() and not self.ends_with_newline():
+            self._file.write('\n') # Ends the line cut short by an interruption, so the next record isn't appended onto it
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+        self._file = None
+
+    def ends_with_newline(self) -> bool:
+        with open(self.journal_file, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) == b'\n'
+
+    def append(self, record:dict) -> None:
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+
+    def write_plan(self, store_id:str, job_chains:dict) -> None:
+        # Stores the header and the steps for every product, and makes sure they reach the disk before the restore starts
+        self.append({'type': 'header', 'store_id': str(store_id), 'created_at': datetime.now().isoformat()})
+        for product_id, job_chain in job_chains.items():
+            steps = [[column, method, request_content[0], request_content[1]] for column, method, request_content in job_chain]
+            self.append({'type': 'plan', 'product_id': product_id, 'steps': steps})
+        os.fsync(self._file.fileno())
+
+    def record_started(self, product_id, step:int, method:str) -> None:
+        # Marks a non idempotent step as sent. Written (and flushed) before the request goes out, so if the process dies
+        # before its outcome is recorded, a resume knows the request may have been applied instead of blindly sending it again
+        self.append({'type': 'started', 'product_id': product_id, 'step': step, 'method': method})
+
+    def record_step(self, product_id, step:int, outcome:dict) -> None:
+        # Appends the outcome of an executed step, as built by step_outcome
+        self.append({'type': 'done', 'product_id': product_id, 'step': step, **outcome})
+        self._summary.add(product_id, outcome)
+
+    @staticmethod
+    def is_success(record:dict) -> bool:
+        return record['status'] is not None and 200 <= record['status'] < 300
+
+    def load(self, failed_only:bool=False) -> list:
+        # Reads the journal back. Returns [store_id, job_chains, start_steps]:
+        # the planned chains by product id, and the first step of each chain that hasn't succeeded yet
+        # With failed_only, only the chains whose pending step was executed and failed (or is in doubt) are returned, to replay just those
+        # The chains whose pending step was started without an outcome are left on in_doubt
+        store_id, job_chains, succeeded, failed, open_steps = None, dict(), dict(), dict(), set()
+        with open(self.journal_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError: # A line cut short by the interruption
+                    continue
+                match record['type']:
+                    case 'header':
+                        store_id = store_id or record['store_id']
+                    case 'plan':
+                        job_chains[record['product_id']] = [[column, method, [url, payload]] for column, method, url, payload in record['steps']]
+                    case 'started':
+                        open_steps.add((record['product_id'], record['step']))
+                    case 'done':
+                        open_steps.discard((record['product_id'], record['step']))
+                        outcomes = succeeded if self.is_success(record) else failed
+                        outcomes.setdefault(record['product_id'], set()).add(record['step'])
+                        if 'method' in record: # Journals written before the result log only have the status
+                            self._summary.add(record['product_id'], record)
+
+        # Chains stop at their first failure, so the succeeded steps always are a prefix of the chain
+        start_steps = dict()
+        for product_id, job_chain in job_chains.items():
+            start = 0
+            while start in succeeded.get(product_id, set()):
+                start += 1
+            start_steps[product_id] = start
+        self._in_doubt = {product_id: step for product_id, step in open_steps if start_steps.get(product_id) == step}
+        if failed_only:
+            job_chains = {product_id: job_chain for product_id, job_chain in job_chains.items()
+                          if start_steps[product_id] in failed.get(product_id, set()) or product_id in self._in_doubt}
+            start_steps = {product_id: start_steps[product_id] for product_id in job_chains}
+        return [store_id, job_chains, start_steps]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarizes the results of a restore journal')
+    parser.add_argument('journal_file')
+    args = parser.parse_args()
+
+    journal = RestoreJournal(args.journal_file)
+    store_id, job_chains, start_steps = journal.load(failed_only=True)
+    print(json.dumps({'store_id': store_id, **journal.summary.to_dict(), 'replayable_products': sorted(job_chains),
+                      'in_doubt_products': sorted(journal.in_doubt)}, indent=2))
@@ -0,0 +1,204 @@
+from rich.console import Console
+import argparse
+import heapq
+import itertools
+import json
+import os
+import re
+import tempfile
+from auxiliary_functions import changed_fields, load_manifest_header
+from delta_snapshots import DeltaSnapshot, iter_snapshot_products
+
+CONSOLE = Console()
+
+RUN_SIZE:int = 20000 # Products sorted in memory at a time when a snapshot isn't stored in id order
+IGNORED_FIELDS:tuple = ('updated_at',) # Changed by the API on every write, even when nothing else changed
+RAW_RECORD_TEMPLATE:str = '{{"type": "{type}", "product_id": {product_id}, "product": {product}}}'
+LINE_ID_PATTERN = re.compile(r'\{"id": ?(\d+)[,}]') # Products are written with their id first, so it's read without decoding the line
+
+
+class UnsortedSnapshotError(Exception):
+    def __init__(self, snapshot_file:str) -> None:
+        super().__init__(f'{snapshot_file} is not stored in product id order')
+        self.snapshot_file = snapshot_file
+
+
+def iter_ndjson_entries(file):
+    # Yields [product_id, line] for every line of an NDJSON file. Lines are only decoded when their id can't be matched
+    for line in file:
+        if not line.strip():
+            continue
+        if match := LINE_ID_PATTERN.match(line):
+            yield (int(match.group(1)), line.rstrip('\n'))
+        else:
+            product = json.loads(line)
+            yield (product['id'], product)
+
+def iter_snapshot_entries(snapshot_file:str):
+    # Yields [product_id, product] for every product of the snapshot, where the product is the raw json line on NDJSON snapshots,
+    # so the ones that didn't change can be compared without decoding them, and the decoded json on the rest of the formats
+    if snapshot_file.endswith('.ndjson') and not DeltaSnapshot.is_delta(snapshot_file):
+        with open(snapshot_file, 'r', encoding='utf-8') as file:
+            yield from iter_ndjson_entries(file)
+    else:
+        yield from ((product['id'], product) for product in iter_snapshot_products(snapshot_file))
+
+def collapse_duplicates(entries):
+    # Keeps only the last of consecutive entries with the same product id. A page offset fetch over a catalog
+    # that changes meanwhile can store a product twice, and the merge join expects each id once per stream
+    previous_entry = None
+    for entry in entries:
+        if previous_entry is not None and entry[0] != previous_entry[0]:
+            yield previous_entry
+        previous_entry = entry
+    if previous_entry is not None:
+        yield previous_entry
+
+def iter_in_id_order(snapshot_file:str):
+    # Yields the products of the snapshot as stored, making sure their ids never go down. Repeated ids are collapsed
+    def checked_entries():
+        previous_id = None
+        for entry in iter_snapshot_entries(snapshot_file):
+            if previous_id is not None and entry[0] < previous_id:
+                raise UnsortedSnapshotError(snapshot_file)
+            previous_id = entry[0]
+            yield entry
+    return collapse_duplicates(checked_entries())
+
+def iter_sorted_products(snapshot_file:str, run_size:int=RUN_SIZE, temp_dir:str|None=None):
+    # Yields the products of the snapshot in product id order, sorting them externally:
+    # runs of run_size products are sorted in memory and written to temporary NDJSON files, which are then merged
+    # Only one run, and one product per run while merging, is kept in memory.
+    # Sorting and merging are stable, so of a repeated id the copy stored last is the one kept
+    yield from collapse_duplicates(iter_sorted_runs(snapshot_file, run_size, temp_dir))
+
+def iter_sorted_runs(snapshot_file:str, run_size:int=RUN_SIZE, temp_dir:str|None=None):
+    with tempfile.TemporaryDirectory(dir=temp_dir) as runs_dir:
+        run_files, entries = [], iter_snapshot_entries(snapshot_file)
+        while run := list(itertools.islice(entries, run_size)):
+            run.sort(key=lambda entry: entry[0])
+            if not run_files and len(run) < run_size: # Fits in a single run, no need to touch the disk
+                yield from run
+                return
+            run_files.append(os.path.join(runs_dir, f'run_{len(run_files)}.ndjson'))
+            with open(run_files[-1], 'w', encoding='utf-8') as file:
+                file.writelines((product if isinstance(product, str) else json.dumps(product)) + '\n' for _, product in run)
+            del run
+
+        CONSOLE.print(f"[bold blue]Merging[/bold blue][bold green] {len(run_files)}[/bold green][bold blue] sorted runs of {os.path.basename(snapshot_file)}[/bold blue]")
+        run_readers = [open(run_file, 'r', encoding='utf-8') for run_file in run_files]
+        try:
+            yield from heapq.merge(*(iter_ndjson_entries(reader) for reader in run_readers), key=lambda entry: entry[0])
+        finally:
+            for reader in run_readers:
+                reader.close()
+
+def as_json(product:str|dict) -> dict:
+    return json.loads(product) if isinstance(product, str) else product
+
+def field_changes(old_json:dict, new_json:dict, ignored_fields:tuple=IGNORED_FIELDS) -> dict:
+    # Top level fields added, removed or changed between both versions, as field -> [old value, new value]
+    fields = changed_fields(new_json, old_json).keys() | changed_fields(old_json, new_json).keys()
+    return {field: [old_json.get(field), new_json.get(field)] for field in sorted(fields) if field not in ignored_fields}
+
+def diff_product(old_json:dict, new_json:dict, ignored_fields:tuple=IGNORED_FIELDS) -> dict|None:
+    # Field level changes of a product and its variants, matched by variant id. None when nothing changed
+    fields = field_changes(old_json, new_json, ('variants', *ignored_fields))
+    old_variants = {variant['id']: variant for variant in old_json.get('variants') or []}
+    new_variants = {variant['id']: variant for variant in new_json.get('variants') or []}
+    variants_changed = []
+    for variant_id in old_variants.keys() & new_variants.keys():
+        if old_variants[variant_id] != new_variants[variant_id]:
+            if variant_fields := field_changes(old_variants[variant_id], new_variants[variant_id], ignored_fields):
+                variants_changed.append({'variant_id': variant_id, 'fields': variant_fields})
+    variants_added = sorted(new_variants.keys() - old_variants.keys())
+    variants_removed = sorted(old_variants.keys() - new_variants.keys())
+
+    if not (fields or variants_changed or variants_added or variants_removed):
+        return None
+    return {'type': 'changed', 'product_id': new_json['id'], 'fields': fields, 'variants_added': variants_added,
+            'variants_removed': variants_removed, 'variants_changed': sorted(variants_changed, key=lambda change: change['variant_id'])}
+
+def iter_snapshot_diff(old_entries, new_entries, ignored_fields:tuple=IGNORED_FIELDS):
+    # Merge join of two streams of [product_id, product] sorted by id, as yielded by iter_in_id_order or iter_sorted_products.
+    # Products are raw json lines or decoded jsons. Equal lines are skipped without decoding them. Yields the records of the diff:
+    #     {"type": "added", "product_id": ..., "product": {...}}
+    #     {"type": "removed", "product_id": ..., "product": {...}}
+    #     {"type": "changed", "product_id": ..., "fields": {field: [old, new]}, "variants_added": [...], "variants_removed": [...], "variants_changed": [...]}
+    # The product of added and removed records is kept as read (a raw json line or a decoded json, see as_json),
+    # so it can be written back without decoding it. Only the current product of each stream is held, so memory doesn't grow with the catalogs
+    old_entries, new_entries = iter(old_entries), iter(new_entries)
+    old_entry, new_entry = next(old_entries, None), next(new_entries, None)
+    while old_entry is not None or new_entry is not None:
+        if new_entry is None or (old_entry is not None and old_entry[0] < new_entry[0]):
+            yield {'type': 'removed', 'product_id': old_entry[0], 'product': old_entry[1]}
+            old_entry = next(old_entries, None)
+        elif old_entry is None or new_entry[0] < old_entry[0]:
+            yield {'type': 'added', 'product_id': new_entry[0], 'product': new_entry[1]}
+            new_entry = next(new_entries, None)
+        else:
+            if old_entry[1] != new_entry[1]:
+                old_json, new_json = as_json(old_entry[1]), as_json(new_entry[1])
+                if old_json != new_json and (change := diff_product(old_json, new_json, ignored_fields)):
+                    yield change
+            old_entry, new_entry = next(old_entries, None), next(new_entries, None)
+
+def dump_record(record:dict) -> str:
+    # Raw json lines are embedded as they are, instead of decoding and encoding them again
+    if isinstance(record.get('product'), str):
+        return RAW_RECORD_TEMPLATE.format(**record)
+    return json.dumps(record)
+
+def write_snapshot_diff(old_entries, new_entries, output_file:str, ignored_fields:tuple=IGNORED_FIELDS) -> dict:
+    # Writes the diff records as NDJSON, followed by a summary record with the amount of each type. Returns the summary
+    summary = {'type': 'summary', 'added': 0, 'removed': 0, 'changed': 0, 'variants_added': 0, 'variants_removed': 0, 'variants_changed': 0}
+    with open(output_file, 'w', encoding='utf-8') as file:
+        for record in iter_snapshot_diff(old_entries, new_entries, ignored_fields):
+            summary[record['type']] += 1
+            if record['type'] == 'changed':
+                for key in ('variants_added', 'variants_removed', 'variants_changed'):
+                    summary[key] += len(record[key])
+            file.write(dump_record(record) + '\n')
+        file.write(json.dumps(summary) + '\n')
+    return summary
+
+def diff_snapshots(old_snapshot:str, new_snapshot:str, output_file:str|None=None, ignored_fields:tuple=IGNORED_FIELDS,
+                   run_size:int=RUN_SIZE, temp_dir:str|None=None) -> list:
+    # Diffs two snapshots of any format (json, NDJSON, delta, repository manifest or indexed) without the API.
+    # Snapshots whose manifest says they weren't stored in id order (pages are stored as they are fetched) are sorted externally.
+    # The rest are streamed straight into the merge join, and if one turns out not to be in id order after all,
+    # it's sorted externally and the diff is written again. Returns [output_file, summary]
+    output_file = output_file or f'{os.path.splitext(new_snapshot)[0]} - Diff.ndjson'
+    sorted_snapshots = {snapshot_file for snapshot_file in (old_snapshot, new_snapshot)
+                        if load_manifest_header(snapshot_file).get('sorted_by_id') is False}
+
+    def entries_of(snapshot_file:str):
+        if snapshot_file in sorted_snapshots:
+            return iter_sorted_products(snapshot_file, run_size, temp_dir)
+        return iter_in_id_order(snapshot_file)
+
+    CONSOLE.print(f"[bold blue]Comparing {os.path.basename(old_snapshot)} against {os.path.basename(new_snapshot)}[/bold blue]")
+    while True:
+        try:
+            summary = write_snapshot_diff(entries_of(old_snapshot), entries_of(new_snapshot), output_file, ignored_fields)
+            break
+        except UnsortedSnapshotError as e:
+            CONSOLE.print(f"[bold yellow]{e}, sorting it externally[/bold yellow]")
+            sorted_snapshots.add(e.snapshot_file)
+
+    CONSOLE.print(f"[bold green]{summary['added']} added, {summary['removed']} removed and {summary['changed']} changed products: {output_file}[/bold green]")
+    return [output_file, summary]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares two stored snapshots, without touching the API')
+    parser.add_argument('old_snapshot')
+    parser.add_argument('new_snapshot')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--run-size', type=int, default=RUN_SIZE, help='Products sorted in memory at a time, for snapshots not stored in id order')
+    parser.add_argument('--include-timestamps', action='store_true', help='Also report changes to updated_at')
+    args = parser.parse_args()
+
+    output_file, summary = diff_snapshots(args.old_snapshot, args.new_snapshot, args.output,
+                                          ignored_fields=() if args.include_timestamps else IGNORED_FIELDS, run_size=args.run_size)
+    print(json.dumps(summary, indent=2))
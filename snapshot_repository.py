@@ -0,0 +1,171 @@
+from contextlib import contextmanager
+from datetime import datetime
+from rich.console import Console
+import argparse
+import fcntl
+import gzip
+import json
+import os
+from auxiliary_functions import iter_json_items, save_json_data, canonical_bytes, bytes_hash
+
+CONSOLE = Console()
+
+REPOSITORY_VERSION:int = 1
+REPOSITORY_MANIFEST_EXTENSION:str = 'repo.json'
+LOCK_FILENAME:str = '.lock'
+OBJECT_COMPRESSION_LEVEL:int = 6
+
+
+class SnapshotRepository:
+    """
+    Content addressed snapshot storage. Every distinct product json is stored once, gzipped, under its content hash:
+        objects/<hash[:2]>/<hash>.json.gz
+    and every snapshot is a small manifest of [product_id, hash] pairs:
+        manifests/<store_id> - Snapshot <timestamp>.repo.json
+    Products that didn't change between snapshots are shared, so disk use and write time grow with the churn only.
+    Snapshots being written hold a shared lock on the repository, and garbage collection an exclusive one,
+    so objects reused by a snapshot that has no manifest yet are never collected.
+    """
+    def __init__(self, root_dir:str) -> None:
+        self._root_dir:str = root_dir
+        self._objects_dir:str = os.path.join(root_dir, 'objects')
+        self._manifests_dir:str = os.path.join(root_dir, 'manifests')
+
+    @property
+    def root_dir(self):
+        return self._root_dir
+
+    @property
+    def manifests_dir(self):
+        return self._manifests_dir
+
+    @classmethod
+    def for_manifest(cls, manifest_file:str):
+        # The repository a manifest belongs to
+        return cls(os.path.dirname(os.path.dirname(os.path.abspath(manifest_file))))
+
+    @staticmethod
+    def is_manifest(snapshot_file:str) -> bool:
+        return snapshot_file.endswith(f'.{REPOSITORY_MANIFEST_EXTENSION}')
+
+    def object_file(self, content_hash:str) -> str:
+        return os.path.join(self._objects_dir, content_hash[:2], f'{content_hash}.json.gz')
+
+    @contextmanager
+    def lock(self, exclusive:bool=False, blocking:bool=True):
+        # Shared while writing snapshots, exclusive while collecting garbage. Held through an flock on the lock file,
+        # so it works across processes. Raises BlockingIOError when not blocking and the lock is taken
+        os.makedirs(self.root_dir, exist_ok=True)
+        with open(os.path.join(self.root_dir, LOCK_FILENAME), 'a') as lock_file:
+            fcntl.flock(lock_file, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB))
+            try:
+                yield self
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def put_product(self, product_json:dict) -> list:
+        # Stores the product unless an identical one is already there. Returns [content_hash, is_new]
+        # Same canonical form as canonical_hash, so the key is the hash of the stored content
+        content = canonical_bytes(product_json)
+        content_hash = bytes_hash(content)
+        object_file = self.object_file(content_hash)
+        if os.path.exists(object_file):
+            return [content_hash, False]
+
+        # Written aside and renamed, so an interrupted write never leaves a broken object behind
+        os.makedirs(os.path.dirname(object_file), exist_ok=True)
+        partial_file = f'{object_file}.{os.getpid()}.part'
+        with open(partial_file, 'wb') as file:
+            file.write(gzip.compress(content, compresslevel=OBJECT_COMPRESSION_LEVEL, mtime=0))
+        os.replace(partial_file, object_file)
+        return [content_hash, True]
+
+    def put_products(self, products_json:list) -> list:
+        # Stores a page of products. Returns [[product_id, content_hash] pairs, amount of new objects]
+        products, new_objects = [], 0
+        for product in products_json:
+            content_hash, is_new = self.put_product(product)
+            products.append([product['id'], content_hash])
+            new_objects += is_new
+        return [products, new_objects]
+
+    def get_product(self, content_hash:str) -> dict:
+        with open(self.object_file(content_hash), 'rb') as file:
+            return json.loads(gzip.decompress(file.read()))
+
+    def build_manifest_filename(self, store_id:str) -> str:
+        return os.path.join(self.manifests_dir, f'{store_id} - Snapshot {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}.{REPOSITORY_MANIFEST_EXTENSION}')
+
+    def save_manifest(self, manifest_file:str, store_id:str, products:list, started_at:str|None=None) -> str:
+        # products holds the [product_id, content_hash] pairs of the snapshot
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        manifest = {
+            'version': REPOSITORY_VERSION,
+            'store_id': str(store_id),
+            'started_at': started_at,
+            'products': products
+        }
+        partial_file = f'{manifest_file}.part'
+        save_json_data(partial_file, manifest)
+        os.replace(partial_file, manifest_file)
+        return manifest_file
+
+    def load_manifest(self, manifest_file:str) -> dict:
+        with open(manifest_file, 'r') as file:
+            manifest = json.load(file)
+        if manifest.get('version') != REPOSITORY_VERSION:
+            raise ValueError(f'Unsupported snapshot manifest version {manifest.get("version")}: {manifest_file}')
+        return manifest
+
+    def iter_products(self, manifest_file:str, product_ids:set|None=None):
+        # Yields the product jsons of a snapshot, one object at a time. Optionally only the requested product ids
+        for product_id, content_hash in self.load_manifest(manifest_file)['products']:
+            if product_ids is None or product_id in product_ids:
+                yield self.get_product(content_hash)
+
+    def import_snapshot(self, snapshot_file:str, store_id:str) -> str:
+        # Adds an existing json or NDJSON snapshot to the repository, and returns its manifest
+        with self.lock():
+            products, new_objects = self.put_products(iter_json_items(snapshot_file))
+            manifest_file = self.save_manifest(self.build_manifest_filename(store_id), store_id, products)
+        CONSOLE.print(f"[bold green]Imported {len(products)} products ({new_objects} new objects): {manifest_file}[/bold green]")
+        return manifest_file
+
+    def collect_garbage(self, blocking:bool=False) -> int:
+        # Removes the objects no manifest refers to anymore, once old manifests have been deleted. Returns the amount removed
+        # Runs only while no snapshot is being written: without blocking, a busy repository raises BlockingIOError
+        with self.lock(exclusive=True, blocking=blocking):
+            referenced = set()
+            os.makedirs(self.manifests_dir, exist_ok=True)
+            os.makedirs(self._objects_dir, exist_ok=True)
+            for manifest_name in os.listdir(self.manifests_dir):
+                if self.is_manifest(manifest_name):
+                    referenced.update(content_hash for _, content_hash in self.load_manifest(os.path.join(self.manifests_dir, manifest_name))['products'])
+
+            removed = 0
+            for prefix in os.listdir(self._objects_dir):
+                for object_name in os.listdir(os.path.join(self._objects_dir, prefix)):
+                    # Partial files belong to writes in progress (or interrupted ones, which os.replace never completed)
+                    if object_name.endswith('.json.gz') and object_name.removesuffix('.json.gz') not in referenced:
+                        os.remove(os.path.join(self._objects_dir, prefix, object_name))
+                        removed += 1
+        CONSOLE.print(f"[bold green]Removed {removed} unreferenced objects[/bold green]")
+        return removed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintenance of a snapshot repository')
+    parser.add_argument('repository_dir')
+    parser.add_argument('--import-snapshot', default=None, help='json or NDJSON snapshot file to add to the repository')
+    parser.add_argument('--store-id', default=None, help='Store of the imported snapshot')
+    parser.add_argument('--collect-garbage', action='store_true', help='Remove the objects no manifest refers to')
+    args = parser.parse_args()
+
+    repository = SnapshotRepository(args.repository_dir)
+    if args.import_snapshot:
+        repository.import_snapshot(args.import_snapshot, args.store_id)
+    if args.collect_garbage:
+        try:
+            repository.collect_garbage()
+        except BlockingIOError:
+            CONSOLE.print(f"[bold red]A snapshot is being written into the repository, try again once it's done[/bold red]")
@@ -0,0 +1,89 @@
+import copy
+import numpy as np
+import pytest
+from benchmarks.catalog_factory import build_catalog
+from compact_catalog import CompactCatalog
+from diff_engine import build_catalog_frames, build_action_plan, IGNORE
+from pydantic_objects import PRODUCT_LIST_ADAPTER
+
+
+@pytest.fixture(scope='module')
+def products_json() -> list[dict]:
+    products_json = build_catalog(25, variants_per_product=2, seed=3)[::-1] # Not in id order
+    products_json[0]['variants'][0]['price'] = '' # Prices are kept as sent by the API, empty or not
+    products_json[1]['variants'][0]['price'] = None
+    products_json[2]['variants'][0]['updated_at'] = 'not a date'
+    products_json[3]['variants'][0]['price'] = 'N/A'
+    return products_json
+
+@pytest.fixture(scope='module')
+def catalog(products_json) -> CompactCatalog:
+    return CompactCatalog.from_json(products_json, batch_size=7)
+
+def test_columns(catalog, products_json):
+    assert len(catalog) == len(products_json)
+    assert catalog.product_ids.tolist() == [product['id'] for product in products_json]
+    assert catalog.variants_count == 2 * len(products_json)
+    variants_df = catalog.variants_frame()
+    assert variants_df['variant_id'].tolist() == [variant['id'] for product in products_json for variant in product['variants']]
+    assert variants_df['position'].tolist()[:2] == [1, 2]
+    # Prices that aren't numbers, and dates that can't be parsed, are kept as missing
+    assert variants_df['price'].isna().tolist()[:8] == [True, False, True, False, False, False, True, False]
+    assert variants_df['price'][1] == float(products_json[0]['variants'][1]['price'])
+    assert variants_df['stock'].dtype == np.float64 and variants_df['sku'][0] == products_json[0]['variants'][0]['sku'].encode()
+    assert variants_df['updated_at'].isna().tolist()[:6] == [False, False, False, False, True, False]
+    assert variants_df['updated_at'][0] == np.datetime64('2024-01-01T00:00:00')
+
+def test_products_round_trip(catalog, products_json):
+    assert list(catalog.iter_json()) == products_json
+    assert catalog.product_json(products_json[0]['id']) == products_json[0]
+    assert catalog.product_json(10 ** 6) is None and catalog.product(10 ** 6) is None
+
+    product = catalog.product(products_json[0]['id'])
+    assert product.variants[0].price == ''
+    assert product.fingerprint == PRODUCT_LIST_ADAPTER.validate_python(products_json[:1])[0].fingerprint
+
+def test_stored_fingerprints_are_reused(products_json):
+    fingerprints = {str(products_json[0]['id']): {'fingerprint': 'f' * 32, 'variants': {}}}
+    catalog = CompactCatalog.from_json(products_json, fingerprints)
+    assert catalog.product(products_json[0]['id']).fingerprint == 'f' * 32
+
+def test_frames_match_the_diff_engine(catalog, products_json):
+    products_df, variants_df = catalog.frames()
+    expected_products_df, expected_variants_df = build_catalog_frames(PRODUCT_LIST_ADAPTER.validate_python(products_json))
+    assert products_df.to_dict('records') == expected_products_df.to_dict('records')
+    assert variants_df[['product_id', 'variant_id']].to_dict('records') == expected_variants_df.to_dict('records')
+
+    plan = build_action_plan(catalog.frames(), catalog.frames())
+    assert set(plan['action']) == {IGNORE}
+
+def test_empty_catalog():
+    catalog = CompactCatalog.from_json([])
+    assert len(catalog) == 0 and catalog.variants_count == 0
+    assert catalog.product(1) is None
+    products_df, variants_df = catalog.frames()
+    assert products_df.empty and variants_df.empty
+    assert catalog.variants_frame()['updated_at'].dtype.kind == 'M' and catalog.variants_frame()['price'].dtype == np.float64
+    assert catalog.compare_variants(catalog).empty
+
+def test_compare_variants(catalog, products_json):
+    fetched_json = copy.deepcopy(products_json)
+    fetched_json[0]['variants'][0]['price'] = '10.00' # Was empty
+    fetched_json[1]['variants'][1]['stock'] = None # Now infinite
+    fetched_json[4]['variants'][0]['sku'] = 'OTHER'
+    fetched_json[5]['variants'][1]['updated_at'] = '2025-01-01T00:00:00+0000'
+    del fetched_json[6]['variants'][0] # Missing variants are left to the action plan
+    changes = catalog.compare_variants(CompactCatalog.from_json(fetched_json))
+
+    variant_ids = [products_json[0]['variants'][0]['id'], products_json[1]['variants'][1]['id'], products_json[4]['variants'][0]['id']]
+    assert changes['variant_id'].tolist() == variant_ids
+    assert changes[['price', 'stock', 'sku']].values.tolist() == [[True, False, False], [False, True, False], [False, False, True]]
+    # Missing on both sides, like the unparseable date of products_json[2], isn't a change
+    updated_changes = catalog.compare_variants(CompactCatalog.from_json(fetched_json), fields=('updated_at',))
+    assert updated_changes['variant_id'].tolist() == [products_json[5]['variants'][1]['id']]
+
+def test_compare_variants_with_a_product_listed_twice(catalog, products_json):
+    stale_copy = copy.deepcopy(products_json[0])
+    stale_copy['variants'][1]['stock'] += 1
+    changes = catalog.compare_variants(CompactCatalog.from_json([stale_copy] + products_json))
+    assert changes.empty # Matched against the last copy
@@ -0,0 +1,106 @@
+import copy
+import json
+import random
+import pytest
+from benchmarks.catalog_factory import build_catalog, build_variant
+from main import ExecutionManager
+from diff_engine import build_catalog_frames, build_raw_catalog_frames, build_action_plan, build_parallel_action_plan, IGNORE, PUT, POST
+from pydantic_objects import PRODUCT_LIST_ADAPTER
+
+
+def baseline_plan(read_json:list[dict], fetched_json:list[dict]) -> dict:
+    # The row by row comparison the diff engine replaced: products are compared on their PUT json,
+    # and the read variants missing from the fetched product are POSTed again
+    fetched_products = {product.id: product for product in PRODUCT_LIST_ADAPTER.validate_python(fetched_json)}
+    plan = dict()
+    for read_product in PRODUCT_LIST_ADAPTER.validate_python(read_json):
+        fetched_product = fetched_products.get(read_product.id)
+        if fetched_product is None:
+            plan[read_product.id] = (POST, [])
+        elif read_product.to_json('PUT') != fetched_product.to_json('PUT'):
+            fetched_variants = set(fetched_product.variants_list)
+            plan[read_product.id] = (PUT, [variant_id for variant_id in read_product.variants_list if variant_id not in fetched_variants])
+        else:
+            plan[read_product.id] = (IGNORE, [])
+    return plan
+
+def as_dict(plan) -> dict:
+    return {product_id: (action, sorted(missing)) for product_id, action, missing in plan[['product_id', 'action', 'missing_variant_ids']].itertuples(index=False)}
+
+@pytest.fixture(scope='module')
+def catalogs() -> list[list[dict]]:
+    # The fetched catalog is the read one after some products were deleted, edited, or had variants removed or added
+    read_json = build_catalog(60, variants_per_product=3, seed=1)
+    fetched_json = copy.deepcopy(read_json)
+    rng = random.Random(2)
+    del fetched_json[50:55]
+    fetched_json[0]['name']['es'] = 'Renamed'
+    fetched_json[1]['variants'][0]['stock'] += 1
+    del fetched_json[2]['variants'][1:]
+    fetched_json[3]['variants'].append(build_variant(4, 499, 4, rng))
+    fetched_json[4]['updated_at'] = '2025-01-01T00:00:00+0000' # Not part of the PUT json, so it's ignored
+    fetched_json[5]['categories'] = []
+    return [read_json, fetched_json]
+
+def test_baseline_fixture(catalogs):
+    plan = baseline_plan(*catalogs)
+    assert [plan[product_id] for product_id in (1, 2, 3, 4, 5, 6)] == [(PUT, []), (PUT, []), (PUT, [302, 303]), (PUT, []), (IGNORE, []), (PUT, [])]
+    assert {product_id for product_id, (action, _) in plan.items() if action == POST} == set(range(51, 56))
+
+def test_action_plan_matches_baseline(catalogs):
+    read_json, fetched_json = catalogs
+    read_frames = build_catalog_frames(PRODUCT_LIST_ADAPTER.validate_python(read_json))
+    fetched_frames = build_catalog_frames(PRODUCT_LIST_ADAPTER.validate_python(fetched_json))
+    assert as_dict(build_action_plan(read_frames, fetched_frames)) == baseline_plan(read_json, fetched_json)
+
+def test_raw_action_plan_matches_baseline(catalogs):
+    read_json, fetched_json = catalogs
+    plan = build_action_plan(build_raw_catalog_frames(read_json), build_raw_catalog_frames(fetched_json))
+    assert as_dict(plan) == baseline_plan(read_json, fetched_json)
+
+def test_parallel_action_plan_matches_baseline(catalogs):
+    read_json, fetched_json = catalogs
+    plan = build_parallel_action_plan(read_json, fetched_json, workers=2)
+    assert plan['product_id'].tolist() == [product['id'] for product in read_json]
+    assert as_dict(plan) == baseline_plan(read_json, fetched_json)
+
+def test_action_plan_of_an_empty_fetched_catalog(catalogs):
+    read_json, _ = catalogs
+    plan = build_action_plan(build_raw_catalog_frames(read_json), build_raw_catalog_frames([]))
+    assert set(plan['action']) == {POST}
+
+@pytest.fixture(scope='module')
+def repeated_catalogs(catalogs) -> list[list[dict]]:
+    # A page offset fetch lists product 2 twice: a stale copy with an extra variant, and the current one further on
+    read_json, fetched_json = catalogs
+    stale_copy = copy.deepcopy(read_json[1])
+    stale_copy['variants'].append(build_variant(2, 299, 3, random.Random(3)))
+    return [read_json, fetched_json[:1] + [stale_copy] + fetched_json[1:]]
+
+def test_repeated_fetched_products_keep_the_last_copy(catalogs, repeated_catalogs):
+    read_json, fetched_json = repeated_catalogs
+    expected = baseline_plan(*catalogs)
+    plan = build_action_plan(build_raw_catalog_frames(read_json), build_raw_catalog_frames(fetched_json))
+    assert len(plan) == len(read_json)
+    assert as_dict(plan) == expected
+    assert as_dict(build_parallel_action_plan(read_json, fetched_json, workers=2)) == expected
+
+@pytest.mark.parametrize('lazy, diff_workers', [(False, 1), (True, 1), (False, 2)])
+def test_restore_actions_with_repeated_fetched_products(tmp_path, catalogs, repeated_catalogs, lazy, diff_workers):
+    read_json, fetched_json = repeated_catalogs
+    snapshot_file = str(tmp_path / 'snapshot.json')
+    with open(snapshot_file, 'w', encoding='utf-8') as file:
+        json.dump(read_json, file)
+
+    execution_manager = ExecutionManager('1', 'token', diff_workers=diff_workers)
+    execution_manager.load_json_file(snapshot_file, lazy)
+    if lazy or diff_workers > 1: # Left for the diff processes to parse
+        assert execution_manager.read_products_dataframe['read_product_object'].tolist() == read_json
+    execution_manager._fetched_products_json = fetched_json
+    actions = execution_manager.build_actions_dataframe()
+
+    expected = {product_id: action for product_id, (action, _) in baseline_plan(*catalogs).items() if action != IGNORE}
+    assert dict(zip(actions['product_id'], actions['action'])) == expected
+    assert len(actions) == len(expected)
+    fetched_variant_ids = [variant['id'] for variant in actions.set_index('product_id').at[2, 'fetched_product_object'].to_json('PUT')['variants']]
+    assert fetched_variant_ids == [variant['id'] for variant in fetched_json[2]['variants']] # The last copy, without the stale variant
@@ -0,0 +1,41 @@
+import json
+import pytest
+from fastapi.testclient import TestClient
+import endpoint_poc
+from benchmarks.catalog_factory import build_catalog
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch) -> TestClient:
+    monkeypatch.setattr(endpoint_poc, 'UPLOAD_DIR', str(tmp_path))
+    return TestClient(endpoint_poc.app)
+
+def ndjson_upload(filename:str, products:list) -> tuple:
+    return (filename, ''.join(json.dumps(product) + '\n' for product in products), 'application/x-ndjson')
+
+def test_snapshot_diff(client):
+    old_products = build_catalog(5, variants_per_product=2, seed=6)
+    new_products = old_products[1:]
+    response = client.post('/snapshot-diff', files={'old_snapshot': ndjson_upload('old.ndjson', old_products),
+                                                    'new_snapshot': ndjson_upload('new.ndjson', new_products)})
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert records[0]['type'] == 'removed' and records[0]['product_id'] == 1
+
+@pytest.mark.parametrize('new_snapshot', [
+    ('new.ndjson', '{"id": 1, "name": ', 'application/x-ndjson'), # Cut short
+    ('new.ndjson', '[1, 2]\n', 'application/x-ndjson'), # Not products
+    ('new.json', b'\xff\xfe[]', 'application/json'), # Not UTF-8
+    ('new.isnap', b'not an indexed snapshot at all', 'application/octet-stream'),
+])
+def test_snapshot_diff_of_malformed_snapshots(client, new_snapshot):
+    old_snapshot = ndjson_upload('old.ndjson', build_catalog(2, variants_per_product=2, seed=6))
+    response = client.post('/snapshot-diff', files={'old_snapshot': old_snapshot, 'new_snapshot': new_snapshot})
+    assert response.status_code == 400
+    assert response.json()['detail'].startswith('The snapshots could not be compared')
+
+def test_snapshot_diff_checks_the_document_types(client, tmp_path):
+    old_snapshot = ndjson_upload('old.ndjson', build_catalog(2, variants_per_product=2, seed=6))
+    response = client.post('/snapshot-diff', files={'old_snapshot': old_snapshot, 'new_snapshot': ('new.txt', 'text', 'text/plain')})
+    assert response.status_code == 400 and response.json()['detail'] == 'Invalid document type'
+    assert list(tmp_path.iterdir()) == [] # Nothing was stored
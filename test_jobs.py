@@ -0,0 +1,29 @@
+import asyncio
+from jobs import JobManager, Job, QUEUED, RUNNING, FINISHED
+
+
+def test_batch_jobs_take_a_slot_of_every_store():
+    async def run() -> None:
+        jobs = JobManager(max_running_jobs=4, max_running_jobs_per_store=1)
+        release = asyncio.Event()
+
+        async def work(job:Job) -> None:
+            await release.wait()
+
+        store_job = jobs.submit('snapshot', '2', work)
+        batch_job = jobs.submit('batch-snapshot', 'batch', work, ['3', '2', '1'])
+        other_job = jobs.submit('snapshot', '4', work)
+        await asyncio.sleep(0.01)
+        assert [store_job.status, batch_job.status, other_job.status] == [RUNNING, QUEUED, RUNNING]
+        assert batch_job.store_ids == ['1', '2', '3']
+        assert jobs.list('3') == [batch_job] and jobs.list('batch') == [batch_job]
+
+        later_job = jobs.submit('snapshot', '1', work)
+        await asyncio.sleep(0.01)
+        assert later_job.status == QUEUED # Behind the batch, which holds store 1 already
+        release.set()
+        await asyncio.sleep(0.01)
+        assert [store_job.status, batch_job.status, later_job.status] == [FINISHED] * 3
+        await jobs.shutdown()
+
+    asyncio.run(run())
@@ -0,0 +1,64 @@
+import asyncio
+import time
+import pytest
+from main import RequestManager
+from metrics import Histogram, Metrics, endpoint_label
+
+CONSUMER_SECONDS:float = 0.05 # Time the consumer spends on every page
+
+
+def test_endpoint_label():
+    assert endpoint_label('/v1/123/products/456/variants') == '/v1/{id}/products/{id}/variants'
+    assert endpoint_label('/v1/123/products') == '/v1/{id}/products'
+
+def test_histogram():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+    assert histogram.cumulative_counts() == [[0.1, 1], [1.0, 3], [float('inf'), 4]]
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(1.0) == 1.0 # +Inf reports the last bound
+    assert Histogram((1.0,)).quantile(0.5) is None
+
+def test_metrics_reach_the_parent():
+    parent = Metrics()
+    metrics = Metrics(parent=parent)
+    metrics.observe_request('GET', '/v1/1/products', 429, 0.2, 10, 20)
+    metrics.count_retry('throttled')
+    with metrics.phase('parse'):
+        pass
+    for summary in (metrics.summary(), parent.summary()):
+        assert summary['requests_by_status'] == {'429': 1} and summary['throttled'] == 1
+        assert summary['retries'] == {'throttled': 1} and summary['phases']['parse']['runs'] == 1
+    assert 'snapshot_requests_total{method="GET",endpoint="/v1/{id}/products",status="429"} 1' in parent.render_prometheus()
+
+def test_timed_sections_only_count_the_timed_time():
+    metrics = Metrics()
+    with metrics.timed_sections('fetch') as timer:
+        with timer.timing():
+            time.sleep(0.01)
+        time.sleep(0.05)
+        with timer.timing():
+            time.sleep(0.01)
+    phase = metrics.summary()['phases']['fetch']
+    assert phase['runs'] == 1
+    assert 0.02 <= phase['seconds'] < 0.05
+
+@pytest.mark.parametrize('sharded', [False, True])
+def test_fetch_time_leaves_out_the_consumer(mock_api, sharded):
+    _, client_pool = mock_api(100, bucket_size=1000)
+    request_manager = RequestManager('1', 'token', progress_callback=lambda *args: None, client_pool=client_pool,
+                                     base_url='http://mock/v1', sharded_fetch=sharded)
+
+    async def consume() -> int:
+        products = 0
+        async for page_products in request_manager.iter_product_pages({'per_page': 10}):
+            products += len(page_products)
+            await asyncio.sleep(CONSUMER_SECONDS) # Writing the page somewhere, for instance
+        return products
+
+    start = time.perf_counter()
+    assert asyncio.run(consume()) == 100
+    elapsed = time.perf_counter() - start
+    fetch_seconds = request_manager.metrics.summary()['phases']['fetch']['seconds']
+    assert fetch_seconds < elapsed - 10 * CONSUMER_SECONDS * 0.9
@@ -0,0 +1,72 @@
+import pytest
+from fastapi.testclient import TestClient
+from benchmarks.catalog_factory import build_product, TIMESTAMP
+from benchmarks.mock_server import build_mock_app
+from pydantic_objects import Product
+
+PRODUCTS_URL:str = '/v1/1/products'
+
+
+@pytest.fixture
+def client() -> TestClient:
+    return TestClient(build_mock_app(40, variants_per_product=2, bucket_size=1000))
+
+def test_pages(client):
+    response = client.get(PRODUCTS_URL, params={'per_page': 15, 'page': 2})
+    assert [product['id'] for product in response.json()] == list(range(16, 31))
+    assert response.headers['x-total-count'] == '40'
+    assert 'page=3' in response.headers['link'] and 'per_page=15' in response.headers['link']
+    assert client.get(PRODUCTS_URL, params={'per_page': 15, 'page': 4}).status_code == 404
+
+def test_post_fills_the_server_fields(client):
+    payload = Product(**build_product(7, variants_per_product=2)).to_json('POST')
+    response = client.post(PRODUCTS_URL, json=payload)
+    assert response.status_code == 201
+
+    product = Product(**response.json()) # Writes come back in the same shape as reads
+    assert product.id == 41
+    assert [variant.position for variant in product.variants] == [1, 2]
+    assert all(variant.product_id == 41 and variant.created_at for variant in product.variants)
+    assert [category['id'] for category in response.json()['categories']] == payload['categories']
+    assert client.get(f'{PRODUCTS_URL}/41').json() == response.json()
+
+def test_put_keeps_the_created_fields(client):
+    product = Product(**client.get(f'{PRODUCTS_URL}/3').json())
+    payload = product.to_json('PUT')
+    payload['name']['es'] = 'Renamed'
+    response = client.put(f'{PRODUCTS_URL}/3', json=payload)
+    assert response.status_code == 200
+
+    updated = Product(**client.get(f'{PRODUCTS_URL}/3').json())
+    assert updated.name.es == 'Renamed'
+    assert updated.created_at == TIMESTAMP and updated.updated_at != TIMESTAMP
+    assert updated.categories_list == product.categories_list
+    assert [(variant.id, variant.position, variant.created_at) for variant in updated.variants] == \
+           [(variant.id, variant.position, variant.created_at) for variant in product.variants]
+    # The product can go through the same PUT again, as on a repeated restore
+    assert client.put(f'{PRODUCTS_URL}/3', json=updated.to_json('PUT')).status_code == 200
+
+def test_variant_writes(client):
+    response = client.post(f'{PRODUCTS_URL}/5/variants', json={'values': [{'es': 'New'}], 'price': '9.99'})
+    assert response.status_code == 201
+    variant = response.json()
+    assert (variant['id'], variant['product_id'], variant['position']) == (503, 5, 3)
+
+    response = client.patch(f'{PRODUCTS_URL}/5/variants', json=[{'id': 501, 'stock': 7}])
+    variants = {variant['id']: variant for variant in response.json()}
+    assert variants[501]['stock'] == 7 and variants[501]['position'] == 1 and variants[501]['created_at'] == TIMESTAMP
+    Product(**client.get(f'{PRODUCTS_URL}/5').json())
+
+def test_missing_products(client):
+    assert client.get(f'{PRODUCTS_URL}/99').status_code == 404
+    assert client.put(f'{PRODUCTS_URL}/99', json={}).status_code == 404
+    assert client.post(f'{PRODUCTS_URL}/99/variants', json={}).status_code == 404
+
+def test_rate_limit():
+    client = TestClient(build_mock_app(5, bucket_size=2, leak_rate=0.001))
+    statuses = [client.get(f'{PRODUCTS_URL}/1').status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+def test_mutate(client):
+    assert client.post('/_mock/mutate', params={'ratio': 0.5, 'seed': 1}).json() == {'changed': 15, 'deleted': 5}
+    assert client.get('/').json() == {'products': 35}
@@ -0,0 +1,130 @@
+import asyncio
+import httpx
+import pytest
+from request_pool import (AdaptiveLimiter, FairBudget, backoff_delay, retry_after, run_worker_pool, seconds_until_slots,
+                          DEFAULT_BACKOFF, MAX_BACKOFF)
+
+
+def rate_limit_headers(limit:int, remaining:int, reset_ms:int) -> dict:
+    return {'x-rate-limit-limit': str(limit), 'x-rate-limit-remaining': str(remaining), 'x-rate-limit-reset': str(reset_ms)}
+
+def test_seconds_until_slots():
+    assert seconds_until_slots(httpx.Headers(), 1) is None
+    assert seconds_until_slots(httpx.Headers(rate_limit_headers(40, 40, 0)), 1) == 0.0
+    # 40 used slots drain in 20 seconds, so 10 of them take 5
+    assert seconds_until_slots(httpx.Headers(rate_limit_headers(40, 0, 20000)), 10) == pytest.approx(5.0)
+
+def test_backoff_delay_is_capped(monkeypatch):
+    monkeypatch.setattr('random.uniform', lambda low, high: high)
+    assert backoff_delay(0) == DEFAULT_BACKOFF
+    assert backoff_delay(3) == DEFAULT_BACKOFF * 8
+    assert backoff_delay(50) == MAX_BACKOFF
+
+def test_retry_after():
+    assert retry_after(httpx.Response(429, headers={'retry-after': '3'})) == 3.0
+    assert retry_after(httpx.Response(429, headers={'retry-after': 'soon'})) == DEFAULT_BACKOFF
+    assert retry_after(httpx.Response(429, headers=rate_limit_headers(40, 0, 20000)), 4) == pytest.approx(2.0)
+
+def test_limiter_halves_on_429_and_grows_back():
+    limiter = AdaptiveLimiter(max_limit=8)
+    limiter.update_from_response(httpx.Response(429, headers={'retry-after': '0'}))
+    assert limiter.limit == 4
+    limiter.update_from_response(httpx.Response(200))
+    assert limiter.limit == 5
+    for _ in range(10):
+        limiter.update_from_response(httpx.Response(200))
+    assert limiter.limit == limiter.max_limit
+
+def test_limiter_shrinks_on_nearly_empty_bucket():
+    limiter = AdaptiveLimiter(max_limit=8, min_limit=7)
+    limiter.update_from_response(httpx.Response(200, headers=rate_limit_headers(40, 2, 1000)))
+    assert limiter.limit == 7
+    limiter.update_from_response(httpx.Response(200, headers=rate_limit_headers(40, 2, 1000)))
+    assert limiter.limit == 7 # Never below min_limit
+
+def test_limiter_caps_requests_in_flight():
+    async def run():
+        limiter, peak = AdaptiveLimiter(max_limit=3), 0
+
+        async def request():
+            nonlocal peak
+            async with limiter:
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(request() for _ in range(10)))
+        return limiter, peak
+
+    limiter, peak = asyncio.run(run())
+    assert peak == 3
+    assert limiter.in_flight == 0
+
+def test_limiter_cancelled_waiter_passes_its_wake_up_on():
+    async def run():
+        limiter = AdaptiveLimiter(max_limit=1)
+        await limiter.acquire()
+        first, second = asyncio.create_task(limiter.acquire()), asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release() # Wakes up the first waiter, which is cancelled before it runs
+        first.cancel()
+        await asyncio.wait_for(second, 1)
+        return limiter
+
+    assert asyncio.run(run()).in_flight == 1
+
+def test_fair_budget_round_robin():
+    async def run():
+        budget, order = FairBudget(limit=1), []
+        await budget.acquire('holder')
+
+        async def request(key):
+            async with budget.slot(key):
+                order.append(key)
+                await asyncio.sleep(0)
+
+        tasks = [asyncio.create_task(request(key)) for key in ('a', 'a', 'a', 'b', 'c')]
+        await asyncio.sleep(0)
+        budget.release()
+        await asyncio.gather(*tasks)
+        return budget, order
+
+    budget, order = asyncio.run(run())
+    assert order == ['a', 'b', 'c', 'a', 'a']
+    assert budget.in_flight == 0
+
+def test_fair_budget_cancelled_waiter_frees_its_slot():
+    async def run():
+        budget = FairBudget(limit=1)
+        await budget.acquire('a')
+        waiter = asyncio.create_task(budget.acquire('b'))
+        await asyncio.sleep(0)
+        budget.release() # Granted to the waiter, which is cancelled before it runs
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return budget
+
+    assert asyncio.run(run()).in_flight == 0
+
+def test_run_worker_pool():
+    async def run(items, workers):
+        handled, running, peak = [], 0, 0
+
+        async def handler(item):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0)
+            if item == 'boom':
+                raise ValueError(item)
+            handled.append(item)
+            running -= 1
+
+        await run_worker_pool(items, handler, workers)
+        return handled, peak
+
+    handled, peak = asyncio.run(run(range(20), 4))
+    assert sorted(handled) == list(range(20))
+    assert peak == 4
+    with pytest.raises(ValueError):
+        asyncio.run(run([1, 'boom', 2], 2))
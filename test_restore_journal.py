@@ -0,0 +1,115 @@
+import asyncio
+import json
+import httpx
+import pytest
+from main import RequestManager
+from restore_journal import RestoreJournal, step_outcome
+
+STORE_ID:str = '1'
+
+
+def done(status:int, method:str='PUT') -> dict:
+    return step_outcome('product_response', method, httpx.Response(status), 0.01)
+
+def chain(steps:int, method:str='PUT') -> list:
+    return [['product_response', method, [f'https://api.example/products/{step}', {'step': step}]] for step in range(steps)]
+
+@pytest.fixture
+def journal_file(tmp_path) -> str:
+    return str(tmp_path / 'restore.journal.ndjson')
+
+def test_load_picks_up_from_the_first_pending_step(journal_file):
+    with RestoreJournal(journal_file) as journal:
+        journal.write_plan(STORE_ID, {1: chain(3), 2: chain(2), 3: chain(1)})
+        journal.record_step(1, 0, done(200))
+        journal.record_step(1, 1, done(200))
+        journal.record_step(2, 0, done(500))
+    with open(journal_file, 'a', encoding='utf-8') as file:
+        file.write('{"type": "done", "product_id": 3, "st') # Cut short by the interruption
+
+    journal = RestoreJournal(journal_file)
+    store_id, job_chains, start_steps = journal.load()
+    assert store_id == STORE_ID
+    assert job_chains[1] == chain(3)
+    assert start_steps == {1: 2, 2: 0, 3: 0}
+    assert journal.summary.to_dict()['failed_products'] == 1
+
+def test_load_failed_only(journal_file):
+    with RestoreJournal(journal_file) as journal:
+        journal.write_plan(STORE_ID, {1: chain(2), 2: chain(2), 3: chain(1)})
+        journal.record_step(1, 0, done(200))
+        journal.record_step(1, 1, done(422))
+        journal.record_step(2, 0, done(500))
+        journal.record_step(2, 0, done(200)) # Replayed successfully afterwards
+
+    _, job_chains, start_steps = RestoreJournal(journal_file).load(failed_only=True)
+    assert list(job_chains) == [1]
+    assert start_steps == {1: 1}
+
+def test_load_in_doubt_steps(journal_file):
+    with RestoreJournal(journal_file) as journal:
+        journal.write_plan(STORE_ID, {1: chain(2, 'POST'), 2: chain(1, 'POST'), 3: chain(1, 'POST')})
+        journal.record_started(1, 0, 'POST')
+        journal.record_step(1, 0, done(201, 'POST'))
+        journal.record_started(1, 1, 'POST') # Sent, but the outcome was lost
+        journal.record_started(2, 0, 'POST')
+        journal.record_step(2, 0, done(500, 'POST'))
+
+    journal = RestoreJournal(journal_file)
+    _, job_chains, start_steps = journal.load(failed_only=True)
+    assert journal.in_doubt == {1: 1}
+    assert set(job_chains) == {1, 2}
+    assert start_steps == {1: 1, 2: 0}
+
+def test_resume_settles_in_doubt_posts(journal_file, mock_api):
+    app, client_pool = mock_api(10, variants_per_product=2)
+    request_manager = RequestManager(STORE_ID, 'token', progress_callback=lambda *args: None, client_pool=client_pool,
+                                     base_url='http://mock/v1')
+    url = request_manager.url
+    applied_variant, lost_variant = {'values': [{'es': 'Applied'}], 'price': '1.00'}, {'values': [{'es': 'Lost'}], 'price': '2.00'}
+    job_chains = {
+        3: [['variant_post_response', 'POST', [f'{url}/products/3/variants', applied_variant]],
+            ['variant_post_response', 'POST', [f'{url}/products/3/variants', {'values': [{'es': 'Next'}]}]]],
+        4: [['variant_post_response', 'POST', [f'{url}/products/4/variants', lost_variant]]],
+        5: [['product_response', 'POST', [f'{url}/products', {'name': {'es': 'Created'}, 'variants': []}]]],
+    }
+    with RestoreJournal(journal_file) as journal:
+        journal.write_plan(STORE_ID, job_chains)
+        for product_id in job_chains:
+            journal.record_started(product_id, 0, 'POST')
+
+    async def resume() -> dict:
+        async with request_manager.client_pool.borrow() as client:
+            await client.post(f'{url}/products/3/variants', json=applied_variant) # Reached the store before the interruption
+        await request_manager.resume_restore(journal_file)
+        async with request_manager.client_pool.borrow() as client:
+            return {product_id: [variant['values'][0]['es'] for variant in (await client.get(f'{url}/products/{product_id}')).json()['variants']]
+                    for product_id in (3, 4)}
+
+    variant_values = asyncio.run(resume())
+    assert variant_values[3].count('Applied') == 1 # Found on the store, so it wasn't sent again
+    assert variant_values[3][-1] == 'Next'
+    assert variant_values[4].count('Lost') == 1 # Never got to the store, so it was sent
+    assert len(app.state.store) == 10 # The in doubt product POST was skipped
+
+    journal = RestoreJournal(journal_file)
+    _, _, start_steps = journal.load()
+    assert start_steps == {3: 2, 4: 1, 5: 0}
+    assert journal.in_doubt == {5: 0}
+    with open(journal_file, 'r', encoding='utf-8') as file:
+        records = [json.loads(line) for line in file]
+    assert [record['resource_id'] for record in records if record['type'] == 'done' and record['product_id'] == 3][0] is not None
+
+def test_records_after_an_interrupted_write_are_kept(journal_file):
+    with RestoreJournal(journal_file) as journal:
+        journal.write_plan(STORE_ID, {7: chain(1), 8: chain(1, 'POST')})
+    with open(journal_file, 'a', encoding='utf-8') as file:
+        file.write('{"type": "done", "product_id": 7, "st') # Cut short by the interruption
+
+    with RestoreJournal(journal_file) as journal: # The resumed run
+        journal.record_started(8, 0, 'POST')
+
+    journal = RestoreJournal(journal_file)
+    _, _, start_steps = journal.load()
+    assert journal.in_doubt == {8: 0}
+    assert start_steps == {7: 0, 8: 0}
@@ -0,0 +1,104 @@
+import copy
+import json
+import random
+import pytest
+from auxiliary_functions import save_fingerprint_manifest, load_manifest_header
+from benchmarks.catalog_factory import build_catalog, build_variant
+import snapshot_diff
+from snapshot_diff import diff_snapshots, iter_in_id_order, iter_sorted_products, UnsortedSnapshotError
+
+
+def write_ndjson(snapshot_file, products:list) -> str:
+    with open(snapshot_file, 'w', encoding='utf-8') as file:
+        file.writelines(json.dumps(product) + '\n' for product in products)
+    return str(snapshot_file)
+
+def read_diff(output_file:str) -> list:
+    # Returns [diff records, summary record]
+    with open(output_file, 'r', encoding='utf-8') as file:
+        records = [json.loads(line) for line in file]
+    return [records[:-1], records[-1]]
+
+def changes_by_id(records:list[dict]) -> dict:
+    return {record['product_id']: record for record in records}
+
+@pytest.fixture(scope='module')
+def catalogs() -> list[list[dict]]:
+    old_products = build_catalog(50, variants_per_product=2, seed=4)
+    new_products = copy.deepcopy(old_products)
+    new_products[0]['name']['es'] = 'Renamed'
+    new_products[1]['variants'][0]['price'] = '' # Prices are compared as sent by the API
+    new_products[2]['variants'].pop()
+    new_products[3]['variants'].append(build_variant(4, 499, 3, random.Random(0)))
+    new_products[4]['updated_at'] = '2025-01-01T00:00:00+0000' # Ignored by default
+    del new_products[10]
+    new_products.append(build_catalog(51, variants_per_product=2, seed=4)[-1])
+    return [old_products, new_products]
+
+def assert_expected_diff(records:list[dict], summary:dict) -> None:
+    changes = changes_by_id(records)
+    assert [record['product_id'] for record in records] == sorted(changes)
+    assert {product_id: record['type'] for product_id, record in changes.items()} == {1: 'changed', 2: 'changed', 3: 'changed', 4: 'changed',
+                                                                                      11: 'removed', 51: 'added'}
+    assert changes[1]['fields'] == {'name': [changes[1]['fields']['name'][0], {**changes[1]['fields']['name'][0], 'es': 'Renamed'}]}
+    assert changes[2]['variants_changed'][0]['variant_id'] == 201
+    assert changes[2]['variants_changed'][0]['fields']['price'][1] == ''
+    assert changes[3]['variants_removed'] == [302] and changes[4]['variants_added'] == [499]
+    assert changes[11]['product']['id'] == 11 and changes[51]['product']['id'] == 51
+    assert {key: summary[key] for key in ('added', 'removed', 'changed', 'variants_added', 'variants_removed', 'variants_changed')} == \
+           {'added': 1, 'removed': 1, 'changed': 4, 'variants_added': 1, 'variants_removed': 1, 'variants_changed': 1}
+
+def test_diff_in_id_order(tmp_path, catalogs):
+    old_file, new_file = write_ndjson(tmp_path / 'old.ndjson', catalogs[0]), write_ndjson(tmp_path / 'new.ndjson', catalogs[1])
+    output_file, summary = diff_snapshots(old_file, new_file, str(tmp_path / 'diff.ndjson'))
+    records, last_record = read_diff(output_file)
+    assert last_record == summary
+    assert_expected_diff(records, summary)
+
+def test_diff_across_formats_and_timestamps(tmp_path, catalogs):
+    old_file = str(tmp_path / 'old.json')
+    with open(old_file, 'w', encoding='utf-8') as file:
+        json.dump(catalogs[0], file)
+    new_file = write_ndjson(tmp_path / 'new.ndjson', catalogs[1])
+    records, summary = read_diff(diff_snapshots(old_file, new_file, str(tmp_path / 'diff.ndjson'), ignored_fields=())[0])
+    assert changes_by_id(records)[5]['fields'] == {'updated_at': [catalogs[0][4]['updated_at'], '2025-01-01T00:00:00+0000']}
+    assert summary['changed'] == 5
+
+def test_unsorted_snapshot_is_sorted_externally(tmp_path, catalogs):
+    shuffled = catalogs[1][:]
+    random.Random(1).shuffle(shuffled)
+    old_file, new_file = write_ndjson(tmp_path / 'old.ndjson', catalogs[0]), write_ndjson(tmp_path / 'new.ndjson', shuffled)
+    with pytest.raises(UnsortedSnapshotError):
+        list(iter_in_id_order(new_file))
+
+    output_file, summary = diff_snapshots(old_file, new_file, str(tmp_path / 'diff.ndjson'), run_size=8) # Several runs on disk
+    assert_expected_diff(read_diff(output_file)[0], summary)
+
+def test_manifest_picks_the_external_sort_up_front(tmp_path, catalogs, monkeypatch):
+    shuffled = catalogs[1][:]
+    random.Random(2).shuffle(shuffled)
+    old_file, new_file = write_ndjson(tmp_path / 'old.ndjson', catalogs[0]), write_ndjson(tmp_path / 'new.ndjson', shuffled)
+    save_fingerprint_manifest(new_file, {str(product['id']): None for product in shuffled})
+    save_fingerprint_manifest(old_file, {str(product['id']): None for product in catalogs[0]})
+    assert load_manifest_header(new_file)['sorted_by_id'] is False
+    assert load_manifest_header(old_file)['sorted_by_id'] is True
+
+    checked_files = []
+    monkeypatch.setattr(snapshot_diff, 'iter_in_id_order', lambda snapshot_file: checked_files.append(snapshot_file) or iter_in_id_order(snapshot_file))
+    output_file, summary = diff_snapshots(old_file, new_file, str(tmp_path / 'diff.ndjson'))
+    assert checked_files == [old_file] # The new snapshot never goes through the in order attempt
+    assert_expected_diff(read_diff(output_file)[0], summary)
+
+def test_duplicated_products_keep_the_last_copy(tmp_path, catalogs):
+    old_products, new_products = catalogs
+    stale_copy = copy.deepcopy(new_products[0])
+    stale_copy['name']['es'] = 'Stale'
+    # A page offset fetch over a changing catalog can store the same product twice, in or out of order
+    in_order = old_products[:1] + old_products[:6] + old_products[6:]
+    out_of_order = [stale_copy] + new_products[5:] + new_products[:5]
+    old_file, new_file = write_ndjson(tmp_path / 'old.ndjson', in_order), write_ndjson(tmp_path / 'new.ndjson', out_of_order)
+    assert [product_id for product_id, _ in iter_in_id_order(old_file)] == [product['id'] for product in old_products]
+    assert [product_id for product_id, _ in iter_sorted_products(new_file, run_size=8)] == sorted(product['id'] for product in new_products)
+
+    output_file, summary = diff_snapshots(old_file, new_file, str(tmp_path / 'diff.ndjson'), run_size=8)
+    assert_expected_diff(read_diff(output_file)[0], summary)
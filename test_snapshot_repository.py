@@ -0,0 +1,51 @@
+import asyncio
+import os
+import pytest
+from auxiliary_functions import canonical_bytes, canonical_hash
+from benchmarks.catalog_factory import build_catalog
+from main import ExecutionManager
+from snapshot_repository import SnapshotRepository
+
+STORE_ID:str = '1'
+
+
+@pytest.fixture
+def repository(tmp_path) -> SnapshotRepository:
+    return SnapshotRepository(str(tmp_path / 'repository'))
+
+def test_identical_products_are_stored_once(repository):
+    products_json = build_catalog(5, variants_per_product=2, seed=5)
+    reordered = {key: products_json[0][key] for key in reversed(products_json[0])}
+    pairs, new_objects = repository.put_products(products_json + [reordered])
+    assert new_objects == 5
+    assert pairs[0][1] == pairs[-1][1] == canonical_hash(products_json[0])
+    assert repository.get_product(pairs[0][1]) == products_json[0]
+    assert canonical_bytes(reordered) == canonical_bytes(products_json[0])
+
+def test_garbage_collection(repository):
+    products_json = build_catalog(4, variants_per_product=2, seed=5)
+    pairs, _ = repository.put_products(products_json)
+    manifest_file = repository.save_manifest(repository.build_manifest_filename(STORE_ID), STORE_ID, pairs[:2])
+    object_dir = os.path.dirname(repository.object_file(pairs[0][1]))
+    partial_file = os.path.join(object_dir, 'f' * 32 + '.json.gz.123.part') # A write in progress
+    open(partial_file, 'wb').close()
+
+    assert repository.collect_garbage() == 2
+    assert os.path.exists(partial_file)
+    assert list(repository.iter_products(manifest_file)) == products_json[:2]
+
+def test_garbage_collection_waits_for_writers(repository):
+    repository.put_products(build_catalog(2, variants_per_product=2, seed=5)) # No manifest refers to them yet
+    with repository.lock():
+        with pytest.raises(BlockingIOError):
+            repository.collect_garbage()
+    assert repository.collect_garbage() == 2
+
+def test_snapshot_into_the_repository(tmp_path, mock_api):
+    _, client_pool = mock_api(30, variants_per_product=2, bucket_size=1000)
+    execution_manager = ExecutionManager(STORE_ID, 'token', progress_callback=lambda *args: None, client_pool=client_pool,
+                                         base_url='http://mock/v1')
+    repository = SnapshotRepository(str(tmp_path / 'repository'))
+    manifest_file = asyncio.run(execution_manager.save_repository_snapshot_async(repository.root_dir))
+    assert [product['id'] for product in repository.iter_products(manifest_file)] == list(range(1, 31))
+    assert repository.collect_garbage() == 0